@@ -0,0 +1,126 @@
+# coding: utf-8
+"""
+接口响应缓存
+
+响应按(模型, 主键, 版本, 查询参数)缓存。SavePipeline写入对象后更新其版本，
+旧版本的缓存不再被读取，直到过期。展开的关联(`?expand=`)的内容来自其他模型，
+因此每个模型还有一个代数(generation)，该模型有任何写入时更新，
+缓存键中包含所有展开模型的代数。
+
+爬虫与接口通常是不同的进程，需要使用进程间共享的缓存(默认为SQLite文件，
+见`API_CACHE`及`cache_backend.SQLiteCache`)，进程内缓存无法接收爬虫的失效通知。
+"""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import hashlib
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+from movie_crawler.store.douban.models import Movie, Celebrity, Genre, Tag, Area, Company
+
+
+# 缓存的模型：版本(主键)及代数在写入后更新
+CACHED_MODELS = (Movie, Celebrity, Genre, Tag, Area, Company)
+
+
+def _label(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.model_name)
+
+
+class ResponseCache(object):
+    """
+    带版本的响应缓存，同一个键同时未命中时只构建一次
+    """
+
+    def __init__(self, alias=None, timeout=None):
+        self.alias = alias or getattr(settings, 'API_CACHE', 'default')
+        self.timeout = timeout or getattr(settings, 'API_CACHE_TIMEOUT', 3600)
+        self._cache = None
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = get_cache(self.alias)
+        return self._cache
+
+    def make_key(self, model, pk, params, expanded_models=()):
+        """
+        缓存键，`params`为影响响应内容的查询参数
+        """
+        version_key = self._version_key(model, pk)
+        generation_keys = [self._generation_key(related) for related in sorted(expanded_models, key=_label)]
+        values = self.cache.get_many([version_key] + generation_keys)
+        parts = [_label(model), '%s' % pk]
+        for key in [version_key] + generation_keys:
+            value = values.get(key)
+            if value is None:
+                # 版本不存在(第一次请求或已被清除)时生成一个新版本
+                self.cache.add(key, uuid.uuid4().hex, None)
+                value = self.cache.get(key)
+            parts.append('%s' % value)
+        parts.extend('%s=%s' % (name, params[name]) for name in sorted(params))
+        return 'api:response:' + hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def etag(self, key):
+        return '"%s"' % key.rsplit(':', 1)[-1]
+
+    def get_or_build(self, key, build):
+        """
+        返回缓存的值，未命中时调用`build`构建并缓存
+        """
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+        with self._single_flight(key):
+            # 等待期间其他线程可能已经构建完成
+            value = self.cache.get(key)
+            if value is None:
+                value = build()
+                self.cache.set(key, value, self.timeout)
+        return value
+
+    def invalidate(self, model, pks):
+        """
+        更新对象的版本及模型的代数，返回失效的对象数
+        """
+        if model not in CACHED_MODELS:
+            return 0
+        pks = list(pks)
+        versions = dict((self._version_key(model, pk), uuid.uuid4().hex) for pk in pks)
+        versions[self._generation_key(model)] = uuid.uuid4().hex
+        self.cache.set_many(versions, None)
+        return len(pks)
+
+    def _version_key(self, model, pk):
+        return 'api:version:%s:%s' % (_label(model), pk)
+
+    def _generation_key(self, model):
+        return 'api:generation:%s' % _label(model)
+
+    @contextmanager
+    def _single_flight(self, key):
+        with self._locks_lock:
+            lock, waiters = self._locks.get(key, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._locks[key] = (lock, waiters + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._locks_lock:
+                lock, waiters = self._locks[key]
+                if waiters == 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = (lock, waiters - 1)
+
+
+response_cache = ResponseCache()
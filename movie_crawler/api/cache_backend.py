@@ -0,0 +1,156 @@
+# coding: utf-8
+"""
+基于SQLite的Django缓存后端
+
+FileBasedCache每次写入都会遍历整个缓存目录统计条目数(`_cull`)，
+条目越多写入越慢。这里所有条目保存在一个SQLite文件中，按主键读写，
+过期条目每`CULL_EVERY`次写入才清理一次(超过`MAX_ENTRIES`时按写入顺序淘汰)，
+写入的代价与条目数无关。
+WAL模式下多个进程(爬虫及接口)可以同时读写：
+
+    'api': {
+        'BACKEND': 'movie_crawler.api.cache_backend.SQLiteCache',
+        'LOCATION': '/path/to/api_cache.sqlite',
+        'OPTIONS': {'MAX_ENTRIES': 100000, 'CULL_EVERY': 1000},
+    }
+"""
+
+from __future__ import unicode_literals
+
+import cPickle as pickle
+import os
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS cache ("
+    "key TEXT PRIMARY KEY, value BLOB, expires REAL)",
+    "CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)",
+]
+
+
+class SQLiteCache(BaseCache):
+    """
+    条目保存在`LOCATION`指定的SQLite文件中，每个线程使用自己的连接，
+    请求结束时不关闭(BaseCache.close)，避免每个请求重新连接
+    """
+
+    def __init__(self, location, params):
+        BaseCache.__init__(self, params)
+        self.location = location
+        options = params.get('OPTIONS', {})
+        self._cull_every = int(options.get('CULL_EVERY', 1000))
+        self._sets = 0
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.location)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            conn = sqlite3.connect(self.location, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self.conn:
+            # 已过期的条目视为不存在
+            self.conn.execute("DELETE FROM cache WHERE key = ? AND expires <= ?", (key, time.time()))
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO cache VALUES (?, ?, ?)", self._row(key, value, timeout)
+            )
+        return cursor.rowcount == 1
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._get_many([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = dict((self.make_key(key, version=version), key) for key in keys)
+        for key in keys:
+            self.validate_key(key)
+        return dict((keys[key], value) for key, value in self._get_many(list(keys)).items())
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        rows = []
+        for key, value in data.items():
+            key = self.make_key(key, version=version)
+            self.validate_key(key)
+            rows.append(self._row(key, value, timeout))
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", rows)
+        self._sets += len(rows)
+        if self._sets >= self._cull_every:
+            self._sets = 0
+            self._cull()
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_key(key, version=version) for key in keys]
+        with self.conn:
+            self.conn.executemany("DELETE FROM cache WHERE key = ?", [(key,) for key in keys])
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key in self._get_many([key])
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM cache")
+
+    def _row(self, key, value, timeout):
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        expires = None if timeout is None else time.time() + timeout
+        return key, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)), expires
+
+    def _get_many(self, keys):
+        values = {}
+        now = time.time()
+        # SQLite每个语句最多999个参数
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.conn.execute(
+                "SELECT key, value, expires FROM cache WHERE key IN (%s)" % ', '.join('?' * len(chunk)), chunk
+            )
+            for key, value, expires in rows:
+                if expires is None or expires > now:
+                    values[key] = pickle.loads(bytes(value))
+        return values
+
+    def _cull(self):
+        """
+        删除过期的条目，仍超过`MAX_ENTRIES`时再删除最早写入的条目，
+        包括不过期的条目(如ResponseCache的版本号，被删除后只是重新生成)，
+        直到剩下MAX_ENTRIES的(1 - 1/CULL_FREQUENCY)
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+            count, = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+            if count > self._max_entries:
+                keep = self._max_entries - (self._max_entries // self._cull_frequency if self._cull_frequency else 0)
+                # INSERT OR REPLACE会分配新的rowid，rowid的顺序即写入顺序
+                self.conn.execute(
+                    "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY rowid LIMIT ?)",
+                    (count - keep,)
+                )
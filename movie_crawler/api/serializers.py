@@ -0,0 +1,189 @@
+# coding: utf-8
+"""
+电影/艺人接口的Serializer
+
+- `?fields=id,title,stars` 只返回指定的字段
+- `?expand=stars,genres` 关联字段返回对象摘要而不是ID列表
+
+关联字段默认返回ID列表，ID直接从ManyToMany中间表读取，不关联目标表；
+展开的关联按目标模型合并，每个模型只查询一次摘要字段。
+一次请求的查询数只与选择的关联字段数有关，与关联对象的数量无关。
+"""
+
+from __future__ import unicode_literals
+
+from rest_framework import serializers
+
+from movie_crawler.store.douban.models import Movie, Celebrity, Genre, Tag, Area, Company
+
+
+# SQLite单条语句最多999个参数
+QUERY_CHUNK_SIZE = 900
+
+
+def get_param_list(request, name):
+    if request is None:
+        return []
+    return [value.strip() for value in request.QUERY_PARAMS.get(name, '').split(',') if value.strip()]
+
+
+class MovieBriefSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Movie
+        fields = ('id', 'title', 'year', 'rating')
+
+
+class CelebrityBriefSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Celebrity
+        fields = ('id', 'name', 'name_en')
+
+
+class GenreSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Genre
+        fields = ('id', 'title')
+
+
+class TagSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Tag
+        fields = ('id', 'title')
+
+
+class AreaSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Area
+        fields = ('id', 'name')
+
+
+class CompanyBriefSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Company
+        fields = ('id', 'name', 'name_en')
+
+
+# 展开关联时，各目标模型使用的摘要Serializer
+BRIEF_SERIALIZERS = {
+    Movie: MovieBriefSerializer,
+    Celebrity: CelebrityBriefSerializer,
+    Genre: GenreSerializer,
+    Tag: TagSerializer,
+    Area: AreaSerializer,
+    Company: CompanyBriefSerializer,
+}
+
+
+class RelationField(serializers.Field):
+    """
+    ManyToMany关联：默认为ID列表，展开时为摘要列表。
+    数据由`load_relations`预先载入到对象的`_relation_ids`及`_related_objects`中
+    """
+
+    def __init__(self, model_field, *args, **kwargs):
+        super(RelationField, self).__init__(*args, **kwargs)
+        self.model_field = model_field
+        self.related_model = model_field.rel.to
+        self.expanded = False
+
+    def field_to_native(self, obj, field_name):
+        ids = obj._relation_ids.get(field_name, [])
+        if not self.expanded:
+            return ids
+        related = obj._related_objects.get(self.related_model, {})
+        serializer = BRIEF_SERIALIZERS[self.related_model]([related[pk] for pk in ids if pk in related], many=True)
+        return serializer.data
+
+
+class ProjectionSerializer(serializers.ModelSerializer):
+    """
+    按`?fields=`选择字段、按`?expand=`展开关联的ModelSerializer
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ProjectionSerializer, self).__init__(*args, **kwargs)
+        request = self.context.get('request')
+        selected = get_param_list(request, 'fields')
+        expand = get_param_list(request, 'expand')
+        fields = self.fields
+        if selected:
+            for name in list(fields):
+                if name not in selected and name not in expand:
+                    fields.pop(name)
+        for name in expand:
+            field = fields.get(name)
+            if isinstance(field, RelationField) and field.related_model in BRIEF_SERIALIZERS:
+                field.expanded = True
+
+    def get_related_field(self, model_field, related_model, to_many):
+        if to_many and model_field is not None:
+            return RelationField(model_field)
+        return super(ProjectionSerializer, self).get_related_field(model_field, related_model, to_many)
+
+    def get_relation_fields(self):
+        return dict((name, field) for name, field in self.fields.items() if isinstance(field, RelationField))
+
+    def get_expanded_models(self):
+        return set(field.related_model for field in self.get_relation_fields().values() if field.expanded)
+
+    def get_selected_columns(self):
+        """
+        需要从主表读取的字段，用于QuerySet.only
+        """
+        opts = self.opts.model._meta
+        concrete = set(field.name for field in opts.fields)
+        return [opts.pk.name] + [name for name in self.fields if name in concrete and name != opts.pk.name]
+
+
+class MovieSerializer(ProjectionSerializer):
+    class Meta:
+        model = Movie
+
+
+class CelebritySerializer(ProjectionSerializer):
+    class Meta:
+        model = Celebrity
+
+
+def _chunks(values, size=QUERY_CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def load_relations(objects, relation_fields):
+    """
+    批量载入对象的关联：每个关联字段查询一次中间表，
+    展开的关联按目标模型合并后每个模型查询一次
+    """
+    objects = list(objects)
+    for obj in objects:
+        obj._relation_ids = {}
+        obj._related_objects = {}
+    if not objects or not relation_fields:
+        return
+
+    by_pk = dict((obj.pk, obj) for obj in objects)
+    expanded_ids = {}
+    for name, field in relation_fields.items():
+        model_field = field.model_field
+        through = model_field.rel.through
+        source, target = model_field.m2m_field_name(), model_field.m2m_reverse_field_name()
+        for obj in objects:
+            obj._relation_ids[name] = []
+        for chunk in _chunks(by_pk):
+            rows = through.objects.filter(**{'%s__in' % source: chunk}).order_by('pk').values_list(source, target)
+            for source_id, target_id in rows:
+                by_pk[source_id]._relation_ids[name].append(target_id)
+        if field.expanded:
+            ids = expanded_ids.setdefault(field.related_model, set())
+            for obj in objects:
+                ids.update(obj._relation_ids[name])
+
+    for model, ids in expanded_ids.items():
+        related = {}
+        columns = BRIEF_SERIALIZERS[model].Meta.fields
+        for chunk in _chunks(ids):
+            related.update((obj.pk, obj) for obj in model.objects.filter(pk__in=chunk).only(*columns))
+        for obj in objects:
+            obj._related_objects[model] = related
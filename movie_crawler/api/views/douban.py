@@ -1,20 +1,159 @@
 # coding: utf-8
 from __future__ import unicode_literals
 
-from rest_framework.generics import RetrieveAPIView
+from collections import OrderedDict
+import json
 
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.generics import GenericAPIView, RetrieveAPIView
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from movie_crawler.api.cache import response_cache
+from movie_crawler.api.serializers import CelebritySerializer, MovieSerializer, get_param_list, load_relations
 from movie_crawler.store.douban.models import Movie, Celebrity
 
 
-class MovieAPIView(RetrieveAPIView):
+class ProjectionMixin(object):
+    """
+    只读取`?fields=`选择的列，并在序列化前批量载入关联
+    """
+
+    def get_queryset(self):
+        queryset = super(ProjectionMixin, self).get_queryset()
+        serializer = self.get_serializer_class()(context=self.get_serializer_context())
+        return queryset.only(*serializer.get_selected_columns())
+
+    def get_serializer(self, instance=None, *args, **kwargs):
+        serializer = super(ProjectionMixin, self).get_serializer(instance, *args, **kwargs)
+        if instance is not None:
+            load_relations(instance if kwargs.get('many') else [instance], serializer.get_relation_fields())
+        return serializer
+
+
+class CachedResponseMixin(object):
+    """
+    按(主键, 版本, 查询参数)缓存响应，并支持`If-None-Match`条件请求。
+    对象写入后版本改变(见`movie_crawler.api.cache`)，缓存及ETag随之失效
+    """
+    cache_params = ('fields', 'expand')
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        serializer = self.get_serializer_class()(context=self.get_serializer_context())
+        params = dict(
+            (name, ','.join(sorted(get_param_list(request, name))))
+            for name in self.cache_params
+        )
+        key = response_cache.make_key(self.model, pk, params, serializer.get_expanded_models())
+        etag = response_cache.etag(key)
+        if etag in self.get_request_etags(request):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        def build():
+            # 对象不存在时抛出Http404，不会被缓存
+            return super(CachedResponseMixin, self).retrieve(request, *args, **kwargs).data
+
+        return Response(response_cache.get_or_build(key, build), headers={'ETag': etag})
+
+    def get_request_etags(self, request):
+        header = request.META.get('HTTP_IF_NONE_MATCH', '')
+        etags = [etag.strip() for etag in header.split(',')]
+        return [etag[2:] if etag.startswith('W/') else etag for etag in etags if etag]
+
+
+class MovieAPIView(CachedResponseMixin, ProjectionMixin, RetrieveAPIView):
     """
     `电影`接口
     """
     model = Movie
+    serializer_class = MovieSerializer
 
 
-class CelebrityAPIView(RetrieveAPIView):
+class CelebrityAPIView(CachedResponseMixin, ProjectionMixin, RetrieveAPIView):
     """
     `艺人`接口
     """
     model = Celebrity
+    serializer_class = CelebritySerializer
+
+
+class MovieBulkAPIView(ProjectionMixin, GenericAPIView):
+    """
+    批量获取`电影`，以NDJSON(每行一个JSON对象)流式返回
+
+    - `?ids=1,2,3` 或 POST `{"ids": [1, 2, 3]}`，最多`API_BULK_MAX_IDS`个，按请求的顺序返回
+    - `?min_id=1&max_id=1000` 主键范围(含两端，可只给一端)，按主键顺序返回
+
+    对象按`API_BULK_CHUNK_SIZE`分块读取，每块的关联由`load_relations`批量载入，
+    内存占用与请求的数量无关。不存在的ID直接跳过。同样支持`?fields=`及`?expand=`
+    """
+    model = Movie
+    serializer_class = MovieSerializer
+    content_type = 'application/x-ndjson'
+
+    def get(self, request, *args, **kwargs):
+        params = request.QUERY_PARAMS
+        if 'min_id' in params or 'max_id' in params:
+            min_id = self.parse_id(params.get('min_id') or 0)
+            max_id = self.parse_id(params['max_id']) if params.get('max_id') else None
+            return self.stream(self.iter_range(min_id, max_id))
+        return self.stream(self.iter_ids(self.parse_ids(get_param_list(request, 'ids'))))
+
+    def post(self, request, *args, **kwargs):
+        ids = request.DATA.get('ids') if hasattr(request.DATA, 'get') else None
+        if not isinstance(ids, (list, tuple)):
+            raise ParseError('`ids` must be a list')
+        return self.stream(self.iter_ids(self.parse_ids(ids)))
+
+    @property
+    def chunk_size(self):
+        return getattr(settings, 'API_BULK_CHUNK_SIZE', 500)
+
+    def parse_id(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ParseError('Invalid id: %r' % (value,))
+
+    def parse_ids(self, values):
+        if not values:
+            raise ParseError('Either `ids` or `min_id`/`max_id` is required')
+        max_ids = getattr(settings, 'API_BULK_MAX_IDS', 10000)
+        if len(values) > max_ids:
+            raise ParseError('At most %d ids per request' % max_ids)
+        return list(OrderedDict.fromkeys(self.parse_id(value) for value in values))
+
+    def iter_ids(self, ids):
+        queryset = self.get_queryset()
+        for i in range(0, len(ids), self.chunk_size):
+            chunk = ids[i:i + self.chunk_size]
+            objects = queryset.in_bulk(chunk)
+            yield [objects[pk] for pk in chunk if pk in objects]
+
+    def iter_range(self, min_id, max_id):
+        # 按主键翻页，不使用OFFSET
+        queryset = self.get_queryset().filter(pk__gte=min_id).order_by('pk')
+        if max_id is not None:
+            queryset = queryset.filter(pk__lte=max_id)
+        last_pk = None
+        while True:
+            chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            chunk = list(chunk[:self.chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last_pk = chunk[-1].pk
+
+    def stream(self, chunks):
+        return StreamingHttpResponse(self.render(chunks), content_type=self.content_type)
+
+    def render(self, chunks):
+        for chunk in chunks:
+            if not chunk:
+                continue
+            serializer = self.get_serializer(chunk, many=True)
+            yield ''.join(json.dumps(data, cls=JSONEncoder) + '\n' for data in serializer.data)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+为已有的数据表加入模型中新增的字段。
+syncdb不会修改已存在的表，升级后(如艺人及评论新增的update_time)
+需要用这个命令补上，已存在的字段会被跳过：
+
+    scrapy addcolumns
+    scrapy addcolumns --sql
+"""
+
+from __future__ import unicode_literals
+
+from django.db import DatabaseError, connections, router, transaction
+from scrapy.command import ScrapyCommand
+
+from movie_crawler.store.columns import get_add_column_sql, get_missing_columns
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Add the model fields missing from existing database tables"
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("--sql", action="store_true",
+                          help="only print the ALTER TABLE statements")
+
+    def run(self, args, opts):
+        added = failed = 0
+        for model, field in get_missing_columns():
+            alias = router.db_for_write(model)
+            if not field.null:
+                print("Skip %s.%s: NOT NULL columns need a manual migration" % (model._meta.db_table, field.column))
+                continue
+            statement = get_add_column_sql(model, field)
+            if opts.sql:
+                print("-- %s\n%s" % (alias, statement))
+                continue
+            try:
+                with transaction.atomic(using=alias):
+                    connections[alias].cursor().execute(statement)
+            except DatabaseError as e:
+                failed += 1
+                print("[%s] %s: %s" % (alias, model._meta.db_table, e))
+            else:
+                added += 1
+                print("[%s] %s" % (alias, statement))
+        if not opts.sql:
+            print("Added %d columns, %d failed" % (added, failed))
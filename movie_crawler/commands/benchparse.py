@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+爬虫回调解析性能测试
+
+使用`movie_crawler/tests/*/html`中的页面反复执行各爬虫回调，统计
+每页耗时、每秒页数以及内存峰值，结果可保存为JSON，
+并与之前的结果比较，作为性能回归检查：
+
+    scrapy benchparse -n 50 -o bench.json
+    scrapy benchparse --baseline bench.json --threshold 0.2
+
+内存峰值在一个新的子进程中测量：子进程载入页面后执行一次回调，
+取执行前后ru_maxrss(进程的内存峰值，只增不减)的差。在同一个进程中
+测量时峰值早已被之前的回调推高，差值总是接近0。
+Python 2.7没有tracemalloc，因此不统计内存分配次数。
+"""
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+from scrapy.command import ScrapyCommand
+from scrapy.http import HtmlResponse, TextResponse, Request
+from scrapy.item import BaseItem
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from movie_crawler.items import douban, mtime
+
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'tests')
+
+MTIME_RATING_BODY = (
+    'var result_20148715112823067 = { "value":{"isRelease":true,"movieRating":{"MovieId":12135,'
+    '"RatingFinal":6.9,"RDirectorFinal":7.9,"ROtherFinal":7.9,"RPictureFinal":8.3,"RShowFinal":7.5,'
+    '"RStoryFinal":7.1,"RTotalFinal":7.4,"Usercount":112467,"AttitudeCount":9207},"movieTitle":"卧虎藏龙",'
+    '"tweetId":0,"userLastComment":"","userLastCommentUrl":"","releaseType":3},"error":null};'
+    'var movieOverviewRatingResult=result_20148715112823067;'
+)
+
+# (名称, 页面文件, URL, meta)
+DOUBAN_FIXTURES = [
+    ('parse_movie_base', 'movie_without_imdb.html', 'http://movie.douban.com/subject/1867420/', {}),
+    ('parse_celebrity', 'celebrity.html', 'http://movie.douban.com/celebrity/1048000/', {}),
+    ('parse_celebrity_photo_base', 'celebrity_photo.html', 'http://movie.douban.com/celebrity/1048000/photo/826255312/', {}),
+    ('parse_movie_photo_base', 'movie_photo.html', 'http://movie.douban.com/photos/photo/2092045531/', {}),
+    ('parse_review', 'review.html', 'http://movie.douban.com/review/6195573/', {'item': douban.MovieItem(id=1867420)}),
+]
+
+MTIME_FIXTURES = [
+    ('parse_movie_rating', None, 'http://service.library.mtime.com/Movie.api', {'movie': mtime.MovieItem(id=12135)}),
+    ('parse_movie_credits', 'fullcredits.html', 'http://movie.mtime.com/157125/fullcredits.html', {'item': mtime.MovieItem(id=157125)}),
+    ('parse_movie_detail', 'details.html', 'http://movie.mtime.com/157125/details.html', {'item': mtime.MovieItem(id=157125)}),
+    ('parse_movie_plots', 'plots.html', 'http://movie.mtime.com/157125/plots.html', {'item': mtime.MovieItem(id=157125)}),
+    ('parse_celebrity', 'celebrity.html', 'http://people.mtime.com/914002/', {}),
+    ('parse_celebrity_detail', 'celebrity_detail.html', 'http://people.mtime.com/914002/details.html', {'celebrity': mtime.CelebrityItem(id=914002)}),
+]
+
+
+def get_benchmarks(douban_parser=None):
+    """
+    返回 [(名称, 回调, 构造Response的函数)]
+    """
+    from movie_crawler.spiders.douban.movie import MovieSpider as DoubanSpider
+    from movie_crawler.spiders.mtime.movie import MovieSpider as MtimeSpider
+
+    douban_spider = DoubanSpider()
+    if douban_parser:
+        douban_spider.parser = douban_parser
+    # 测量解析本身，解析进程池只是把解析移到其他进程中
+    douban_spider.parse_pool = None
+    mtime_spider = MtimeSpider()
+
+    benchmarks = []
+    for spider, site, fixtures in [(douban_spider, 'douban', DOUBAN_FIXTURES), (mtime_spider, 'mtime', MTIME_FIXTURES)]:
+        for callback, filename, url, meta in fixtures:
+            if filename:
+                with open(os.path.join(TESTS_DIR, site, 'html', filename)) as f:
+                    body = f.read()
+                response_cls = HtmlResponse
+            else:
+                body = MTIME_RATING_BODY.encode('utf-8')
+                response_cls = TextResponse
+            benchmarks.append((
+                '%s.%s' % (site, callback),
+                getattr(spider, callback),
+                _response_factory(response_cls, url, body, meta),
+            ))
+    return benchmarks
+
+
+def _response_factory(response_cls, url, body, meta):
+    def make_response():
+        request = Request(url=url, meta=dict((k, v.copy()) for k, v in meta.items()))
+        return response_cls(url=url, body=body, encoding='utf-8', request=request)
+    return make_response
+
+
+def _consume(result):
+    if isinstance(result, defer.Deferred):
+        # 没有运行reactor，只能处理已经触发的Deferred
+        results = []
+        result.addBoth(results.append)
+        if not results:
+            raise RuntimeError('callback returned a Deferred that has not fired, '
+                               'benchmarks run without a reactor')
+        result = results[0]
+        if isinstance(result, Failure):
+            result.raiseException()
+    if result is None or isinstance(result, BaseItem):
+        return
+    for _ in result:
+        pass
+
+
+def run_benchmark(callback, make_response, iterations):
+    # 预热，排除首次调用时的导入、XPath编译等开销
+    _consume(callback(make_response()))
+
+    elapsed = 0.0
+    for _ in range(iterations):
+        response = make_response()
+        gc.disable()
+        try:
+            start = time.time()
+            _consume(callback(response))
+            elapsed += time.time() - start
+        finally:
+            gc.enable()
+
+    return {
+        'ms_per_page': elapsed / iterations * 1000,
+        'pages_per_sec': iterations / elapsed if elapsed else None,
+    }
+
+
+def _max_rss_kb():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return max_rss / 1024.0 if sys.platform == 'darwin' else float(max_rss)
+
+
+def measure_memory(name, douban_parser=None):
+    """
+    在当前进程中执行一次回调，返回执行前后的内存峰值(KB)，
+    只应在新的进程中调用，见`measure_memory_in_subprocess`
+    """
+    for benchmark_name, callback, make_response in get_benchmarks(douban_parser):
+        if benchmark_name == name:
+            response = make_response()
+            before = _max_rss_kb()
+            _consume(callback(response))
+            after = _max_rss_kb()
+            return {'peak_memory_kb': after - before, 'max_rss_kb': after}
+    raise KeyError(name)
+
+
+def measure_memory_in_subprocess(name, douban_parser=None):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'movie_crawler.commands.benchparse', name, douban_parser or ''],
+        env=env,
+    )
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def compare_results(baseline, results, threshold):
+    """
+    返回每页耗时超过基线(1 + threshold)倍的回调 [(名称, 基线耗时, 当前耗时)]
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base and result['ms_per_page'] > base['ms_per_page'] * (1 + threshold):
+            regressions.append((name, base['ms_per_page'], result['ms_per_page']))
+    return regressions
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Benchmark spider callbacks against the bundled HTML fixtures"
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("-n", "--iterations", type="int", default=20,
+                          help="iterations per callback (default: %default)")
+        parser.add_option("-o", "--output", metavar="FILE",
+                          help="save results as JSON to FILE")
+        parser.add_option("--baseline", metavar="FILE",
+                          help="compare with results saved in FILE, exit 1 on regression")
+        parser.add_option("--threshold", type="float", default=0.2,
+                          help="allowed slowdown ratio against baseline (default: %default)")
+        parser.add_option("--douban-parser", metavar="PARSER",
+                          help="douban parser (default: DOUBAN_PARSER setting)")
+        parser.add_option("-k", "--filter", metavar="TEXT",
+                          help="only run callbacks whose name contains TEXT")
+
+    def run(self, args, opts):
+        douban_parser = opts.douban_parser or self.settings.get('DOUBAN_PARSER')
+        results = {}
+        print("%-40s %10s %10s %12s %12s" % ("callback", "ms/page", "pages/s", "peak KB", "max RSS KB"))
+        for name, callback, make_response in get_benchmarks(douban_parser):
+            if opts.filter and opts.filter not in name:
+                continue
+            result = results[name] = run_benchmark(callback, make_response, opts.iterations)
+            result.update(measure_memory_in_subprocess(name, douban_parser))
+            print("%-40s %10.2f %10.1f %12.1f %12.1f" % (
+                name, result['ms_per_page'], result['pages_per_sec'] or 0,
+                result['peak_memory_kb'], result['max_rss_kb']
+            ))
+
+        if opts.output:
+            with open(opts.output, 'w') as f:
+                json.dump({
+                    'time': datetime.now().isoformat(),
+                    'python': platform.python_version(),
+                    'iterations': opts.iterations,
+                    'douban_parser': douban_parser,
+                    'results': results,
+                }, f, indent=2, sort_keys=True)
+
+        if opts.baseline:
+            with open(opts.baseline) as f:
+                baseline = json.load(f)['results']
+            regressions = compare_results(baseline, results, opts.threshold)
+            for name, before, after in regressions:
+                print("REGRESSION %s: %.2f ms -> %.2f ms" % (name, before, after))
+            if regressions:
+                self.exitcode = 1
+
+
+if __name__ == '__main__':
+    # 由measure_memory_in_subprocess调用: benchparse.py <名称> [douban解析器]
+    print(json.dumps(measure_memory(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)))
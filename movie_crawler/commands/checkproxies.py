@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+并发验证候选代理，按延迟排序写入`PROXY_LIST`。候选代理为`PROXY_CANDIDATE_LIST`
+以及代理爬虫抓取到代理仓库(`PROXY_STORE_FILE`)中的代理：
+
+    scrapy checkproxies
+    scrapy checkproxies -i unfilter_proxy.txt --no-store --probe-url http://127.0.0.1:8000/
+"""
+
+from __future__ import unicode_literals
+
+from scrapy.command import ScrapyCommand
+from twisted.internet import reactor
+
+from movie_crawler.filter_proxy import read_candidates, validate, write_results
+from movie_crawler.utils import ProxyStore
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Validate candidate proxies and write a ranked proxy list"
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("-i", "--input", metavar="FILE",
+                          help="candidate proxies (default: PROXY_CANDIDATE_LIST)")
+        parser.add_option("--no-store", action="store_true",
+                          help="do not check the proxies harvested into PROXY_STORE_FILE")
+        parser.add_option("-o", "--output", metavar="FILE",
+                          help="ranked proxy list (default: PROXY_LIST)")
+        parser.add_option("-m", "--meta", metavar="FILE",
+                          help="per-proxy metadata as JSON (default: PROXY_META_FILE)")
+        parser.add_option("--probe-url", metavar="URL",
+                          help="URL requested through each proxy (default: PROXY_PROBE_URL)")
+        parser.add_option("-c", "--concurrency", type="int",
+                          help="number of proxies checked at the same time")
+        parser.add_option("-t", "--timeout", type="float",
+                          help="timeout of each check in seconds")
+
+    def run(self, args, opts):
+        settings = self.settings
+        candidates = read_candidates(opts.input or settings.get('PROXY_CANDIDATE_LIST'))
+        if not opts.no_store:
+            candidates = sorted(set(candidates) | set(ProxyStore.load_addresses(settings.get('PROXY_STORE_FILE'))))
+        output = opts.output or settings.get('PROXY_LIST')
+        meta = opts.meta or settings.get('PROXY_META_FILE')
+
+        def finished(results):
+            ranked = write_results(results, output, meta)
+            print("%d/%d proxies available, written to %s" % (len(ranked), len(candidates), output))
+
+        def failed(failure):
+            failure.printTraceback()
+            self.exitcode = 1
+
+        d = validate(candidates,
+                     opts.probe_url or settings.get('PROXY_PROBE_URL'),
+                     opts.concurrency or settings.getint('PROXY_CHECK_CONCURRENCY'),
+                     opts.timeout or settings.getfloat('PROXY_CHECK_TIMEOUT'))
+        d.addCallbacks(finished, failed)
+        d.addBoth(lambda _: reactor.stop())
+        reactor.run()
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+清理HTTP缓存：删除按当前`HTTPCACHE_TTLS`已过期的响应及不再引用的响应体，
+并整理缓存文件：
+
+    scrapy compactcache
+"""
+
+from __future__ import unicode_literals
+
+import os
+
+from scrapy.command import ScrapyCommand
+
+from movie_crawler.httpcache import TTLRules, compact, get_cache_path
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Remove expired responses and unreferenced bodies from the HTTP cache"
+
+    def run(self, args, opts):
+        path = get_cache_path(self.settings)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        responses, bodies = compact(path, TTLRules.from_settings(self.settings))
+        print("Removed %d responses and %d bodies, %s: %.1f MB -> %.1f MB" % (
+            responses, bodies, path, size / 1048576.0, os.path.getsize(path) / 1048576.0))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+在本机启动多个进程分片爬取同一个爬虫，进程之间通过SQLite共享待爬队列及已见集合，
+请求按实体ID(或URL、时光网类型)的一致性哈希分配给各进程：
+
+    scrapy crawlsharded douban_movie -w 4
+    scrapy crawlsharded mtime_movie -w 8 --logdir logs -s CHECKPOINT_DIR=.checkpoint
+    scrapy crawlsharded douban_movie -w 4 --resume
+
+设置了`CHECKPOINT_DIR`时每个进程使用其中单独的子目录。
+"""
+
+from __future__ import unicode_literals
+
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+
+from scrapy.command import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy.utils.project import data_path
+
+from movie_crawler.frontier import SharedFrontier
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options] <spider>"
+
+    def short_desc(self):
+        return "Run a spider in several processes sharing one frontier"
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("-w", "--workers", type="int",
+                          help="number of worker processes (default: SHARD_WORKERS or number of CPUs)")
+        parser.add_option("-a", dest="spargs", action="append", default=[], metavar="NAME=VALUE",
+                          help="set spider argument (may be repeated)")
+        parser.add_option("--frontier", metavar="FILE",
+                          help="shared frontier database (default: .scrapy/frontier-<spider>.sqlite)")
+        parser.add_option("--resume", action="store_true",
+                          help="keep the seen set and pending requests of the last run")
+        parser.add_option("--logdir", metavar="DIR",
+                          help="write the log of each worker to DIR/<spider>-<n>.log")
+
+    def run(self, args, opts):
+        if len(args) != 1:
+            raise UsageError()
+        spider_name = args[0]
+        workers = opts.workers or self.settings.getint('SHARD_WORKERS') or multiprocessing.cpu_count()
+        path = opts.frontier or data_path('frontier-%s.sqlite' % spider_name)
+
+        frontier = SharedFrontier(path)
+        frontier.reset(workers, keep=opts.resume)
+        frontier.close()
+
+        processes = [subprocess.Popen(self._worker_command(spider_name, index, workers, path, opts))
+                     for index in range(workers)]
+        print("Started %d workers of %s, frontier %s" % (workers, spider_name, path))
+        try:
+            for process in processes:
+                process.wait()
+        except KeyboardInterrupt:
+            # 各进程收到SIGINT后正常关闭爬虫
+            for process in processes:
+                if process.poll() is None:
+                    process.send_signal(signal.SIGINT)
+            for process in processes:
+                process.wait()
+        self.exitcode = max(abs(process.returncode) for process in processes)
+
+    def _worker_command(self, spider_name, index, workers, path, opts):
+        command = [sys.executable, '-m', 'scrapy.cmdline', 'crawl', spider_name,
+                   '-s', 'SHARD_FRONTIER=%s' % path,
+                   '-s', 'SHARD_INDEX=%d' % index,
+                   '-s', 'SHARD_COUNT=%d' % workers]
+        for setting in opts.set:
+            if not setting.startswith('CHECKPOINT_DIR='):
+                command += ['-s', setting]
+        checkpoint_dir = self.settings.get('CHECKPOINT_DIR')
+        if checkpoint_dir:
+            command += ['-s', 'CHECKPOINT_DIR=%s' % os.path.join(checkpoint_dir, 'shard-%d' % index)]
+        if opts.logdir:
+            if not os.path.exists(opts.logdir):
+                os.makedirs(opts.logdir)
+            command += ['-s', 'LOG_FILE=%s' % os.path.join(opts.logdir, '%s-%d.log' % (spider_name, index))]
+        for spider_argument in opts.spargs:
+            command += ['-a', spider_argument]
+        return command
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+为已有的数据库创建按Item的unique_fields推导出的索引。
+syncdb只在建表时创建索引，之后在模型中加入的db_index/index_together
+需要用这个命令补上，已存在的索引会被跳过：
+
+    scrapy createindexes
+    scrapy createindexes --sql
+"""
+
+from __future__ import unicode_literals
+
+from django.db import DatabaseError, connections, router, transaction
+from scrapy.command import ScrapyCommand
+
+from movie_crawler.store.indexes import get_index_sql, get_missing_indexes, get_required_indexes
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Create the database indexes needed by Item.unique_fields lookups"
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("--sql", action="store_true",
+                          help="only print the CREATE INDEX statements")
+
+    def run(self, args, opts):
+        for item_class, fields, reason in get_missing_indexes():
+            print("WARNING: %s.unique_fields %s is not indexed in the model (%s)" % (
+                item_class.__name__, fields, reason))
+
+        created = existing = 0
+        for item_class, model, fields in get_required_indexes():
+            alias = router.db_for_write(model)
+            try:
+                statements = get_index_sql(model, fields)
+            except Exception as e:
+                print("Skip %s.unique_fields %s: %s" % (item_class.__name__, fields, e))
+                continue
+            for statement in statements:
+                if opts.sql:
+                    print("-- %s\n%s" % (alias, statement))
+                    continue
+                try:
+                    with transaction.atomic(using=alias):
+                        connections[alias].cursor().execute(statement)
+                except DatabaseError as e:
+                    # 索引已存在(syncdb已创建或重复执行)
+                    existing += 1
+                    print("[%s] %s: %s" % (alias, model._meta.db_table, e))
+                else:
+                    created += 1
+                    print("[%s] %s" % (alias, statement))
+        if not opts.sql:
+            print("Created %d indexes, %d already existed" % (created, existing))
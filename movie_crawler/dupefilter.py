@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from scrapy import log
+from scrapy.dupefilter import BaseDupeFilter
+from scrapy.utils.request import request_fingerprint
+
+from movie_crawler.utils.bloom import BloomFilter
+
+
+class BloomDupeFilter(BaseDupeFilter):
+    """
+        基于布隆过滤器的请求去重
+
+        内存占用由`DUPEFILTER_CAPACITY`及`DUPEFILTER_ERROR_RATE`确定，不随请求数增长；
+        设置`DUPEFILTER_PATH`时保存在文件中，重启后仍然有效，并可由多个进程共用。
+        代价是少量未请求过的URL会被误判为重复。
+
+        持久化的去重记录只记录见过的请求，不记录它们是否完成，
+        因此只在启用检查点(`CHECKPOINT_DIR`)时使用，由检查点重新发出未完成的请求；
+        否则忽略`DUPEFILTER_PATH`，只在内存中去重。
+    """
+
+    def __init__(self, capacity=10000000, error_rate=0.001, path=None, debug=False):
+        self.bloom = BloomFilter(capacity, error_rate, path or None)
+        self.debug = debug
+        self.logdupes = True
+
+    @classmethod
+    def from_settings(cls, settings):
+        path = settings.get('DUPEFILTER_PATH')
+        if path and not settings.get('CHECKPOINT_DIR'):
+            log.msg('DUPEFILTER_PATH is ignored without CHECKPOINT_DIR: '
+                    'pending requests would be dropped as duplicates after a restart', level=log.WARNING)
+            path = None
+        return cls(
+            capacity=settings.getint('DUPEFILTER_CAPACITY', 10000000),
+            error_rate=settings.getfloat('DUPEFILTER_ERROR_RATE', 0.001),
+            path=path,
+            debug=settings.getbool('DUPEFILTER_DEBUG'),
+        )
+
+    def request_seen(self, request):
+        return self.bloom.add(request_fingerprint(request))
+
+    def close(self, reason):
+        # 调度器在spider_closed之前关闭，保留映射以便统计扩展读取最终状态
+        self.bloom.flush()
+
+    def log(self, request, spider):
+        if self.debug:
+            log.msg(format="Filtered duplicate request: %(request)s", level=log.DEBUG, spider=spider, request=request)
+        elif self.logdupes:
+            log.msg(format="Filtered duplicate request: %(request)s - no more duplicates will be shown"
+                           " (see DUPEFILTER_DEBUG to show all duplicates)",
+                    level=log.DEBUG, spider=spider, request=request)
+            self.logdupes = False
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+
+class DupeFilterStats(object):
+    """
+        定期将布隆过滤器去重的状态写入统计：已加入的请求数、置位比例及估计的误判率
+
+        去重器由调度器创建，无法直接拿到crawler，因此由扩展从调度器中读取
+    """
+
+    def __init__(self, crawler, interval):
+        self.crawler = crawler
+        self.interval = interval
+        self._loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        interval = crawler.settings.getfloat('DUPEFILTER_STATS_INTERVAL', 60)
+        if not interval:
+            raise NotConfigured
+        extension = cls(crawler, interval)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        self._loop = task.LoopingCall(self.update_stats, spider)
+        self._loop.start(self.interval)
+
+    def spider_closed(self, spider):
+        if self._loop and self._loop.running:
+            self._loop.stop()
+        self.update_stats(spider)
+
+    def update_stats(self, spider):
+        slot = getattr(self.crawler.engine, 'slot', None)
+        bloom = getattr(getattr(getattr(slot, 'scheduler', None), 'df', None), 'bloom', None)
+        if bloom is None:
+            return
+        stats = self.crawler.stats
+        stats.set_value('dupefilter/count', len(bloom), spider=spider)
+        stats.set_value('dupefilter/fill_ratio', round(bloom.fill_ratio, 6), spider=spider)
+        stats.set_value('dupefilter/false_positive_rate', bloom.false_positive_rate, spider=spider)
@@ -1,21 +1,206 @@
 #encoding:utf-8
+"""
+代理验证
 
+从`unfilter_proxy.txt`(checkerproxy.net导出格式)或代理列表(PROTOCOL://IP:PORT)
+中读取候选代理，并发地通过每个代理请求探测URL，记录延迟及支持的协议，
+可用代理按延迟排序写入代理列表，每个代理的详细信息写入JSON文件：
 
-def filter():
-    ip_list, protocol_list, proxy_list = [], [], []
-    with open('unfilter_proxy.txt', 'r') as f:
-        for i, line in enumerate(f):
-            sp = line.split('\t')
-            if i % 2 == 0:
-                ip_list.append(sp[1] + ':' + sp[2])
-            if i % 2 == 1:
-                protocol_list.append(sp[0].lower())
-        for i in range(len(ip_list)):
-            proxy_list.append(protocol_list[i] + '://' + ip_list[i])
+    python filter_proxy.py -i unfilter_proxy.txt -o proxy_list.txt --probe-url http://movie.douban.com/
+"""
+from __future__ import unicode_literals
+
+from urlparse import urlparse
+import argparse
+import json
+import time
+
+from twisted.internet import defer, protocol, reactor
+from twisted.internet.endpoints import TCP4ClientEndpoint
+from twisted.web.client import ProxyAgent, readBody
+
+
+DEFAULT_PROBE_URL = 'http://movie.douban.com/'
+
+
+def read_candidates(filename):
+    """
+    读取候选代理，返回 [PROTOCOL://IP:PORT]
+    """
+    with open(filename) as f:
+        lines = [line.rstrip('\r\n') for line in f if line.strip()]
+    if all('://' in line for line in lines):
+        return [line.strip() for line in lines]
+
+    # checkerproxy.net格式：每个代理两行，第一行为IP及端口，第二行为协议
+    ip_list, protocol_list = [], []
+    for i, line in enumerate(lines):
+        sp = line.split('\t')
+        if i % 2 == 0:
+            ip_list.append(sp[1] + ':' + sp[2])
+        if i % 2 == 1:
+            protocol_list.append(sp[0].lower())
+    return [protocol_list[i] + '://' + ip_list[i] for i in range(len(protocol_list))]
+
+
+class ConnectProbe(protocol.Protocol):
+    """
+    通过CONNECT方法检查代理是否支持HTTPS隧道
+    """
+
+    def __init__(self, target, finished):
+        self.target = target
+        self.finished = finished
+        self.data = b''
+
+    def connectionMade(self):
+        self.transport.write(('CONNECT %s HTTP/1.1\r\nHost: %s\r\n\r\n' % (self.target, self.target)).encode('ascii'))
+
+    def dataReceived(self, data):
+        self.data += data
+        if b'\r\n' in self.data:
+            status_line = self.data.split(b'\r\n', 1)[0].split()
+            self.transport.loseConnection()
+            if not self.finished.called:
+                self.finished.callback(len(status_line) > 1 and status_line[1] == b'200')
+
+    def connectionLost(self, reason):
+        if not self.finished.called:
+            self.finished.callback(False)
+
+
+def _with_timeout(d, timeout):
+    call = reactor.callLater(timeout, d.cancel)
+
+    def cancel_timeout(result):
+        if call.active():
+            call.cancel()
+        return result
+    return d.addBoth(cancel_timeout)
+
+
+@defer.inlineCallbacks
+def check_http(host, port, probe_url, timeout):
+    """
+    通过代理请求探测URL，成功时返回延迟(秒)，失败返回None
+    """
+    endpoint = TCP4ClientEndpoint(reactor, host, port, timeout=timeout)
+    start = time.time()
+    try:
+        response = yield _with_timeout(ProxyAgent(endpoint).request(b'GET', probe_url.encode('ascii')), timeout)
+        yield _with_timeout(readBody(response), timeout)
+    except Exception:
+        defer.returnValue(None)
+    if response.code != 200:
+        defer.returnValue(None)
+    defer.returnValue(time.time() - start)
+
+
+@defer.inlineCallbacks
+def check_https(host, port, probe_url, timeout):
+    """
+    检查代理能否建立到探测URL主机443端口的隧道，成功时返回延迟(秒)，失败返回None
+    """
+    endpoint = TCP4ClientEndpoint(reactor, host, port, timeout=timeout)
+    finished = defer.Deferred()
+    target = '%s:443' % urlparse(probe_url).hostname
+    start = time.time()
+    try:
+        proto = yield endpoint.connect(protocol.Factory.forProtocol(lambda: ConnectProbe(target, finished)))
+    except Exception:
+        defer.returnValue(None)
+    timeout_call = reactor.callLater(timeout, proto.transport.loseConnection)
+    ok = yield finished
+    if timeout_call.active():
+        timeout_call.cancel()
+    defer.returnValue(time.time() - start if ok else None)
+
+
+@defer.inlineCallbacks
+def check_proxy(address, probe_url=DEFAULT_PROBE_URL, timeout=10):
+    """
+    检查单个代理，返回代理的详细信息
+    """
+    obj = urlparse(address)
+    http_latency, https_latency = yield defer.gatherResults([
+        check_http(obj.hostname, obj.port, probe_url, timeout),
+        check_https(obj.hostname, obj.port, probe_url, timeout),
+    ])
+    protocols = []
+    if http_latency is not None:
+        protocols.append('http')
+    if https_latency is not None:
+        protocols.append('https')
+    latencies = [l for l in (http_latency, https_latency) if l is not None]
+    defer.returnValue({
+        'address': address,
+        'protocols': protocols,
+        'latency': min(latencies) if latencies else None,
+        'http_latency': http_latency,
+        'https_latency': https_latency,
+        'checked_time': time.time(),
+    })
+
+
+def validate(addresses, probe_url=DEFAULT_PROBE_URL, concurrency=50, timeout=10):
+    """
+    并发检查所有代理，最多同时检查`concurrency`个
+    """
+    semaphore = defer.DeferredSemaphore(concurrency)
+    return defer.gatherResults([
+        semaphore.run(check_proxy, address, probe_url, timeout)
+        for address in sorted(set(addresses))
+    ])
+
+
+def rank(results, protocol='http'):
+    """
+    支持`protocol`目标协议的代理按该协议的延迟排序
+
+    代理地址保持原样：地址的协议是客户端连接代理的方式，与代理支持请求
+    哪些协议的目标无关，后者记录在`protocols`中。爬取的页面都是http://，
+    只支持CONNECT隧道的代理不会被列出。
+    """
+    latency_key = '%s_latency' % protocol
+    available = sorted([r for r in results if protocol in r['protocols']], key=lambda r: r[latency_key])
+    for i, result in enumerate(available):
+        result['rank'] = i + 1
+        result['proxy'] = result['address']
+    return available
+
+
+def write_results(results, list_file, meta_file):
+    ranked = rank(results)
+    with open(list_file, 'w') as f:
+        for result in ranked:
+            f.write(result['proxy'] + '\n')
+    with open(meta_file, 'w') as f:
+        json.dump(ranked, f, indent=2)
+    return ranked
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate proxies concurrently')
+    parser.add_argument('-i', '--input', default='unfilter_proxy.txt')
+    parser.add_argument('-o', '--output', default='proxy_list.txt')
+    parser.add_argument('-m', '--meta', default='proxy_list.json')
+    parser.add_argument('--probe-url', default=DEFAULT_PROBE_URL)
+    parser.add_argument('-c', '--concurrency', type=int, default=50)
+    parser.add_argument('-t', '--timeout', type=float, default=10)
+    args = parser.parse_args()
+
+    candidates = read_candidates(args.input)
+
+    def finished(results):
+        ranked = write_results(results, args.output, args.meta)
+        print('%d/%d proxies available' % (len(ranked), len(candidates)))
+
+    d = validate(candidates, args.probe_url, args.concurrency, args.timeout)
+    d.addCallback(finished)
+    d.addErrback(lambda failure: failure.printTraceback())
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
 
-    with open('proxy_list.txt', 'w') as f:
-        for address in proxy_list:
-            f.write(address + '\n')
 
 if __name__ == '__main__':
-    filter()
+    main()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sqlite3
+import time
+
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY)",
+    "CREATE TABLE IF NOT EXISTS frontier ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, shard INTEGER, request BLOB, claimed REAL)",
+    "CREATE TABLE IF NOT EXISTS workers ("
+    "shard INTEGER PRIMARY KEY, idle INTEGER, heartbeat REAL)",
+]
+
+
+class SharedFrontier(object):
+    """
+        多进程共享的待爬队列及已见集合，保存在一个SQLite文件中
+
+        - seen: 所有进程发现过的请求(实体的规范URL或请求指纹)，保证每个实体只爬取一次
+        - frontier: 属于其他进程的请求。所属进程取走时标记取走时间(claimed)，
+          处理完成后才删除；进程重启或心跳超时时，它取走但未完成的请求重新排队
+        - workers: 各进程是否空闲及心跳时间，所有进程空闲且队列为空时爬取结束
+
+        已见集合在发现请求时写入，因此请求在完成之前不能从队列中删除，
+        否则进程中断后该请求不会再被发现。
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(frontier)")]
+        if 'claimed' not in columns:
+            # 旧版本的队列文件
+            self.conn.execute("ALTER TABLE frontier ADD COLUMN claimed REAL")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS frontier_claim ON frontier (shard, claimed, id)")
+        self.conn.commit()
+
+    def reset(self, count, keep=False):
+        """
+        登记`count`个进程，`keep`为False时清空已见集合及队列，
+        否则上次取走但未完成的请求重新排队
+        """
+        with self.conn:
+            if not keep:
+                self.conn.execute("DELETE FROM seen")
+                self.conn.execute("DELETE FROM frontier")
+            else:
+                self.conn.execute("UPDATE frontier SET claimed = NULL")
+            self.conn.execute("DELETE FROM workers")
+            self.conn.executemany(
+                "INSERT INTO workers VALUES (?, 0, ?)",
+                [(shard, time.time()) for shard in range(count)]
+            )
+
+    def add(self, entries):
+        """
+        在一个事务中加入一批请求，`entries`为[(key, shard, 请求数据)]，
+        请求数据为None时只加入已见集合。返回每个key是否第一次出现
+        """
+        added = []
+        with self.conn:
+            for key, shard, data in entries:
+                cursor = self.conn.execute("INSERT OR IGNORE INTO seen VALUES (?)", (key,))
+                added.append(cursor.rowcount == 1)
+                if cursor.rowcount == 1 and data is not None:
+                    self.conn.execute(
+                        "INSERT INTO frontier (shard, request) VALUES (?, ?)", (shard, sqlite3.Binary(data))
+                    )
+        return added
+
+    def claim(self, shard, limit):
+        """
+        取走属于`shard`的至多`limit`个请求，同时更新心跳，返回[(id, 请求数据)]。
+        请求处理完成后需要调用`complete`
+        """
+        now = time.time()
+        with self.conn:
+            rows = self.conn.execute(
+                "SELECT id, request FROM frontier WHERE shard = ? AND claimed IS NULL ORDER BY id LIMIT ?",
+                (shard, limit)
+            ).fetchall()
+            if rows:
+                self.conn.executemany("UPDATE frontier SET claimed = ? WHERE id = ?", [(now, row_id) for row_id, _ in rows])
+                self.conn.execute("UPDATE workers SET idle = 0, heartbeat = ? WHERE shard = ?", (now, shard))
+            else:
+                self.conn.execute("UPDATE workers SET heartbeat = ? WHERE shard = ?", (now, shard))
+        return [(row_id, bytes(data)) for row_id, data in rows]
+
+    def complete(self, ids):
+        """
+        删除处理完成的请求
+        """
+        with self.conn:
+            self.conn.executemany("DELETE FROM frontier WHERE id = ?", [(row_id,) for row_id in ids])
+
+    def release(self, shard):
+        """
+        `shard`的进程启动时调用：之前的进程取走但未完成的请求重新排队
+        """
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE frontier SET claimed = NULL WHERE shard = ? AND claimed IS NOT NULL", (shard,)
+            )
+        return cursor.rowcount
+
+    def requeue_stale(self, timeout=300):
+        """
+        超过`timeout`秒没有心跳的进程取走的请求重新排队，返回重新排队的数量
+        """
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE frontier SET claimed = NULL WHERE claimed IS NOT NULL AND shard IN "
+                "(SELECT shard FROM workers WHERE heartbeat <= ?)", (time.time() - timeout,)
+            )
+        return cursor.rowcount
+
+    def heartbeat(self, shard):
+        with self.conn:
+            self.conn.execute("UPDATE workers SET heartbeat = ? WHERE shard = ?", (time.time(), shard))
+
+    def set_idle(self, shard):
+        with self.conn:
+            self.conn.execute("UPDATE workers SET idle = 1, heartbeat = ? WHERE shard = ?", (time.time(), shard))
+
+    def finished(self, timeout=300):
+        """
+        所有进程都空闲(或超过`timeout`秒没有心跳)且没有排队的请求时返回True。
+        空闲进程取走但未完成的请求是下载失败的请求，留到下次`--resume`时重新排队
+        """
+        # 在同一个查询中读取，避免两次读取之间其他进程加入请求
+        busy, pending = self.conn.execute(
+            "SELECT (SELECT COUNT(*) FROM workers WHERE idle = 0 AND heartbeat > ?), "
+            "(SELECT COUNT(*) FROM frontier WHERE claimed IS NULL)", (time.time() - timeout,)
+        ).fetchone()
+        return busy == 0 and pending == 0
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import cPickle as pickle
+import hashlib
+import os
+import re
+import sqlite3
+import time
+import zlib
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from scrapy.utils.request import request_fingerprint
+
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS bodies ("
+    "hash TEXT PRIMARY KEY, data BLOB, size INTEGER)",
+    "CREATE TABLE IF NOT EXISTS responses ("
+    "fingerprint TEXT PRIMARY KEY, spider TEXT, request_url TEXT, url TEXT, status INTEGER, "
+    "headers BLOB, body_hash TEXT, timestamp REAL)",
+    "CREATE INDEX IF NOT EXISTS responses_body_hash ON responses (body_hash)",
+]
+
+
+def get_cache_path(settings):
+    cache_dir = data_path(settings.get('HTTPCACHE_DIR'))
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    return os.path.join(cache_dir, 'httpcache.sqlite')
+
+
+class TTLRules(object):
+    """
+    按URL正则确定缓存有效期(秒)，第一个匹配的规则生效，0表示永不过期
+    """
+
+    def __init__(self, rules, default=0):
+        self.rules = [(re.compile(pattern), int(ttl)) for pattern, ttl in rules]
+        self.default = default
+
+    def get(self, url):
+        for regex, ttl in self.rules:
+            if regex.search(url):
+                return ttl
+        return self.default
+
+    def expired(self, url, timestamp, now=None):
+        ttl = self.get(url)
+        return ttl > 0 and (now or time.time()) - timestamp > ttl
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.get('HTTPCACHE_TTLS') or (), settings.getint('HTTPCACHE_EXPIRATION_SECS'))
+
+
+class SQLiteCacheStorage(object):
+    """
+        HTTP缓存存储(HTTPCACHE_STORAGE)
+
+        所有响应保存在一个SQLite文件中，响应体按内容的SHA1去重并用zlib压缩；
+        有效期由`HTTPCACHE_TTLS`按请求URL设置，未匹配时使用`HTTPCACHE_EXPIRATION_SECS`。
+        过期的响应及不再引用的响应体由`scrapy compactcache`清理。
+    """
+
+    # 每写入多少个响应提交一次事务
+    commit_interval = 100
+
+    def __init__(self, settings):
+        self.path = get_cache_path(settings)
+        self.ttl = TTLRules.from_settings(settings)
+        self.compression_level = settings.getint('HTTPCACHE_COMPRESSION_LEVEL', 6)
+        self.conn = None
+        self._uncommitted = 0
+
+    def open_spider(self, spider):
+        if self.conn is None:
+            self.conn = connect(self.path)
+
+    def close_spider(self, spider):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    def retrieve_response(self, spider, request):
+        row = self.conn.execute(
+            "SELECT r.url, r.status, r.headers, r.timestamp, b.data FROM responses r "
+            "JOIN bodies b ON b.hash = r.body_hash WHERE r.fingerprint = ?",
+            (request_fingerprint(request),)
+        ).fetchone()
+        if row is None:
+            return None
+        url, status, headers, timestamp, data = row
+        if self.ttl.expired(request.url, timestamp):
+            return None
+
+        headers = Headers(pickle.loads(bytes(headers)))
+        body = zlib.decompress(bytes(data))
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        body_hash = hashlib.sha1(response.body).hexdigest()
+        self.conn.execute(
+            "INSERT OR IGNORE INTO bodies VALUES (?, ?, ?)",
+            (body_hash, sqlite3.Binary(zlib.compress(response.body, self.compression_level)), len(response.body))
+        )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (request_fingerprint(request), spider.name, request.url, response.url, response.status,
+             sqlite3.Binary(pickle.dumps(dict(response.headers), protocol=2)), body_hash, time.time())
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_interval:
+            self.conn.commit()
+            self._uncommitted = 0
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def compact(path, ttl, now=None):
+    """
+    删除过期的响应及不再引用的响应体，并整理数据库文件，
+    返回 (删除的响应数, 删除的响应体数)
+    """
+    conn = connect(path)
+    now = now or time.time()
+    try:
+        expired = [
+            (fingerprint,)
+            for fingerprint, url, timestamp in conn.execute("SELECT fingerprint, request_url, timestamp FROM responses")
+            if ttl.expired(url, timestamp, now)
+        ]
+        with conn:
+            conn.executemany("DELETE FROM responses WHERE fingerprint = ?", expired)
+            cursor = conn.execute(
+                "DELETE FROM bodies WHERE NOT EXISTS "
+                "(SELECT 1 FROM responses WHERE responses.body_hash = bodies.hash)"
+            )
+            orphans = cursor.rowcount
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return len(expired), orphans
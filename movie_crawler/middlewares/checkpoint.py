@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import cPickle as pickle
+import os
+import sqlite3
+import time
+
+from scrapy import log, signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from scrapy.utils.reqser import request_to_dict, request_from_dict
+from scrapy.utils.request import request_fingerprint
+from twisted.internet import defer, task, threads
+
+from movie_crawler.utils.bloom import BloomFilter
+
+
+PENDING = 0
+COMPLETED = 1
+
+
+class CheckpointStore(object):
+    """
+    爬取进度，保存在SQLite中
+
+    每个请求(标签页、列表页、电影、子页面等)是一个单元，以请求指纹为主键，
+    未完成的单元保存序列化后的请求，以便重启后重新发出。
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        # 写入在线程中进行，但同一时刻只有一个线程使用连接
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        # WAL模式下reactor线程的查询不会被写线程阻塞
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS units ("
+            "fingerprint TEXT PRIMARY KEY, url TEXT, callback TEXT, request BLOB, "
+            "status INTEGER, updated REAL)"
+        )
+        self.conn.commit()
+        self.reader = sqlite3.connect(filename, timeout=30)
+
+    def iter_completed(self):
+        for fingerprint, in self.reader.execute("SELECT fingerprint FROM units WHERE status = %d" % COMPLETED):
+            yield fingerprint
+
+    def load_pending(self):
+        """
+        返回 [(指纹, 未完成的请求数据)]
+        """
+        return self.reader.execute("SELECT fingerprint, request FROM units WHERE status = %d" % PENDING).fetchall()
+
+    def is_completed(self, fingerprint):
+        row = self.reader.execute("SELECT status FROM units WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        return row is not None and row[0] == COMPLETED
+
+    def write(self, pending, completed):
+        """
+        批量写入，`pending`为[(指纹, url, 回调, 请求数据)]，`completed`为[(指纹, url, 回调)]
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO units VALUES (?, ?, ?, ?, %d, ?)" % PENDING,
+                [unit + (now,) for unit in pending]
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO units VALUES (?, ?, ?, NULL, %d, ?)" % COMPLETED,
+                [unit + (now,) for unit in completed]
+            )
+
+    def close(self):
+        self.reader.close()
+        self.conn.close()
+
+
+class CheckpointMiddleware(object):
+    """
+        爬取进度检查点(Spider中间件)
+
+        记录每个爬虫发出(未完成)及处理完成的请求，定期在线程中批量写入
+        `CHECKPOINT_DIR/<spider>.sqlite`(设置`CHECKPOINT_JOB`时为
+        `<spider>.<job>.sqlite`)。重启时跳过已完成的请求，重新发出上次未完成的
+        请求(不经过调度器去重，持久化的去重记录中它们已被标记)，只需重做中断时
+        正在进行的工作。回调出错的请求保持未完成状态。
+
+        爬虫正常结束(finished)时删除检查点，下次运行重新开始；
+        `CHECKPOINT_RESET`可以在启动时丢弃之前的检查点。
+
+        已完成的指纹只在内存中保存一个容量为`CHECKPOINT_CAPACITY`的布隆过滤器，
+        命中时再查询数据库确认，内存占用不随完成的请求数增长。
+    """
+
+    def __init__(self, checkpoint_dir, batch_size=1000, flush_interval=5, stats=None,
+                 job=None, reset=False, capacity=10000000):
+        self.checkpoint_dir = checkpoint_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = stats
+        self.job = job
+        self.reset = reset
+        self.capacity = capacity
+
+        self.store = None
+        self.completed = None
+        self.pending = set()
+        self._restored = []
+        self._pending_buffer = []
+        self._completed_buffer = []
+        # 已完成但还没有写入数据库的指纹
+        self._completed_unflushed = set()
+        self._lock = defer.DeferredLock()
+        self._flush_loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        checkpoint_dir = settings.get('CHECKPOINT_DIR')
+        if not checkpoint_dir:
+            raise NotConfigured
+        middleware = cls(
+            checkpoint_dir,
+            batch_size=settings.getint('CHECKPOINT_BATCH_SIZE', 1000),
+            flush_interval=settings.getfloat('CHECKPOINT_FLUSH_INTERVAL', 5),
+            stats=crawler.stats,
+            job=settings.get('CHECKPOINT_JOB'),
+            reset=settings.getbool('CHECKPOINT_RESET'),
+            capacity=settings.getint('CHECKPOINT_CAPACITY', 10000000),
+        )
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.open(spider)
+        if self.flush_interval:
+            self._flush_loop = task.LoopingCall(self.flush)
+            self._flush_loop.start(self.flush_interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self._flush_loop and self._flush_loop.running:
+            self._flush_loop.stop()
+        d = self.flush()
+        d.addBoth(lambda _: self.close(spider, reason))
+        return d
+
+    def open(self, spider):
+        if not os.path.exists(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir)
+        filename = self.get_filename(spider)
+        if self.reset:
+            self._remove(filename)
+        self.store = CheckpointStore(filename)
+        self.completed = BloomFilter(self.capacity, 0.001)
+        completed = 0
+        for fingerprint in self.store.iter_completed():
+            self.completed.add(fingerprint)
+            completed += 1
+        self._restored = self.store.load_pending()
+        self.pending = set(fingerprint for fingerprint, _ in self._restored)
+        log.msg('Checkpoint restored: %d completed, %d pending' % (completed, len(self.pending)), spider=spider)
+        self._inc_stats('checkpoint/restored', len(self.pending))
+
+    def close(self, spider, reason=None):
+        self.store.close()
+        self.completed.close()
+        if reason == 'finished':
+            # 爬取已完成，剩下的未完成单元是出错或被忽略的请求
+            log.msg('Crawl finished, checkpoint removed (%d units left pending)' % len(self.pending), spider=spider)
+            self._remove(self.store.filename)
+
+    def get_filename(self, spider):
+        name = '%s.%s' % (spider.name, self.job) if self.job else spider.name
+        return os.path.join(self.checkpoint_dir, '%s.sqlite' % name)
+
+    def is_completed(self, fingerprint):
+        if fingerprint not in self.completed:
+            return False
+        return fingerprint in self._completed_unflushed or self.store.is_completed(fingerprint)
+
+    def _remove(self, filename):
+        for path in (filename, filename + '-wal', filename + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def process_start_requests(self, start_requests, spider):
+        for request in start_requests:
+            fingerprint = request_fingerprint(request)
+            if fingerprint in self.pending or self.is_completed(fingerprint):
+                continue
+            self._add_pending(request, fingerprint, spider)
+            yield request
+
+        restored, self._restored = self._restored, []
+        for fingerprint, data in restored:
+            try:
+                request = request_from_dict(pickle.loads(bytes(data)), spider)
+            except Exception as e:
+                log.msg('Failed to restore request [%s]: %s' % (fingerprint, e), level=log.WARNING, spider=spider)
+                continue
+            # 持久化的去重记录(DUPEFILTER_PATH)中这些请求已被标记为见过
+            yield request.replace(dont_filter=True)
+
+    def process_spider_output(self, response, result, spider):
+        for r in result:
+            if isinstance(r, Request):
+                fingerprint = request_fingerprint(r)
+                if not r.dont_filter and self.is_completed(fingerprint):
+                    self._inc_stats('checkpoint/skipped')
+                    continue
+                if fingerprint not in self.pending:
+                    self._add_pending(r, fingerprint, spider)
+            yield r
+        # 回调中途出错时不会执行到这里，请求保持未完成状态
+        self._add_completed(response)
+
+    def flush(self):
+        pending, completed = self._take_buffers()
+        if not pending and not completed:
+            return defer.succeed(None)
+        d = self._lock.run(threads.deferToThread, self.store.write, pending, completed)
+        d.addCallback(lambda _: self._written(completed))
+        d.addErrback(lambda failure: log.err(failure, 'Failed to write checkpoint'))
+        return d
+
+    def _take_buffers(self):
+        pending, self._pending_buffer = self._pending_buffer, []
+        completed, self._completed_buffer = self._completed_buffer, []
+        return pending, completed
+
+    def _written(self, completed):
+        for unit in completed:
+            self._completed_unflushed.discard(unit[0])
+
+    def _add_pending(self, request, fingerprint, spider):
+        # 重定向后的请求沿用原请求的指纹
+        request.meta['checkpoint_fingerprint'] = fingerprint
+        try:
+            data = pickle.dumps(request_to_dict(request, spider), protocol=2)
+        except Exception as e:
+            log.msg('Request can not be checkpointed [%s]: %s' % (request.url, e), level=log.WARNING, spider=spider)
+            return
+        self.pending.add(fingerprint)
+        self._pending_buffer.append((fingerprint, request.url, _callback_name(request), sqlite3.Binary(data)))
+        self._inc_stats('checkpoint/pending')
+        self._maybe_flush()
+
+    def _add_completed(self, response):
+        request = response.request
+        if request is None:
+            return
+        fingerprint = response.meta.get('checkpoint_fingerprint') or request_fingerprint(request)
+        self.pending.discard(fingerprint)
+        self.completed.add(fingerprint)
+        self._completed_unflushed.add(fingerprint)
+        self._completed_buffer.append((fingerprint, request.url, _callback_name(request)))
+        self._inc_stats('checkpoint/completed')
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._pending_buffer) + len(self._completed_buffer) >= self.batch_size:
+            self.flush()
+
+    def _inc_stats(self, key, count=1):
+        if self.stats:
+            self.stats.inc_value(key, count)
+
+
+def _callback_name(request):
+    callback = request.callback
+    if callback is None:
+        return 'parse'
+    return getattr(callback, '__name__', str(callback))
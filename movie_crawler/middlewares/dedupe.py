@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from scrapy import log
+from scrapy.http import Request
+
+from movie_crawler.utils.entity import entity_url, parse_entity_url
+
+
+class EntityDedupeMiddleware(object):
+    """
+        按实体去重(Spider中间件)
+
+        同一部电影/同一个艺人/同一篇长评可能通过不同的标签、推荐或URL写法
+        (查询参数、有无结尾斜杠)被多次发现。实体主页面的请求统一为
+        (站点, 类型, ID)，每次运行只调度一次，URL改写为规范形式。
+        子页面及dont_filter的请求不处理，仍由调度器去重。
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats
+        self._seen = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def process_start_requests(self, start_requests, spider):
+        for request in start_requests:
+            request = self.dedupe(request, spider)
+            if request is not None:
+                yield request
+
+    def process_spider_output(self, response, result, spider):
+        for r in result:
+            if isinstance(r, Request):
+                r = self.dedupe(r, spider)
+                if r is None:
+                    continue
+            yield r
+
+    def dedupe(self, request, spider):
+        """
+        返回规范化后的请求，实体已调度过时返回None
+        """
+        if request.dont_filter:
+            return request
+        entity = parse_entity_url(request.url)
+        if entity is None or entity.subpage:
+            return request
+
+        seen = self._seen.setdefault((entity.site, entity.type), set())
+        if entity.id in seen:
+            if self.stats:
+                self.stats.inc_value('entity_dedupe/filtered', spider=spider)
+            log.msg('Filtered duplicate entity %s %s %d [%s]' % (entity.site, entity.type, entity.id, request.url),
+                    level=log.DEBUG, spider=spider)
+            return None
+        seen.add(entity.id)
+        if self.stats:
+            self.stats.inc_value('entity_dedupe/%s/%s' % (entity.site, entity.type), spider=spider)
+
+        url = entity_url(entity)
+        return request if url == request.url else request.replace(url=url)
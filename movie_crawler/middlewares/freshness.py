@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+import calendar
+import time
+
+from django.db import DatabaseError, router
+from django.utils import timezone
+from scrapy import log, signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from twisted.internet import threads
+
+from movie_crawler.store.douban import models as douban_models
+from movie_crawler.store.mtime import models as mtime_models
+from movie_crawler.utils.entity import parse_entity_url
+
+
+# (站点, 实体类型): (模型, ID字段, 过滤条件)
+ENTITY_MODELS = {
+    ('douban', 'movie'): (douban_models.Movie, 'id', {}),
+    ('douban', 'celebrity'): (douban_models.Celebrity, 'id', {}),
+    ('douban', 'review'): (douban_models.Comment, 'id_comment', {'type': 2}),
+    ('mtime', 'movie'): (mtime_models.Movie, 'id', {}),
+    ('mtime', 'celebrity'): (mtime_models.Celebrity, 'id', {}),
+}
+
+
+def to_timestamp(value):
+    if timezone.is_aware(value):
+        return calendar.timegm(value.utctimetuple())
+    return time.mktime(value.timetuple())
+
+
+class UpdateTimeIndex(object):
+    """
+    实体ID到更新时间的索引
+
+    只保存在TTL内更新过的实体，ID及时间保存在按ID排序的两个数组中，
+    通过二分查找，比dict节省内存。
+    """
+
+    def __init__(self, rows):
+        self.ids = array(b'l')
+        self.times = array(b'd')
+        for entity_id, update_time in sorted(rows):
+            self.ids.append(entity_id)
+            self.times.append(update_time)
+
+    def get(self, entity_id):
+        index = bisect_left(self.ids, entity_id)
+        if index < len(self.ids) and self.ids[index] == entity_id:
+            return self.times[index]
+        return None
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class FreshnessMiddleware(object):
+    """
+        跳过最近更新过的实体(Spider中间件)
+
+        电影、艺人及长评页面的实体在`FRESHNESS_TTL`(按实体类型设置，单位秒)内
+        更新过时，不再发出请求。爬虫启动时在线程中从对应的数据库载入
+        TTL内更新过的(ID, update_time)，载入完成后才发出起始请求。
+        数据表缺少update_time字段(见`scrapy addcolumns`)时不跳过该类实体。
+    """
+
+    def __init__(self, ttl, stats=None):
+        self.ttl = dict((entity_type, seconds) for entity_type, seconds in ttl.items() if seconds)
+        self.stats = stats
+        self.skipped = 0
+        self._indexes = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        ttl = crawler.settings.getdict('FRESHNESS_TTL')
+        if not ttl or not any(ttl.values()):
+            raise NotConfigured
+        middleware = cls(ttl, crawler.stats)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        # spider_opened的Deferred完成后引擎才开始调度起始请求
+        d = threads.deferToThread(self.load_indexes)
+        d.addErrback(lambda failure: log.err(failure, 'Failed to load freshness indexes', spider=spider))
+        return d
+
+    def spider_closed(self, spider):
+        log.msg('Skipped %d requests for fresh entities' % self.skipped, spider=spider)
+
+    def process_start_requests(self, start_requests, spider):
+        for request in start_requests:
+            if not self.is_fresh(request, spider):
+                yield request
+
+    def process_spider_output(self, response, result, spider):
+        for r in result:
+            if isinstance(r, Request) and self.is_fresh(r, spider):
+                continue
+            yield r
+
+    def is_fresh(self, request, spider):
+        entity = parse_entity_url(request.url)
+        # 只跳过实体主页面，子页面由主页面的回调发出
+        if entity is None or entity.subpage or entity.type not in self.ttl:
+            return False
+        index = self._get_index(entity.site, entity.type)
+        if index is None:
+            return False
+
+        update_time = index.get(entity.id)
+        if update_time is None or update_time < time.time() - self.ttl[entity.type]:
+            return False
+
+        self.skipped += 1
+        if self.stats:
+            self.stats.inc_value('freshness/skipped', spider=spider)
+            self.stats.inc_value('freshness/skipped/%s/%s' % (entity.site, entity.type), spider=spider)
+        log.msg('Skip fresh %s %s [%s]' % (entity.site, entity.type, request.url), level=log.DEBUG, spider=spider)
+        return True
+
+    def load_indexes(self):
+        """
+        载入所有设置了TTL的实体的索引，在线程中调用
+        """
+        self._indexes = dict(
+            (key, self._load_index(key)) for key in ENTITY_MODELS if key[1] in self.ttl
+        )
+
+    def _get_index(self, site, entity_type):
+        return self._indexes.get((site, entity_type))
+
+    def _load_index(self, key):
+        model, id_field, filters = ENTITY_MODELS[key]
+        cutoff = timezone.now() - timedelta(seconds=self.ttl[key[1]])
+        rows = (
+            model.objects.using(router.db_for_read(model))
+            .filter(update_time__gte=cutoff, **filters)
+            .exclude(**{'%s__isnull' % id_field: True})
+            .values_list(id_field, 'update_time')
+            .iterator()
+        )
+        try:
+            index = UpdateTimeIndex((entity_id, to_timestamp(update_time)) for entity_id, update_time in rows)
+        except DatabaseError as e:
+            log.msg('Can not load fresh %s %s, see `scrapy addcolumns`: %s' % (key[0], key[1], e), level=log.WARNING)
+            return None
+        log.msg('Loaded %d fresh %s %s' % (len(index), key[0], key[1]))
+        return index
@@ -1,56 +1,110 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-import re
-import random
+import os
+import time
 import base64
 
-from scrapy import log
+from scrapy import log, signals
 
 from movie_crawler.settings import scrapy_settings
+from movie_crawler.utils import ProxyPool
+
+
+# 这些状态码通常表示代理被封禁或不可用
+PROXY_FAILURE_STATUS = (403, 407, 429, 502, 503, 504)
+
+
+def get_setting(settings, name, default=None):
+    try:
+        return settings.get(name, default)
+    except AttributeError:
+        return getattr(settings, name, default)
 
 
 class ProxyMiddleware(object):
     """
         随机代理
         ref: https://github.com/aivarsk/scrapy-proxies/blob/master/randomproxy.py
+
+        代理按成功率及响应时间加权选择，失败的代理进入冷却期，
+        代理表现保存在`PROXY_SCORES_FILE`中，下次启动时载入。
     """
 
-    def __init__(self, settings=scrapy_settings):
-        try:
-            self.proxy_list = settings.get('PROXY_LIST')
-        except AttributeError:
-            self.proxy_list = settings.PROXY_LIST
+    def __init__(self, settings=scrapy_settings, stats=None):
+        self.proxy_list = get_setting(settings, 'PROXY_LIST')
+        self.scores_file = get_setting(settings, 'PROXY_SCORES_FILE')
+        self.stats = stats
 
         with open(self.proxy_list) as fin:
-            self.proxies = fin.readlines()
+            addresses = [line.strip() for line in fin if line.strip()]
+        self.pool = ProxyPool(
+            addresses,
+            cooldown=int(get_setting(settings, 'PROXY_COOLDOWN', 60)),
+            max_cooldown=int(get_setting(settings, 'PROXY_MAX_COOLDOWN', 3600)),
+        )
+        if self.scores_file and os.path.exists(self.scores_file):
+            self.pool.load_file(self.scores_file)
 
     @classmethod
     def from_crawler(cls, crawler):
-        return cls(crawler.settings)
+        middleware = cls(crawler.settings, crawler.stats)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_closed(self, spider):
+        self.save_scores()
 
     def process_request(self, request, spider):
-        if 'proxy' in request.meta:
+        if 'proxy' in request.meta and 'proxy_start_time' not in request.meta:
+            # 请求自己指定的代理
             return
 
+        # 重试及重定向的请求复制了上一次尝试的meta，每次尝试重新选择代理并计时
+        request.meta.pop('proxy', None)
+        request.meta.pop('proxy_start_time', None)
+        request.headers.pop('Proxy-Authorization', None)
+
         proxy_address = self.get_random_proxy()
-        log.msg('Proxies num: %d' % len(self.proxies))
+        if proxy_address is None:
+            log.msg('No proxy available', level=log.WARNING)
+            return
 
         request.meta['proxy'] = proxy_address
+        request.meta['proxy_start_time'] = time.time()
         basic_auth = 'Basic ' + base64.encodestring(proxy_address)
         request.headers['Proxy-Authorization'] = basic_auth
 
+    def process_response(self, request, response, spider):
+        if 'proxy_start_time' in request.meta:
+            proxy = request.meta['proxy']
+            if response.status in PROXY_FAILURE_STATUS:
+                self.pool.record_failure(proxy)
+            else:
+                self.pool.record_success(proxy, time.time() - request.meta['proxy_start_time'])
+            self._update_stats()
+        return response
+
     def process_exception(self, request, exception, spider):
-        proxy = request.meta['proxy']
-        try:
+        proxy = request.meta.get('proxy')
+        if proxy:
             self.del_proxy(proxy)
-        except ValueError:
-            pass
+            self._update_stats()
 
     def get_random_proxy(self):
-        return random.choice(self.proxies)
+        return self.pool.choose()
 
     def del_proxy(self, proxy):
-        if not proxy.endswith("\n"):
-            proxy += "\n"
-        del self.proxies[self.proxies.index(proxy)]
+        """
+        代理暂时进入冷却期，而不是永久删除
+        """
+        self.pool.record_failure(proxy.strip())
+
+    def save_scores(self):
+        if self.scores_file:
+            self.pool.save_file(self.scores_file)
+
+    def _update_stats(self):
+        if self.stats:
+            self.stats.set_value('proxy/active', len(self.pool))
+            self.stats.set_value('proxy/quarantined', self.pool.quarantined)
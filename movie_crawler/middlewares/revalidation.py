@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import sqlite3
+import time
+
+from django.utils import timezone
+from scrapy import log, signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from twisted.internet import defer, threads
+
+from movie_crawler.middlewares.freshness import ENTITY_MODELS
+from movie_crawler.signals import item_saved
+from movie_crawler.utils import LRUCache
+from movie_crawler.utils.entity import entity_url, parse_entity_url
+
+
+# 模型: (实体ID字段, 过滤条件)
+MODEL_ENTITIES = dict((model, (id_field, filters)) for model, id_field, filters in ENTITY_MODELS.values())
+
+
+class ValidatorStore(object):
+    """
+    每个规范URL的校验信息(ETag, Last-Modified, 响应体哈希及大小)，保存在SQLite中
+    """
+
+    # 每写入多少条提交一次事务
+    commit_interval = 100
+
+    def __init__(self, filename):
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS validators ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body_hash TEXT, size INTEGER, checked REAL)"
+        )
+        self.conn.commit()
+        self._uncommitted = 0
+
+    def get(self, url):
+        row = self.conn.execute(
+            "SELECT etag, last_modified, body_hash, size FROM validators WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('etag', 'last_modified', 'body_hash', 'size'), row))
+
+    def set(self, url, etag, last_modified, body_hash, size):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?, ?)",
+            (url, etag, last_modified, body_hash, size, time.time())
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class RevalidationMiddleware(object):
+    """
+        条件请求(下载中间件)
+
+        记录电影、艺人、长评等实体页面的ETag/Last-Modified及响应体哈希，
+        再次请求时带上If-None-Match/If-Modified-Since。
+        响应为304或响应体哈希未变时，在线程中更新对应对象的update_time，
+        并忽略该请求，不再解析及写入数据库。
+        设置`request.meta['dont_revalidate']`可强制重新解析。
+
+        新的校验信息在实体的Item写入数据库(`item_saved`信号)之后才保存，
+        回调出错或写入失败时下次仍会完整地请求及解析。
+        合并Item的部分页面(`coalesce_part`)不做条件请求，由主页面决定是否重新爬取。
+    """
+
+    def __init__(self, filename, stats=None, pending_size=10000):
+        self.store = ValidatorStore(filename)
+        self.stats = stats
+        # (模型, 实体ID): {规范URL: 校验信息}，等待Item写入
+        self.pending = LRUCache(pending_size)
+        self._updates = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        filename = crawler.settings.get('REVALIDATION_FILE')
+        if not filename:
+            raise NotConfigured
+        middleware = cls(filename, crawler.stats)
+        crawler.signals.connect(middleware.item_saved, signal=item_saved)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_closed(self, spider):
+        d = defer.DeferredList(list(self._updates))
+        d.addBoth(lambda _: self.store.close())
+        return d
+
+    def item_saved(self, item):
+        model = getattr(item, 'django_model', None)
+        if model not in MODEL_ENTITIES:
+            return
+        id_field, filters = MODEL_ENTITIES[model]
+        if any(item.get(field) != value for field, value in filters.items()):
+            return
+        validators = self.pending.pop((model, item.get(id_field)))
+        for url, values in (validators or {}).items():
+            self.store.set(url, *values)
+
+    def process_request(self, request, spider):
+        url = self._get_url(request)
+        if url is None:
+            return
+        validators = self.store.get(url)
+        if validators is None:
+            return
+        if validators['etag']:
+            request.headers.setdefault('If-None-Match', validators['etag'])
+        if validators['last_modified']:
+            request.headers.setdefault('If-Modified-Since', validators['last_modified'])
+        self._inc_stats('revalidation/conditional_requests', spider)
+
+    def process_response(self, request, response, spider):
+        # 缓存中的响应不做判断，以便修改解析代码后可以重新解析
+        if 'cached' in response.flags:
+            return response
+        url = self._get_url(request)
+        if url is None:
+            return response
+
+        validators = self.store.get(url)
+        if response.status == 304 and validators:
+            self._inc_stats('revalidation/not_modified', spider)
+            self._inc_stats('revalidation/bytes_saved', spider, validators['size'] or 0)
+            return self._unchanged(request, spider)
+        if response.status != 200:
+            return response
+
+        body_hash = hashlib.sha1(response.body).hexdigest()
+        if validators and validators['body_hash'] == body_hash:
+            self._inc_stats('revalidation/unchanged', spider)
+            return self._unchanged(request, spider)
+
+        entity = parse_entity_url(request.url)
+        model = ENTITY_MODELS[(entity.site, entity.type)][0]
+        pending = self.pending.get((model, entity.id)) or {}
+        pending[url] = (response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                        body_hash, len(response.body))
+        self.pending[(model, entity.id)] = pending
+        return response
+
+    def _get_url(self, request):
+        if request.meta.get('dont_revalidate') or 'coalesce_part' in request.meta:
+            return None
+        entity = parse_entity_url(request.url)
+        if entity is None or (entity.site, entity.type) not in ENTITY_MODELS:
+            return None
+        return entity_url(entity)
+
+    def _unchanged(self, request, spider):
+        entity = parse_entity_url(request.url)
+        if not entity.subpage:
+            d = threads.deferToThread(self._touch, entity)
+            d.addErrback(lambda failure: log.err(failure, 'Failed to update %s' % request.url, spider=spider))
+            self._updates.add(d)
+            d.addBoth(lambda _: self._updates.discard(d))
+        log.msg('Not modified [%s]' % request.url, level=log.DEBUG, spider=spider)
+        raise IgnoreRequest('Not modified: %s' % request.url)
+
+    def _touch(self, entity):
+        model, id_field, filters = ENTITY_MODELS[(entity.site, entity.type)]
+        model.objects.filter(**dict(filters, **{id_field: entity.id})).update(update_time=timezone.now())
+
+    def _inc_stats(self, key, spider, count=1):
+        if self.stats:
+            self.stats.inc_value(key, count, spider=spider)
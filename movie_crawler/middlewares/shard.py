@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import cPickle as pickle
+
+from scrapy import log, signals
+from scrapy.exceptions import DontCloseSpider, NotConfigured
+from scrapy.http import Request
+from scrapy.utils.reqser import request_to_dict, request_from_dict
+from scrapy.utils.request import request_fingerprint
+from scrapy.utils.url import canonicalize_url
+from twisted.internet import task
+
+from movie_crawler.frontier import SharedFrontier
+from movie_crawler.utils import HashRing
+from movie_crawler.utils.entity import entity_url, parse_entity_url
+
+
+def shard_key(request):
+    """
+    决定请求归属的key：`request.meta['shard_key']`，
+    否则为实体(子页面与主页面归同一个进程)，否则为规范化的URL
+    """
+    if request.meta.get('shard_key'):
+        return request.meta['shard_key']
+    entity = parse_entity_url(request.url)
+    if entity is not None:
+        return '%s:%s:%d' % (entity.site, entity.type, entity.id)
+    return canonicalize_url(request.url)
+
+
+def seen_key(request):
+    entity = parse_entity_url(request.url)
+    if entity is not None and request.method == 'GET':
+        return entity_url(entity)
+    return request_fingerprint(request)
+
+
+class ShardMiddleware(object):
+    """
+        多进程分片爬取(Spider中间件)，由`scrapy crawlsharded`启动的各进程使用
+
+        发出的请求按`shard_key`在一致性哈希环上分配给`SHARD_COUNT`个进程之一，
+        所有进程共用`SHARD_FRONTIER`中的已见集合，每个请求只被发出一次；
+        属于本进程的请求直接调度，属于其他进程的请求写入共享队列，
+        由所属进程每`SHARD_POLL_INTERVAL`秒取走，回调完成后才从队列中删除。
+        进程启动时，同一分片之前的进程取走但未完成的请求重新排队。
+        dont_filter的请求不分片。
+    """
+
+    def __init__(self, crawler, frontier, shard, count, poll_interval=1, batch_size=100):
+        self.crawler = crawler
+        self.frontier = frontier
+        self.shard = shard
+        self.ring = HashRing(range(count))
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._loop = None
+        # 回调已完成、等待从共享队列中删除的请求id
+        self._completed = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        path = settings.get('SHARD_FRONTIER')
+        if not path:
+            raise NotConfigured
+        middleware = cls(
+            crawler,
+            SharedFrontier(path),
+            settings.getint('SHARD_INDEX'),
+            settings.getint('SHARD_COUNT', 1),
+            poll_interval=settings.getfloat('SHARD_POLL_INTERVAL', 1),
+            batch_size=settings.getint('SHARD_BATCH_SIZE', 100),
+        )
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        log.msg('Shard %d/%d, frontier %s' % (self.shard, len(self.ring.nodes), self.frontier.path), spider=spider)
+        released = self.frontier.release(self.shard)
+        if released:
+            log.msg('Requeued %d unfinished shared requests' % released, spider=spider)
+        self._loop = task.LoopingCall(self.poll, spider)
+        self._loop.start(self.poll_interval, now=False)
+
+    def spider_idle(self, spider):
+        if self.poll(spider):
+            raise DontCloseSpider
+        self.frontier.requeue_stale()
+        self.frontier.set_idle(self.shard)
+        if not self.frontier.finished():
+            raise DontCloseSpider
+
+    def spider_closed(self, spider):
+        if self._loop and self._loop.running:
+            self._loop.stop()
+        self.complete()
+        self.frontier.set_idle(self.shard)
+        self.frontier.close()
+
+    def process_start_requests(self, start_requests, spider):
+        batch = []
+        for request in start_requests:
+            batch.append(request)
+            if len(batch) >= self.batch_size:
+                for r in self.dispatch(batch, spider):
+                    yield r
+                batch = []
+        for r in self.dispatch(batch, spider):
+            yield r
+
+    def process_spider_output(self, response, result, spider):
+        # 同一个响应产生的请求在一个事务中写入，减少锁等待
+        requests = []
+        for r in result:
+            if isinstance(r, Request):
+                requests.append(r)
+            else:
+                yield r
+        for r in self.dispatch(requests, spider):
+            yield r
+        # 回调出错时不会执行到这里，请求保持取走状态，下次启动时重新排队
+        if 'frontier_id' in response.meta:
+            self._completed.append(response.meta['frontier_id'])
+
+    def dispatch(self, requests, spider):
+        """
+        返回属于本进程且第一次出现的请求，其他进程的请求写入共享队列
+        """
+        local, entries, candidates = [], [], []
+        for request in requests:
+            if request.dont_filter:
+                local.append(request)
+                continue
+            shard = self.ring.get_node(shard_key(request))
+            data = None
+            if shard != self.shard:
+                data = self._serialize(request, spider)
+                if data is None:
+                    local.append(request)
+                    continue
+            entries.append((seen_key(request), shard, data))
+            candidates.append((request, shard))
+        if not entries:
+            return local
+
+        for (request, shard), added in zip(candidates, self.frontier.add(entries)):
+            if not added:
+                self._inc_stats('shard/duplicate', spider)
+            elif shard == self.shard:
+                local.append(request)
+                self._inc_stats('shard/local', spider)
+            else:
+                self._inc_stats('shard/forwarded', spider)
+        return local
+
+    def poll(self, spider):
+        """
+        取走共享队列中属于本进程的请求，返回取走的数量
+        """
+        self.complete()
+        engine = self.crawler.engine
+        slot = getattr(engine, 'slot', None)
+        if slot is None or len(slot.scheduler) >= self.batch_size:
+            # 忙碌时也要更新心跳，否则取走的请求会被当作超时重新排队
+            self.frontier.heartbeat(self.shard)
+            return 0
+        claimed = self.frontier.claim(self.shard, self.batch_size)
+        for row_id, data in claimed:
+            try:
+                request = request_from_dict(pickle.loads(data), spider)
+            except Exception as e:
+                log.msg('Failed to load shared request: %s' % e, level=log.WARNING, spider=spider)
+                self._completed.append(row_id)
+                continue
+            request.meta['frontier_id'] = row_id
+            engine.crawl(request, spider)
+        if claimed:
+            self._inc_stats('shard/claimed', spider, len(claimed))
+        return len(claimed)
+
+    def complete(self):
+        """
+        从共享队列中删除回调已完成的请求
+        """
+        if self._completed:
+            completed, self._completed = self._completed, []
+            self.frontier.complete(completed)
+
+    def _serialize(self, request, spider):
+        try:
+            return pickle.dumps(request_to_dict(request, spider), protocol=2)
+        except Exception as e:
+            # 回调不是爬虫的方法时无法序列化，只能在本进程中发出
+            log.msg('Request can not be shared [%s]: %s' % (request.url, e), level=log.WARNING, spider=spider)
+            return None
+
+    def _inc_stats(self, key, spider, count=1):
+        self.crawler.stats.inc_value(key, count, spider=spider)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from scrapy import log, signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import task
+from twisted.internet.error import ConnectError, ConnectionLost, DNSLookupError, TimeoutError
+
+
+# 这些异常通常表示目标站点或代理过载
+BACKOFF_EXCEPTIONS = (TimeoutError, ConnectError, ConnectionLost, DNSLookupError)
+
+
+class SlotState(object):
+    """
+    一个下载槽(域名, 代理)的当前速度
+    """
+
+    __slots__ = ('delay', 'concurrency', 'successes', 'responses', 'rate')
+
+    def __init__(self, delay, concurrency=1):
+        self.delay = delay
+        self.concurrency = concurrency
+        self.successes = 0
+        self.responses = 0
+        self.rate = 0.0
+
+
+class AIMDThrottle(object):
+    """
+    加性增、乘性减(AIMD)的速度控制
+
+    速度按"间隔 -> 并发数"一条轴调节：
+    - 连续成功`window`次后加速：间隔大于`min_delay`时减少`delay_step`秒，
+      否则并发数加1(不超过`max_concurrency`)
+    - 出现封禁、验证码或超时时减速：并发数大于1时减半，否则间隔乘以`backoff_factor`
+      (不小于`delay_step`，不超过`max_delay`)
+    """
+
+    def __init__(self, start_delay=2, min_delay=0, max_delay=60, max_concurrency=8,
+                 window=20, delay_step=0.25, backoff_factor=2):
+        self.start_delay = start_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_concurrency = max_concurrency
+        self.window = window
+        self.delay_step = delay_step
+        self.backoff_factor = backoff_factor
+        self.states = {}
+
+    def get(self, key):
+        if key not in self.states:
+            self.states[key] = SlotState(self.start_delay)
+        return self.states[key]
+
+    def success(self, key):
+        """
+        记录一次成功，速度有变化时返回True
+        """
+        state = self.get(key)
+        state.responses += 1
+        state.successes += 1
+        if state.successes < self.window:
+            return False
+        state.successes = 0
+        if state.delay > self.min_delay:
+            state.delay = max(self.min_delay, state.delay - self.delay_step)
+        elif state.concurrency < self.max_concurrency:
+            state.concurrency += 1
+        else:
+            return False
+        return True
+
+    def backoff(self, key):
+        state = self.get(key)
+        state.responses += 1
+        state.successes = 0
+        if state.concurrency > 1:
+            state.concurrency = max(1, state.concurrency // 2)
+        else:
+            state.delay = min(self.max_delay, max(state.delay * self.backoff_factor, self.delay_step))
+
+
+class AdaptiveThrottleMiddleware(object):
+    """
+        按(域名, 代理)自适应限速(下载中间件)，代替全局的DOWNLOAD_DELAY
+
+        每个域名及代理的组合使用单独的下载槽(`request.meta['download_slot']`)，
+        由AIMDThrottle调节其间隔及并发数。响应状态码在`THROTTLE_BACKOFF_HTTP_CODES`中、
+        跳转到验证码页面(`THROTTLE_CAPTCHA_PATTERNS`)或下载超时时减速。
+        各下载槽的间隔、并发数及每秒响应数每`THROTTLE_STATS_INTERVAL`秒写入统计。
+
+        需要在ProxyMiddleware之后(order更大)，RedirectMiddleware之前处理响应。
+    """
+
+    def __init__(self, crawler, throttle, backoff_codes, captcha_patterns, stats_interval=10):
+        self.crawler = crawler
+        self.throttle = throttle
+        self.backoff_codes = set(backoff_codes)
+        self.captcha_patterns = [re.compile(pattern) for pattern in captcha_patterns]
+        self.stats_interval = stats_interval
+        self._loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('THROTTLE_ENABLED'):
+            raise NotConfigured
+        throttle = AIMDThrottle(
+            start_delay=settings.getfloat('THROTTLE_START_DELAY', settings.getfloat('DOWNLOAD_DELAY')),
+            min_delay=settings.getfloat('THROTTLE_MIN_DELAY'),
+            max_delay=settings.getfloat('THROTTLE_MAX_DELAY', 60),
+            max_concurrency=settings.getint('THROTTLE_MAX_CONCURRENCY', 8),
+            window=settings.getint('THROTTLE_WINDOW', 20),
+        )
+        middleware = cls(
+            crawler, throttle,
+            settings.getlist('THROTTLE_BACKOFF_HTTP_CODES'),
+            settings.getlist('THROTTLE_CAPTCHA_PATTERNS'),
+            settings.getfloat('THROTTLE_STATS_INTERVAL', 10),
+        )
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        if self.stats_interval:
+            self._loop = task.LoopingCall(self.update_stats, spider)
+            self._loop.start(self.stats_interval, now=False)
+
+    def spider_closed(self, spider):
+        if self._loop and self._loop.running:
+            self._loop.stop()
+
+    def process_request(self, request, spider):
+        request.meta['download_slot'] = self.get_key(request)
+
+    def process_response(self, request, response, spider):
+        if 'cached' in response.flags or 'download_slot' not in request.meta:
+            return response
+        key = request.meta['download_slot']
+        if response.status in self.backoff_codes or self.is_captcha(response):
+            self._backoff(key, spider, 'status %d' % response.status)
+        else:
+            if self.throttle.success(key):
+                self._inc_stats('throttle/ramp_up', spider)
+            # 新建的下载槽使用全局设置，在第一个响应时改为当前速度
+            self._apply(key)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if isinstance(exception, BACKOFF_EXCEPTIONS) and 'download_slot' in request.meta:
+            self._backoff(request.meta['download_slot'], spider, exception.__class__.__name__)
+
+    def get_key(self, request):
+        hostname = urlparse_cached(request).hostname or ''
+        proxy = request.meta.get('proxy')
+        return '%s|%s' % (hostname, proxy) if proxy else hostname
+
+    def is_captcha(self, response):
+        urls = [response.url]
+        if 300 <= response.status < 400 and 'Location' in response.headers:
+            urls.append(response.headers['Location'].decode('utf-8', 'ignore'))
+        return any(pattern.search(url) for pattern in self.captcha_patterns for url in urls)
+
+    def update_stats(self, spider):
+        stats = self.crawler.stats
+        for key, state in self.throttle.states.items():
+            state.rate = state.responses / float(self.stats_interval)
+            state.responses = 0
+            stats.set_value('throttle/%s/delay' % key, state.delay, spider=spider)
+            stats.set_value('throttle/%s/concurrency' % key, state.concurrency, spider=spider)
+            stats.set_value('throttle/%s/rate' % key, round(state.rate, 2), spider=spider)
+        stats.set_value('throttle/slots', len(self.throttle.states), spider=spider)
+
+    def _backoff(self, key, spider, reason):
+        self.throttle.backoff(key)
+        state = self._apply(key)
+        self._inc_stats('throttle/backoff', spider)
+        log.msg('Throttle %s (%s): delay %.2fs, concurrency %d' % (key, reason, state.delay, state.concurrency),
+                level=log.DEBUG, spider=spider)
+
+    def _apply(self, key):
+        state = self.throttle.get(key)
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None:
+            slot.delay = state.delay
+            slot.concurrency = state.concurrency
+        return state
+
+    def _inc_stats(self, key, spider):
+        self.crawler.stats.inc_value(key, spider=spider)
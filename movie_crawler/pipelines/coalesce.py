@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+同一个对象的数据可能分散在多个页面中(例如时光网电影的基本信息、评分、
+演职人员、详情以及剧情)，每个页面的回调都会返回一个部分Item。
+合并这些部分Item后再写入，每个对象只需要写一次数据库。
+"""
+
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import time
+
+
+def merge_item(target, item):
+    """
+    将item合并到target中，结果与依次写入相同：
+    后到的字段覆盖先到的字段，空的ManyToMany字段不覆盖
+    """
+    many_to_many_fields = [f.name for f in item.django_model._meta.many_to_many]
+    for field, value in item.items():
+        if field in many_to_many_fields and not value:
+            continue
+        target[field] = value
+    return target
+
+
+class ItemCoalescer(object):
+    """
+    按(Item类型, unique_fields)合并部分Item
+
+    Spider通过`_coalesce_part`属性标记部分Item来自哪个页面，
+    所有期望的页面都返回后，`add`返回合并后的Item；
+    超过`timeout`秒仍未完成的Item通过`pop_expired`取出。
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._pending = OrderedDict()
+
+    def add(self, item, part, expected_parts):
+        key = (item.__class__, self._get_key(item))
+        if key in self._pending:
+            merged, parts, _ = self._pending[key]
+            merge_item(merged, item)
+        else:
+            merged, parts = item.copy(), set()
+            self._pending[key] = (merged, parts, time.time())
+
+        parts.add(part)
+        if parts.issuperset(expected_parts):
+            del self._pending[key]
+            return merged
+        return None
+
+    def _get_key(self, item):
+        # 各页面解析出的值类型可能不同(如 '12468' 与 12468)，按Model字段统一
+        opts = item.django_model._meta
+        return tuple(opts.get_field(field).to_python(item.get(field)) for field in item.unique_fields)
+
+    def pop_expired(self):
+        deadline = time.time() - self.timeout
+        expired = []
+        # 按加入顺序排列，遇到未超时的即可停止
+        for key, (merged, _, created) in self._pending.items():
+            if created > deadline:
+                break
+            expired.append(key)
+        return [self._pending.pop(key)[0] for key in expired]
+
+    def pop_all(self):
+        items = [merged for merged, _, _ in self._pending.values()]
+        self._pending.clear()
+        return items
+
+    def __len__(self):
+        return len(self._pending)
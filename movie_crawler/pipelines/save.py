@@ -1,37 +1,503 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from collections import OrderedDict
+import threading
+import time
+
+from django.db import router, transaction, DatabaseError
+from django.db.models import AutoField, Q
+from django.utils import timezone
 from scrapy import log
+from twisted.internet import defer, reactor, task
+
+from movie_crawler.api.cache import response_cache
+from movie_crawler.pipelines.coalesce import ItemCoalescer, merge_item
+from movie_crawler.pipelines.writer import DatabaseWriter
+from movie_crawler.signals import item_saved
+from movie_crawler.settings.db_router import APP_DB
+from movie_crawler.store.columns import get_missing_columns
+from movie_crawler.store.douban import models as douban_models
+from movie_crawler.store.indexes import get_missing_indexes
+from movie_crawler.store.mtime import models as mtime_models
+from movie_crawler.utils import LRUCache
+
+
+# SQLite单条语句最多999个参数
+QUERY_CHUNK_SIZE = 900
+
+# 维度表：数据量小且几乎不变，ManyToMany关联时通过缓存查询主键
+DIMENSION_MODELS = (
+    douban_models.Genre, douban_models.Tag, douban_models.Area, douban_models.Company,
+    mtime_models.Genre, mtime_models.Tag, mtime_models.Area, mtime_models.Company,
+)
+
+
+class ItemBuffer(object):
+    """
+    一个数据库的待写入Item，按Model以及unique_fields合并
+    """
+
+    def __init__(self):
+        self.models = OrderedDict()
+        self.count = 0
+        self.last_flush = time.time()
 
 
 class SavePipeline(object):
+    """
+    保存Item到数据库
+
+    默认逐个写入Item。设置`SAVE_PIPELINE_BATCH_SIZE`后启用批量模式：
+    Item按Django Model分组缓存，数量达到`SAVE_PIPELINE_BATCH_SIZE`或距上次
+    写入超过`SAVE_PIPELINE_FLUSH_INTERVAL`秒时，在一个事务内批量写入，
+    `close_spider`时写入剩余Item。
+
+    维度表(分类/标签/地区/公司)的主键缓存在容量为
+    `SAVE_PIPELINE_DIMENSION_CACHE_SIZE`的LRU缓存中，`open_spider`时批量
+    载入，只有未命中时才查询数据库。
+
+    设置`SAVE_PIPELINE_WRITER_QUEUE_SIZE`后，每个数据库由一个独立的写线程
+    写入，`process_item`返回的Deferred在Item提交到数据库(批量模式下为放入
+    缓存)后触发，不再阻塞reactor线程。
+
+    批量模式下`process_item`返回时Item还没有写入，Item提交到数据库后
+    发送`movie_crawler.signals.item_saved`信号(总是在reactor线程中)。
+
+    Spider标记的部分Item(见`movie_crawler.pipelines.coalesce`)先在内存中合并，
+    所有部分到齐或超过`SAVE_PIPELINE_COALESCE_TIMEOUT`秒后才写入。
+
+    `SAVE_PIPELINE_INVALIDATE_API_CACHE`启用时，事务提交后使写入对象的
+    接口响应缓存失效(见`movie_crawler.api.cache`)。
+    """
     # TODO: Rename to StorePipeline
+
+    def __init__(self, batch_size=0, flush_interval=0, stats=None,
+                 dimension_cache_size=10000, dimension_models=DIMENSION_MODELS,
+                 writer_queue_size=0, coalesce_timeout=300, response_cache=None, signals=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.writer_queue_size = writer_queue_size
+        self.stats = stats
+        self.signals = signals
+        self.response_cache = response_cache
+
+        self._dimension_cache = LRUCache(dimension_cache_size)
+        self._dimension_fields = {
+            model: self._get_natural_key_fields(model)
+            for model in dimension_models
+        }
+
+        self._coalescer = ItemCoalescer(coalesce_timeout) if coalesce_timeout else None
+        self._buffers = {}
+        self._writers = {}
+        self._flush_task = None
+        self._coalesce_task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            batch_size=settings.getint('SAVE_PIPELINE_BATCH_SIZE', 0),
+            flush_interval=settings.getfloat('SAVE_PIPELINE_FLUSH_INTERVAL', 0),
+            stats=crawler.stats,
+            dimension_cache_size=settings.getint('SAVE_PIPELINE_DIMENSION_CACHE_SIZE', 10000),
+            writer_queue_size=settings.getint('SAVE_PIPELINE_WRITER_QUEUE_SIZE', 0),
+            coalesce_timeout=settings.getfloat('SAVE_PIPELINE_COALESCE_TIMEOUT', 300),
+            response_cache=response_cache if settings.getbool('SAVE_PIPELINE_INVALIDATE_API_CACHE', True) else None,
+            signals=crawler.signals,
+        )
+
+    def open_spider(self, spider):
+        self.check_indexes()
+        self.check_columns()
+        self.load_dimension_cache()
+        if self.writer_queue_size:
+            for alias in set(APP_DB.values()):
+                self._get_writer(alias)
+        if self.batch_size and self.flush_interval:
+            self._flush_task = task.LoopingCall(self._schedule_flush)
+            self._flush_task.start(self.flush_interval, now=False)
+        if self._coalescer is not None:
+            self._coalesce_task = task.LoopingCall(self._write_coalesced, expired_only=True)
+            self._coalesce_task.start(max(self._coalescer.timeout / 10, 1), now=False)
+
+    def close_spider(self, spider):
+        for looping_call in (self._flush_task, self._coalesce_task):
+            if looping_call and looping_call.running:
+                looping_call.stop()
+        if self._coalescer is not None:
+            self._write_coalesced()
+
+        if not self._writers:
+            self.flush()
+            return
+
+        dfds = []
+        for alias, writer in self._writers.items():
+            writer.submit(self.flush, alias).addErrback(log.err, 'SavePipeline flush failed')
+            dfds.append(writer.stop())
+        self._writers = {}
+        return defer.DeferredList(dfds)
+
     def process_item(self, item, spider):
+        part = getattr(item, '_coalesce_part', None)
+        if part is not None and self._coalescer is not None:
+            merged = self._coalescer.add(item, part, spider.coalesce_parts[item.__class__])
+            if merged is None:
+                self._inc_stats('save_pipeline/coalesce/partial')
+                return item
+            self._inc_stats('save_pipeline/coalesce/complete')
+            item = merged
+        return self._write(item)
+
+    def _write(self, item):
+        alias = router.db_for_write(item.django_model)
+        if self.writer_queue_size:
+            if not self.batch_size:
+                d = self._get_writer(alias).submit(self.save_item, item)
+            else:
+                # 批量模式下，Item放入缓存后即触发，写入结果见item_saved信号
+                d = self._get_writer(alias).submit(self._buffer_item, alias, item)
+            return d.addCallback(lambda _: item)
+
+        if not self.batch_size:
+            self.save_item(item)
+        else:
+            self._buffer_item(alias, item)
+        return item
+
+    def save_item(self, item):
+        """
+        逐个写入Item
+        """
+        model = item.django_model
+        many_to_many_fields = [f.name for f in model._meta.many_to_many]
+
+        try:
+            with transaction.atomic(using=router.db_for_write(model)):
+                # Update model instance without ManyToMany Fields
+                instance, _ = model.objects.get_or_create(**{
+                    field: item.get(field)
+                    for field in item.unique_fields
+                })
+                model.objects.filter(id=instance.id).update(**self._get_fields(item, many_to_many_fields))
+
+                self._save_many_to_many(instance, item, many_to_many_fields)
+        except Exception:
+            # 事务回滚后，缓存中可能有不存在的主键
+            self._dimension_cache.clear()
+            raise
+
+        self._invalidate(model, [instance.pk])
+        self._send_item_saved([item])
+
+    def flush(self, alias=None):
+        """
+        在事务内写入缓存的Item，一个数据库一个事务
+        """
+        aliases = [alias] if alias else list(self._buffers)
+        for alias in aliases:
+            buffer = self._buffers.pop(alias, None)
+            if buffer and buffer.count:
+                self._flush_buffer(alias, buffer)
+
+    def check_indexes(self):
+        """
+        unique_fields没有索引支持时，每个Item的查询都是全表扫描
+        """
+        for item_class, fields, reason in get_missing_indexes():
+            log.msg('%s.unique_fields %s has no supporting index (%s), see `scrapy createindexes`' % (
+                item_class.__name__, fields, reason), level=log.WARNING)
+
+    def check_columns(self):
+        """
+        模型中新增的字段在已有的表中不存在时，写入会失败
+        """
+        for model, field in get_missing_columns():
+            log.msg('%s.%s does not exist in the database, see `scrapy addcolumns`' % (
+                model._meta.db_table, field.column), level=log.ERROR)
+
+    def load_dimension_cache(self):
+        """
+        从数据库批量载入维度表主键
+        """
+        for model, fields in self._dimension_fields.items():
+            try:
+                rows = list(model.objects.values_list('pk', *fields)[:self._dimension_cache.capacity])
+            except DatabaseError as e:
+                log.msg('Load dimension cache of %s failed: %s' % (model.__name__, e), level=log.WARNING)
+                continue
+            for row in rows:
+                self._dimension_cache[(model, tuple(row[1:]))] = row[0]
+
+    def _write_coalesced(self, expired_only=False):
+        """
+        写入合并超时(或所有)的部分Item
+        """
+        if expired_only:
+            items = self._coalescer.pop_expired()
+        else:
+            items = self._coalescer.pop_all()
+        self._inc_stats('save_pipeline/coalesce/expired', len(items))
+        for item in items:
+            defer.maybeDeferred(self._write, item).addErrback(log.err, 'SavePipeline write failed')
+
+    def _get_writer(self, alias):
+        if alias not in self._writers:
+            writer = DatabaseWriter(alias, self.writer_queue_size, stats=self.stats)
+            writer.start()
+            self._writers[alias] = writer
+        return self._writers[alias]
+
+    def _schedule_flush(self):
+        if not self._writers:
+            self._flush_if_due()
+            return
+        for writer in self._writers.values():
+            d = writer.submit(self._flush_if_due, writer.alias)
+            d.addErrback(log.err, 'SavePipeline flush failed')
+
+    def _flush_if_due(self, alias=None):
+        aliases = [alias] if alias else list(self._buffers)
+        for alias in aliases:
+            buffer = self._buffers.get(alias)
+            if buffer and time.time() - buffer.last_flush >= self.flush_interval:
+                self.flush(alias)
+
+    def _flush_buffer(self, alias, buffer):
+        written = {}
+        try:
+            with transaction.atomic(using=alias):
+                for model, items in buffer.models.items():
+                    written[model] = self._flush_model(model, items)
+        except Exception:
+            # 事务回滚后，缓存中可能有不存在的主键
+            self._dimension_cache.clear()
+            raise
+
+        for model, pks in written.items():
+            self._invalidate(model, pks)
+        self._send_item_saved([item for items in buffer.models.values() for item in items.values()])
+        log.msg('SavePipeline flushed %d items into [%s]' % (buffer.count, alias), level=log.DEBUG)
+        self._inc_stats('save_pipeline/flush_count')
+        self._inc_stats('save_pipeline/item_flushed', buffer.count)
+
+    def _buffer_item(self, alias, item):
+        """
+        按Model以及unique_fields合并缓存Item，合并结果与依次写入相同：
+        后到的字段覆盖先到的字段，空的ManyToMany字段不覆盖
+        """
+        buffer = self._buffers.setdefault(alias, ItemBuffer())
         model = item.django_model
+        items = buffer.models.setdefault(model, OrderedDict())
+        unique_fields = getattr(item, 'unique_fields', ())
+        key = self._get_key(model, unique_fields, item) if unique_fields else object()
+
+        if key in items:
+            merge_item(items[key], item)
+        else:
+            items[key] = item.copy()
+        buffer.count += 1
+
+        if buffer.count >= self.batch_size:
+            self.flush(alias)
+        elif self.flush_interval:
+            self._flush_if_due(alias)
+
+    def _flush_model(self, model, items):
+        """
+        写入一个Model的Item，返回更新的已存在对象的主键
+        """
         many_to_many_fields = [f.name for f in model._meta.many_to_many]
+        unique_fields = getattr(items.values()[0], 'unique_fields', ())
+
+        existing = self._get_existing_pks(model, unique_fields, items.keys()) if unique_fields else {}
+
+        # 新建对象，直接带上所有字段
+        created_keys = [key for key in items if key not in existing]
+        model.objects.bulk_create([
+            model(**self._get_fields(items[key], many_to_many_fields))
+            for key in created_keys
+        ], batch_size=QUERY_CHUNK_SIZE)
+
+        # 已存在对象逐条更新，但共用一个事务
+        for key, pk in existing.items():
+            model.objects.filter(pk=pk).update(**self._get_fields(items[key], many_to_many_fields))
+
+        updated = list(existing.values())
+        if not any(items[key].get(field) for key in items for field in many_to_many_fields):
+            return updated
+        if unique_fields:
+            existing.update(self._get_existing_pks(model, unique_fields, created_keys))
+        for key, item in items.items():
+            if key in existing:
+                self._save_many_to_many(model(pk=existing[key]), item, many_to_many_fields)
+        return updated
+
+    def _invalidate(self, model, pks):
+        """
+        使接口响应缓存失效，失败时不影响写入(缓存最多在过期时间后更新)
+        """
+        if self.response_cache is None:
+            return
+        try:
+            count = self.response_cache.invalidate(model, pks)
+        except Exception as e:
+            log.msg('Invalidate API cache of %s failed: %s' % (model.__name__, e), level=log.WARNING)
+            return
+        if count:
+            self._inc_stats('save_pipeline/api_cache_invalidated', count)
 
-        # Update model instance without ManyToMany Fields
-        instance, _ = model.objects.get_or_create(**{
-            field: item.get(field)
-            for field in item.unique_fields
-        })
+    def _get_existing_pks(self, model, unique_fields, keys):
+        """
+        批量查询已存在的对象，返回 {key: pk}
+        """
+        existing = {}
+        chunk_size = max(QUERY_CHUNK_SIZE // len(unique_fields), 1)
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            if len(unique_fields) == 1:
+                query = Q(**{'%s__in' % unique_fields[0]: [key[0] for key in chunk]})
+            else:
+                query = Q()
+                for key in chunk:
+                    query |= Q(**dict(zip(unique_fields, key)))
+            for row in model.objects.filter(query).values_list('pk', *unique_fields):
+                existing[self._get_key(model, unique_fields, dict(zip(unique_fields, row[1:])))] = row[0]
+        return existing
+
+    def _get_key(self, model, unique_fields, values):
+        # Item中的值未经过类型转换(如 '2014' 与 2014)，需要统一之后才能比较
+        return tuple(
+            model._meta.get_field(field).to_python(values.get(field))
+            for field in unique_fields
+        )
+
+    def _get_fields(self, item, many_to_many_fields):
         fields = dict(item.copy())
         for field in many_to_many_fields:
             if field in fields:
                 fields.pop(field)
-        model.objects.filter(id=instance.id).update(**fields)
+        # QuerySet.update不会更新auto_now字段(如update_time)，需要手动设置
+        for field in item.django_model._meta.fields:
+            if getattr(field, 'auto_now', False):
+                fields[field.name] = timezone.now()
+        return fields
 
-        # Create ManyToMany relationship instance
-        for field in many_to_many_fields:
-            if not item.get(field):
+    def _save_many_to_many(self, instance, item, many_to_many_fields):
+        """
+        Create ManyToMany relationship instance
+
+        直接在中间表上按主键集合同步，每个字段的查询数与关联数量无关
+        """
+        model = instance.__class__
+        for field_name in many_to_many_fields:
+            if not item.get(field_name):
                 continue
-            many_to_many_objs = getattr(instance, field)
-            old_set = set(many_to_many_objs.all())
-            new_set = set([
-                model._meta.get_field(field).rel.to.objects.get_or_create(**value)[0]
-                for value in item[field]
-            ])
-            for obj in new_set - old_set:
-                many_to_many_objs.add(obj)
-            for obj in old_set - new_set:
-                many_to_many_objs.remove(obj)
+            field = model._meta.get_field(field_name)
+            through = field.rel.through
+            source = through._meta.get_field(field.m2m_field_name()).attname
+            target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+            # 指向自身的对称关系(如相关电影)，需要同时维护反向记录
+            symmetrical = field.rel.to == model and field.rel.symmetrical
+
+            old_set = set(through.objects.filter(**{source: instance.pk}).values_list(target, flat=True))
+            new_set = set(self._get_related_pks(field.rel.to, item[field_name]))
+            added, removed = list(new_set - old_set), list(old_set - new_set)
+
+            links = [through(**{source: instance.pk, target: pk}) for pk in added]
+            if symmetrical and added:
+                reversed_existing = set(through.objects.filter(**{
+                    '%s__in' % source: added,
+                    target: instance.pk,
+                }).values_list(source, flat=True))
+                links.extend([
+                    through(**{source: pk, target: instance.pk})
+                    for pk in added if pk != instance.pk and pk not in reversed_existing
+                ])
+            through.objects.bulk_create(links, batch_size=QUERY_CHUNK_SIZE)
+
+            if removed:
+                through.objects.filter(**{source: instance.pk, '%s__in' % target: removed}).delete()
+                if symmetrical:
+                    through.objects.filter(**{'%s__in' % source: removed, target: instance.pk}).delete()
+
+    def _get_related_pks(self, model, values):
+        """
+        批量获取ManyToMany关联对象的主键，不存在的对象批量创建
+        """
+        pks = []
+        missing = OrderedDict()
+        for value in values:
+            key = self._get_dimension_key(model, value)
+            if key is not None:
+                pk = self._dimension_cache.get(key)
+                if pk is not None:
+                    self._inc_stats('save_pipeline/dimension_cache/hit')
+                    pks.append(pk)
+                    continue
+                self._inc_stats('save_pipeline/dimension_cache/miss')
+            missing.setdefault(tuple(sorted(value)), []).append(value)
+
+        for fields, group in missing.items():
+            pks.extend(self._get_or_create_pks(model, fields, group))
+        return pks
+
+    def _get_or_create_pks(self, model, fields, values):
+        keys = list(OrderedDict.fromkeys(
+            self._get_key(model, fields, value) for value in values
+        ))
+        existing = self._get_existing_pks(model, fields, keys)
+
+        created_keys = [key for key in keys if key not in existing]
+        model.objects.bulk_create([
+            model(**dict(zip(fields, key)))
+            for key in created_keys
+        ], batch_size=QUERY_CHUNK_SIZE)
+        if created_keys:
+            if fields == (model._meta.pk.name,):
+                existing.update((key, key[0]) for key in created_keys)
+            else:
+                existing.update(self._get_existing_pks(model, fields, created_keys))
+
+        if self._dimension_fields.get(model) == fields:
+            for key, pk in existing.items():
+                self._dimension_cache[(model, key)] = pk
+        return [existing[key] for key in keys]
+
+    def _get_dimension_key(self, model, value):
+        fields = self._dimension_fields.get(model)
+        if fields is None or sorted(value) != sorted(fields):
+            return None
+        return (model, tuple(
+            model._meta.get_field(field).to_python(value[field])
+            for field in fields
+        ))
+
+    def _get_natural_key_fields(self, model):
+        return tuple(
+            f.name for f in model._meta.fields
+            if f.unique and not isinstance(f, AutoField)
+        )
+
+    def _in_writer_thread(self):
+        return isinstance(threading.current_thread(), DatabaseWriter)
+
+    def _send_item_saved(self, items):
+        if not self.signals:
+            return
+        for item in items:
+            if self._in_writer_thread():
+                reactor.callFromThread(self.signals.send_catch_log, signal=item_saved, item=item)
+            else:
+                self.signals.send_catch_log(signal=item_saved, item=item)
+
+    def _inc_stats(self, key, count=1):
+        if not self.stats:
+            return
+        # StatsCollector不是线程安全的，写线程中的统计交给reactor线程更新
+        if self._in_writer_thread():
+            reactor.callFromThread(self.stats.inc_value, key, count)
+        else:
+            self.stats.inc_value(key, count)
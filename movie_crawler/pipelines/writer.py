@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import Queue
+import threading
+import time
+
+from django.db import connections
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+
+class DatabaseWriter(threading.Thread):
+    """
+    数据库写线程
+
+    写任务交给本线程执行，同时最多有`queue_size`个未完成的任务，
+    超过时`submit`返回的Deferred等待前面的任务完成后才入队，
+    以此限制内存中等待写入的Item数量，reactor线程不会被阻塞。
+    任务的结果通过`submit`返回的Deferred在reactor线程中返回。
+    """
+
+    def __init__(self, alias, queue_size, stats=None):
+        super(DatabaseWriter, self).__init__(name='DatabaseWriter-%s' % alias)
+        self.daemon = True
+        self.alias = alias
+        self.stats = stats
+        self._queue = Queue.Queue()
+        self._semaphore = defer.DeferredSemaphore(queue_size)
+        self._stopped = defer.Deferred()
+
+    def submit(self, func, *args, **kwargs):
+        return self._semaphore.run(self._enqueue, func, args, kwargs)
+
+    def stop(self):
+        """
+        执行完已提交的任务后退出，返回的Deferred在线程退出后触发
+        """
+        # 等待中的任务按提交顺序先于结束标记入队
+        self._semaphore.acquire().addCallback(lambda _: self._queue.put_nowait(None))
+        return self._stopped
+
+    def _enqueue(self, func, args, kwargs):
+        d = defer.Deferred()
+        self._queue.put_nowait((func, args, kwargs, d))
+        self._set_stats('queue_depth', self._queue.qsize())
+        return d
+
+    def run(self):
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    break
+                self._run_job(*job)
+        finally:
+            connections[self.alias].close()
+            reactor.callFromThread(self._stopped.callback, None)
+
+    def _run_job(self, func, args, kwargs, d):
+        start = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            reactor.callFromThread(d.errback, Failure())
+        else:
+            reactor.callFromThread(d.callback, result)
+        latency = time.time() - start
+        reactor.callFromThread(self._record_latency, latency, self._queue.qsize())
+
+    def _record_latency(self, latency, queue_depth):
+        if not self.stats:
+            return
+        self._set_stats('queue_depth', queue_depth)
+        self._set_stats('write_latency', latency)
+        self.stats.max_value(self._stats_key('max_write_latency'), latency)
+        self.stats.inc_value(self._stats_key('write_time'), latency)
+        self.stats.inc_value(self._stats_key('write_count'))
+
+    def _set_stats(self, key, value):
+        if self.stats:
+            self.stats.set_value(self._stats_key(key), value)
+
+    def _stats_key(self, key):
+        return 'save_pipeline/writer/%s/%s' % (self.alias, key)
+
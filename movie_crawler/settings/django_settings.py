@@ -62,3 +62,28 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = (
     os.path.join(BASE_DIR, "static"),
 )
+
+# 接口响应缓存，爬虫写入后通过它使缓存失效，需要爬虫与接口进程共享(不能使用locmem)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        # FileBasedCache每次写入都遍历整个目录，条目多时很慢，使用SQLite文件
+        'BACKEND': 'movie_crawler.api.cache_backend.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'api_cache.sqlite'),
+        'OPTIONS': {'MAX_ENTRIES': 100000, 'CULL_EVERY': 1000},
+    },
+}
+API_CACHE = 'api'
+# 响应缓存的过期时间(秒)，写入后立即失效，与过期时间无关
+API_CACHE_TIMEOUT = 24 * 3600
+
+# 批量接口每次请求最多的ID数，以及每次从数据库读取的对象数
+API_BULK_MAX_IDS = 10000
+API_BULK_CHUNK_SIZE = 500
+
+# 测试中django_dynamic_fixture无法为没有默认值的JSONField(如艺人的family)生成数据
+DDF_FIELD_FIXTURES = {
+    'jsonfield.fields.JSONField': {'ddf_fixture': lambda: []},
+}
@@ -21,30 +21,147 @@ SPIDER_MODULES = [
     'movie_crawler.spiders.mtime',
     'movie_crawler.spiders.proxy'
 ]
+COMMANDS_MODULE = 'movie_crawler.commands'
 
 
 DUPEFILTER_DEBUG = False
+# 默认使用Scrapy的去重；大规模爬取可以改用布隆过滤器去重(容量及误判率决定内存占用)：
+# -s DUPEFILTER_CLASS=movie_crawler.dupefilter.BloomDupeFilter
+# DUPEFILTER_PATH为空时只在内存中，设置后保存在文件中，重启后继续使用；
+# 持久化的去重记录必须与检查点(CHECKPOINT_DIR)一起使用，否则上次未完成的请求重启后会被当作重复而丢弃
+DUPEFILTER_CLASS = 'scrapy.dupefilter.RFPDupeFilter'
+DUPEFILTER_CAPACITY = 10000000
+DUPEFILTER_ERROR_RATE = 0.001
+DUPEFILTER_PATH = ''
+DUPEFILTER_STATS_INTERVAL = 60
+
+# 豆瓣页面解析器：beautifulsoup 或 lxml(BeautifulSoup兼容层，结果一致，速度更快)
+DOUBAN_PARSER = 'lxml'
+# 豆瓣电影及艺人页面在子进程中解析的进程数，0表示在爬虫进程中解析；
+# 同时解析的页面数不超过PARSE_POOL_MAX_IN_FLIGHT，0表示进程数的2倍；
+# 超过PARSE_POOL_TIMEOUT秒没有结果的页面按解析出错处理，0表示不限
+PARSE_POOL_PROCESSES = 0
+PARSE_POOL_MAX_IN_FLIGHT = 0
+PARSE_POOL_TIMEOUT = 60
+
+# 时光网电影列表：并发浏览器数，以及预先启动的备用浏览器数
+MTIME_BROWSER_WORKERS = 4
+MTIME_BROWSER_STANDBY = 1
+# 时光网电影列表获取方式：browser(浏览器渲染)或ajax(直接请求搜索服务)，
+# 搜索服务URL模板，为空时使用爬虫中的默认值，参数为{genre_value}及{page}
+MTIME_LISTING_MODE = 'browser'
+MTIME_LISTING_URL = ''
 
 DOWNLOAD_TIMEOUT = 60
+# 启用自适应限速时只作为新下载槽的初始间隔
 DOWNLOAD_DELAY = 2
 DOWNLOADER_MIDDLEWARES = {
     # 'movie_crawler.middlewares.useragent.UserAgentMiddleware': 100,
     # 'movie_crawler.middlewares.proxy.ProxyMiddleware': 101,
     # 'scrapy.contrib.downloadermiddleware.useragent.UserAgentMiddleware': None,
+    # 位于HttpCompressionMiddleware(590)之后，按解压后的响应体计算哈希
+    'movie_crawler.middlewares.revalidation.RevalidationMiddleware': 580,
+    # 位于ProxyMiddleware之后、RedirectMiddleware(600)之前，能看到代理及验证码跳转
+    'movie_crawler.middlewares.throttle.AdaptiveThrottleMiddleware': 650,
 }
+# 按(域名, 代理)自适应限速：连续成功THROTTLE_WINDOW次后缩短间隔/增加并发，
+# 遇到封禁状态码、验证码跳转或超时时减半并发/加倍间隔。默认关闭，使用全局的DOWNLOAD_DELAY：
+# scrapy crawl douban_movie -s THROTTLE_ENABLED=1
+THROTTLE_ENABLED = False
+THROTTLE_START_DELAY = DOWNLOAD_DELAY
+THROTTLE_MIN_DELAY = 0
+THROTTLE_MAX_DELAY = 60
+THROTTLE_MAX_CONCURRENCY = 8
+THROTTLE_WINDOW = 20
+THROTTLE_BACKOFF_HTTP_CODES = [403, 429, 503]
+THROTTLE_CAPTCHA_PATTERNS = [r'sec\.douban\.com', r'/misc/sorry', r'captcha']
+THROTTLE_STATS_INTERVAL = 10
+# 实体页面的ETag/Last-Modified及响应体哈希，再次爬取时发送条件请求，为空时不启用，例如
+# scrapy crawl mtime_movie -s REVALIDATION_FILE=validators.sqlite
+REVALIDATION_FILE = ''
 
 PROXY_LIST = os.path.join(os.path.dirname(__file__), '..', 'proxy_list.txt')
+# 代理爬虫的来源页面，以及抓取到的代理(未经验证，见scrapy checkproxies)首次/最近发现时间
+PROXY_SOURCE_URLS = ['http://checkerproxy.net/all_proxy']
+PROXY_STORE_FILE = os.path.join(os.path.dirname(__file__), '..', 'proxy_store.json')
+# 代理表现记录，以及失败代理的冷却时间(秒)
+PROXY_SCORES_FILE = os.path.join(os.path.dirname(__file__), '..', 'proxy_scores.json')
+PROXY_COOLDOWN = 60
+PROXY_MAX_COOLDOWN = 3600
+# scrapy checkproxies：候选代理、探测URL、并发数、超时(秒)，以及每个代理的检查结果
+PROXY_CANDIDATE_LIST = os.path.join(os.path.dirname(__file__), '..', 'unfilter_proxy.txt')
+PROXY_META_FILE = os.path.join(os.path.dirname(__file__), '..', 'proxy_list.json')
+PROXY_PROBE_URL = 'http://movie.douban.com/'
+PROXY_CHECK_CONCURRENCY = 50
+PROXY_CHECK_TIMEOUT = 10
+
+SPIDER_MIDDLEWARES = {
+    'movie_crawler.middlewares.checkpoint.CheckpointMiddleware': 50,
+    'movie_crawler.middlewares.shard.ShardMiddleware': 52,
+    'movie_crawler.middlewares.dedupe.EntityDedupeMiddleware': 55,
+    'movie_crawler.middlewares.freshness.FreshnessMiddleware': 60,
+}
+# 在TTL(秒)内更新过的电影、艺人及长评不再爬取，未设置或为0时总是爬取(默认)，例如
+# scrapy crawl douban_movie -s FRESHNESS_TTL='{"movie": 604800, "celebrity": 2592000, "review": 2592000}'
+FRESHNESS_TTL = {}
+# 爬取进度检查点目录，为空时不启用，例如 scrapy crawl douban_movie -s CHECKPOINT_DIR=.checkpoint
+# 检查点每`CHECKPOINT_BATCH_SIZE`条或每`CHECKPOINT_FLUSH_INTERVAL`秒批量写入一次
+CHECKPOINT_DIR = ''
+CHECKPOINT_BATCH_SIZE = 1000
+CHECKPOINT_FLUSH_INTERVAL = 5
+# 同一个爬虫的不同任务使用不同的检查点文件(<spider>.<job>.sqlite)；爬取正常结束后检查点被删除，
+# CHECKPOINT_RESET=1 在启动时丢弃之前的检查点重新开始
+CHECKPOINT_JOB = ''
+CHECKPOINT_RESET = False
+# 内存中已完成请求的布隆过滤器容量(误判时查询检查点数据库确认)
+CHECKPOINT_CAPACITY = 10000000
+# 多进程分片爬取，由`scrapy crawlsharded <spider> -w N`为每个进程设置SHARD_FRONTIER、SHARD_INDEX及SHARD_COUNT，
+# SHARD_WORKERS为默认进程数(0表示CPU核数)；各进程每SHARD_POLL_INTERVAL秒从共享队列中取走至多SHARD_BATCH_SIZE个请求
+SHARD_FRONTIER = ''
+SHARD_INDEX = 0
+SHARD_COUNT = 1
+SHARD_WORKERS = 0
+SHARD_POLL_INTERVAL = 1
+SHARD_BATCH_SIZE = 100
 
 ITEM_PIPELINES = {
     'movie_crawler.pipelines.save.SavePipeline': 100,
 }
 
+# SavePipeline批量写入，0表示逐个写入
+SAVE_PIPELINE_BATCH_SIZE = 0
+SAVE_PIPELINE_FLUSH_INTERVAL = 5
+SAVE_PIPELINE_DIMENSION_CACHE_SIZE = 10000
+# 每个数据库一个写线程，0表示在reactor线程中写入
+SAVE_PIPELINE_WRITER_QUEUE_SIZE = 0
+# 部分Item合并超时时间(秒)，0表示不合并
+SAVE_PIPELINE_COALESCE_TIMEOUT = 300
+# 写入后使接口响应缓存失效(见django_settings的API_CACHE)
+SAVE_PIPELINE_INVALIDATE_API_CACHE = True
+
 USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_8_3) AppleWebKit/536.5 (KHTML, like Gecko) Chrome/19.0.1084.54 Safari/536.5'
 COOKIES_ENABLED = True
+# HTTP缓存，默认关闭。开启后所有响应压缩后按内容去重保存在一个SQLite文件中
+# (.scrapy/<HTTPCACHE_DIR>/httpcache.sqlite)，用`scrapy compactcache`清理过期响应：
+# scrapy crawl douban_movie -s HTTPCACHE_ENABLED=1
 HTTPCACHE_ENABLED = False
+HTTPCACHE_STORAGE = 'movie_crawler.httpcache.SQLiteCacheStorage'
+HTTPCACHE_IGNORE_HTTP_CODES = [304, 403, 407, 429, 500, 502, 503, 504]
+# 按请求URL设置缓存有效期(秒)，第一个匹配的规则生效，未匹配时使用HTTPCACHE_EXPIRATION_SECS，0表示永不过期
+HTTPCACHE_EXPIRATION_SECS = 24 * 3600
+HTTPCACHE_TTLS = [
+    (r'^https?://movie\.douban\.com/subject/\d+/', 7 * 24 * 3600),
+    (r'^https?://movie\.douban\.com/celebrity/\d+/', 30 * 24 * 3600),
+    (r'^https?://movie\.douban\.com/review/\d+/', 30 * 24 * 3600),
+    (r'^https?://movie\.mtime\.com/\d+/', 7 * 24 * 3600),
+    (r'^https?://people\.mtime\.com/\d+/', 30 * 24 * 3600),
+    (r'^https?://service\.library\.mtime\.com/Movie\.api', 24 * 3600),
+    (r'^https?://(www\.)?imdb\.com/title/', 7 * 24 * 3600),
+]
 
 DEPTH_STATS_VERBOSE = True
 
 EXTENSIONS = {
     "scrapy_sentry.extensions.Errors":10,
+    "movie_crawler.extensions.DupeFilterStats": 500,
 }
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+项目自定义的Scrapy信号
+"""
+
+# SavePipeline将Item提交到数据库之后发送，参数: item
+item_saved = object()
@@ -4,11 +4,12 @@ from __future__ import unicode_literals
 from random import randint
 from urllib import quote
 
+from scrapy import signals
 from scrapy.contrib.spiders import CrawlSpider, Rule
 from scrapy.contrib.linkextractors import LinkExtractor
 from scrapy.contrib.linkextractors.sgml import SgmlLinkExtractor
 from scrapy.selector import Selector
-from scrapy.http import Request
+from scrapy.http import HtmlResponse, Request, TextResponse
 
 from django.db.utils import IntegrityError
 from bs4 import BeautifulSoup
@@ -17,6 +18,8 @@ from movie_crawler.items.douban import (
     MovieItem, AreaItem, GenreItem, AwardItem,
     TagItem, CelebrityItem, PhotoItem, CommentItem
 )
+from movie_crawler.utils.lxmlsoup import LxmlSoup
+from movie_crawler.utils.parsepool import ParsePool
 
 
 RATING = {
@@ -42,14 +45,55 @@ class MovieSpider(CrawlSpider):
     celebrity_photo_url_extractor = SgmlLinkExtractor(allow=(r'/celebrity/\d+/photo/\d+/$'))
     celebrity_link = 'http://movie.douban.com/celebrity/%s/'
     celebrity_types = ['stars', 'directors', 'writers']
+    # 页面解析器，见`DOUBAN_PARSER`
+    parser = 'beautifulsoup'
+    # 解析进程池，见`PARSE_POOL_PROCESSES`
+    parse_pool = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(MovieSpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.parser = crawler.settings.get('DOUBAN_PARSER', cls.parser)
+        spider.parse_pool = ParsePool.from_settings(crawler.settings)
+        crawler.signals.connect(spider.spider_closed, signals.spider_closed)
+        return spider
+
+    def spider_closed(self, spider):
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+
+    def parse_in_pool(self, response, extract, build):
+        """
+        `extract`从页面提取普通的数据，`build`由数据生成Item及请求；
+        启用解析进程池时`extract`在子进程中执行，返回Deferred，否则直接返回生成器
+        """
+        if self.parse_pool is None:
+            return build(extract(response))
+        d = self.parse_pool.submit(
+            extract_in_worker, extract.__name__, self.parser, response.url, response.body, response.encoding
+        )
+        d.addCallback(build)
+        return d
+
+    def make_soup(self, response):
+        """
+        构建文档树
+
+        - beautifulsoup: BeautifulSoup
+        - lxml: 基于lxml的BeautifulSoup兼容层，速度更快
+        """
+        if self.parser == 'lxml':
+            return LxmlSoup(response.body, encoding=getattr(response, 'encoding', 'utf-8'))
+        if isinstance(response, TextResponse):
+            return BeautifulSoup(response.body_as_unicode())
+        return BeautifulSoup(response.body)
 
     def parse(self, response):
-        soup = BeautifulSoup(response.body)
         tag_urls = self.tag_url_extractor.extract_links(response)
         return [Request(tag_url.url, callback=self.parse_page) for tag_url in tag_urls]
 
     def parse_page(self, response):
-        soup = BeautifulSoup(response.body)
+        soup = self.make_soup(response)
         try:
             page_num = soup.find('span', attrs={'class': 'thispage'}).attrs['data-total-page']
         except AttributeError:
@@ -65,7 +109,13 @@ class MovieSpider(CrawlSpider):
         """
         电影基本信息
         """
-        soup = BeautifulSoup(response.body)
+        return self.parse_in_pool(response, self.extract_movie_base, self.build_movie_base)
+
+    def extract_movie_base(self, response):
+        """
+        从电影页面提取数据，只返回普通的dict/list，可以在解析进程中执行
+        """
+        soup = self.make_soup(response)
         movie = MovieItem()
 
         # ID
@@ -86,6 +136,20 @@ class MovieSpider(CrawlSpider):
         # 标签
         movie = self.add_tags(soup, movie)
 
+        return {
+            'movie': dict(movie),
+            'cover': self.extract_cover(self.fillup_movie_cover_image, soup, movie),
+            'awards': [dict(award) for award in self.get_movie_awards(soup, movie)],
+            'comments': [dict(comment) for comment in self.get_short_comments(soup, movie)],
+            'review_ids': self.get_review_ids(soup),
+        }
+
+    def build_movie_base(self, data):
+        """
+        由`extract_movie_base`的结果生成Item及请求
+        """
+        movie = MovieItem(data['movie'])
+
         # IMDB 评分
         try:
             id_imdb = movie['id_imdb']
@@ -96,21 +160,19 @@ class MovieSpider(CrawlSpider):
             request.meta['item'] = movie
             yield request
 
-        cover = self.fillup_movie_cover_image(soup, movie)
-        yield cover
+        if data['cover']:
+            yield PhotoItem(data['cover'])
 
         # 获奖
-        awards = self.get_movie_awards(soup, movie)
-        for award in awards:
-            yield award
+        for award in data['awards']:
+            yield AwardItem(award)
 
         # 短评
-        short_comments = self.get_short_comments(soup, movie)
-        for comment in short_comments:
-            yield comment
+        for comment in data['comments']:
+            yield CommentItem(comment)
 
         # 长评
-        review_ids = self.get_review_ids(soup)
+        review_ids = data['review_ids']
         requests = [Request('http://movie.douban.com/review/%s/' % review_id, callback=self.parse_review) for review_id in review_ids]
         for request in requests:
             request.meta['item'] = movie
@@ -165,6 +227,15 @@ class MovieSpider(CrawlSpider):
             pass
         return movie
 
+    def extract_cover(self, fillup, soup, item):
+        """
+        没有封面时返回None，不影响页面中其他数据
+        """
+        try:
+            return dict(fillup(soup, item))
+        except AttributeError:
+            return None
+
     def fillup_movie_cover_image(self, soup, movie_item):
         return PhotoItem(
             movie_id=movie_item["id"],
@@ -349,7 +420,7 @@ class MovieSpider(CrawlSpider):
         return celebrity_ids
 
     def parse_review(self, response):
-        soup = BeautifulSoup(response.body)
+        soup = self.make_soup(response)
         id = response.url.split('/')[-2]
         if response.status != 200:
             return
@@ -378,7 +449,7 @@ class MovieSpider(CrawlSpider):
         return comment
 
     def parse_movie_photo(self, response):
-        soup = BeautifulSoup(response.body)
+        soup = self.make_soup(response)
         try:
             page_num = soup.find('span', attrs={'class': 'thispage'}).attrs['data-total-page']
         except:
@@ -410,21 +481,30 @@ class MovieSpider(CrawlSpider):
         yield photo
 
     def parse_celebrity(self, response):
-        soup = BeautifulSoup(response.body)
+        return self.parse_in_pool(response, self.extract_celebrity, self.build_celebrity)
+
+    def extract_celebrity(self, response):
+        soup = self.make_soup(response)
         celebrity = CelebrityItem()
 
         # ID
         celebrity['id'] = int(response.url.split('/')[-2])
 
         celebrity = self.add_celebrity_base(soup, celebrity)
-        yield celebrity
+        return {
+            'celebrity': dict(celebrity),
+            'cover': self.extract_cover(self.fillup_celebrity_cover_image, soup, celebrity),
+            'awards': [dict(award) for award in self.get_celebrity_awards(soup, celebrity)],
+        }
+
+    def build_celebrity(self, data):
+        yield CelebrityItem(data['celebrity'])
 
-        cover = self.fillup_celebrity_cover_image(soup, celebrity)
-        yield cover
+        if data['cover']:
+            yield PhotoItem(data['cover'])
 
-        awards = self.get_celebrity_awards(soup, celebrity)
-        for award in awards:
-            yield award
+        for award in data['awards']:
+            yield AwardItem(award)
 
         #yield Request('http://movie.douban.com/celebrity/%s/photos/' % id, callback=self.parse_celebrity_photo)
 
@@ -519,7 +599,7 @@ class MovieSpider(CrawlSpider):
             return awards
 
     def parse_celebrity_photo(self, response):
-        soup = BeautifulSoup(response.body)
+        soup = self.make_soup(response)
         try:
             page_num = soup.find('span', attrs={'class': 'thispage'}).attrs['data-total-page']
         except:
@@ -532,7 +612,7 @@ class MovieSpider(CrawlSpider):
 
     def parse_celebrity_photo_base(self, response):
         photo = PhotoItem()
-        soup = BeautifulSoup(response.body)
+        soup = self.make_soup(response)
         try:
             info_li = soup.find('ul', attrs={'class': 'poster-info'}).findAll('li')
         except AttributeError:
@@ -551,7 +631,7 @@ class MovieSpider(CrawlSpider):
 
     def parse_rating_imdb(self, response):
         movie = response.meta['item']
-        soup = BeautifulSoup(response.body)
+        soup = self.make_soup(response)
         try:
             rating_imdb = soup.find('div', attrs={'class': 'titlePageSprite star-box-giga-star'}).text
         except AttributeError:
@@ -559,3 +639,19 @@ class MovieSpider(CrawlSpider):
         else:
             movie['rating_imdb'] = rating_imdb
             yield movie
+
+
+# 解析进程中按解析器缓存的爬虫实例
+_worker_spiders = {}
+
+
+def extract_in_worker(method, parser, url, body, encoding):
+    """
+    在解析进程中执行爬虫的extract_*方法
+    """
+    spider = _worker_spiders.get(parser)
+    if spider is None:
+        spider = _worker_spiders[parser] = MovieSpider()
+        spider.parser = parser
+    response = HtmlResponse(url=url, body=body, encoding=encoding)
+    return getattr(spider, method)(response)
@@ -1,23 +1,27 @@
 # coding: utf-8
 from __future__ import unicode_literals
-from urlparse import urljoin, urlparse, urlunparse
+from urlparse import urljoin
 from datetime import datetime
-import time
+import Queue
 import json
 import os
+import re
+import threading
 
-from scrapy import log
+from scrapy import log, signals
 from scrapy import Request
+from scrapy.exceptions import DontCloseSpider
 from scrapy.spider import Spider
 from scrapy.selector import Selector
-from selenium import webdriver
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.common.exceptions import TimeoutException
 from selenium.common.exceptions import NoSuchElementException
+from twisted.internet import reactor
 
 from movie_crawler.items.mtime import MovieItem, CharacterItem, GenreItem, CelebrityItem
 from movie_crawler.middlewares.proxy import ProxyMiddleware
 from movie_crawler.utils import DictIgnoreSpace
+from movie_crawler.utils.browserpool import BrowserPool, phantomjs_factory
 
 
 class MovieSpider(Spider):
@@ -34,10 +38,76 @@ class MovieSpider(Spider):
     "Ajax_CrossDomain=1&Ajax_RequestUrl=http%3A%2F%2Fmovie.mtime.com%2F12468%2F&t=2014871"
     "137882676&Ajax_CallBackArgument0={movie_id}")
 
+    # 电影列表的获取方式：
+    # - browser: 浏览器渲染列表页，见SeleniumSpider
+    # - ajax: 直接请求列表页背后的搜索服务(JSONP)
+    listing_mode = "browser"
+    listing_jsonp_url = ("http://service.channel.mtime.com/service/search.mcs?Ajax_CallBack=true&"
+    "Ajax_CallBackType=Mtime.Channel.Pages.SearchService&Ajax_CallBackMethod=SearchMovieByCategory&"
+    "Ajax_CrossDomain=1&Ajax_RequestUrl=http%3A%2F%2Fmovie.mtime.com%2Fmovie%2Fsearch%2Fsection%2F&"
+    "Ajax_CallBackArgument0=&Ajax_CallBackArgument1=0&Ajax_CallBackArgument2=0&Ajax_CallBackArgument3=0&"
+    "Ajax_CallBackArgument4={genre_value}&Ajax_CallBackArgument5=0&Ajax_CallBackArgument6=0&"
+    "Ajax_CallBackArgument7=0&Ajax_CallBackArgument8=&Ajax_CallBackArgument9=0&Ajax_CallBackArgument10=0&"
+    "Ajax_CallBackArgument11=0&Ajax_CallBackArgument12=0&Ajax_CallBackArgument13=0&Ajax_CallBackArgument14=1&"
+    "Ajax_CallBackArgument15=0&Ajax_CallBackArgument16=1&Ajax_CallBackArgument17=4&"
+    "Ajax_CallBackArgument18={page}&Ajax_CallBackArgument19=0")
+    movie_url_re = re.compile(r"^http://movie\.mtime\.com/\d+/?$")
+
+    # 电影数据分散在多个页面中，各页面返回的部分Item由SavePipeline合并后写入
+    coalesce_parts = {
+        MovieItem: ("base", "rating", "credits", "detail", "plots"),
+    }
+
+    # 浏览器方式爬取电影列表时才创建，见`get_selenium_spider`
+    selenium_spider = None
+    browser_workers = 1
+    browser_standby = 1
 
-    def __init__(self, *args, **kwargs):
-        self.selenium_spider = SeleniumSpider()
-        super(MovieSpider, self).__init__(*args, **kwargs)
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(MovieSpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.listing_mode = crawler.settings.get("MTIME_LISTING_MODE", cls.listing_mode)
+        if crawler.settings.get("SHARD_FRONTIER"):
+            # 分片爬取时列表页需要经过ShardMiddleware分配，浏览器方式无法分片
+            spider.listing_mode = "ajax"
+        spider.listing_jsonp_url = crawler.settings.get("MTIME_LISTING_URL") or cls.listing_jsonp_url
+        spider.browser_workers = crawler.settings.getint("MTIME_BROWSER_WORKERS", 1)
+        spider.browser_standby = crawler.settings.getint("MTIME_BROWSER_STANDBY", 1)
+        crawler.signals.connect(spider.spider_idle, signals.spider_idle)
+        crawler.signals.connect(spider.spider_closed, signals.spider_closed)
+        return spider
+
+    def spider_idle(self, spider):
+        # 浏览器仍在爬取电影列表时不关闭爬虫
+        if self.selenium_spider is not None and self.selenium_spider.running:
+            raise DontCloseSpider
+
+    def spider_closed(self, spider):
+        if self.selenium_spider is not None:
+            self.selenium_spider.stop()
+
+    def get_selenium_spider(self):
+        """
+        浏览器与下载器共用ProxyMiddleware的代理池，浏览器遇到的失败代理
+        同样进入冷却期，代理表现由下载器的ProxyMiddleware在关闭时保存
+        """
+        if self.selenium_spider is None:
+            self.selenium_spider = SeleniumSpider(
+                workers=self.browser_workers,
+                standby=self.browser_standby,
+                proxy_middleware=self._get_downloader_proxy_middleware(),
+            )
+        return self.selenium_spider
+
+    def _get_downloader_proxy_middleware(self):
+        crawler = getattr(self, "_crawler", None)
+        engine = getattr(crawler, "engine", None)
+        if engine is None:
+            return None
+        for middleware in engine.downloader.middleware.middlewares:
+            if isinstance(middleware, ProxyMiddleware):
+                return middleware
+        return None
 
     def parse(self, response):
         """
@@ -49,15 +119,94 @@ class MovieSpider(Spider):
         for genre_title in response.css("div#typePickerRegion a::text").extract():
             yield GenreItem(title=genre_title)
 
-        for genre_value in response.css("div#typePickerRegion a::attr(cvalue)").extract()[genre_index:]:
-            for movie in self.selenium_spider.crawl_movie_list_by(genre_value, genre_index, page):
-                yield Request(movie, callback=self.parse_movie_base)
-            genre_index += 1
-            page = 1
+        genre_values = response.css("div#typePickerRegion a::attr(cvalue)").extract()
+        genres = [
+            (index, genre_values[index], page if index == genre_index else 1)
+            for index in range(genre_index, len(genre_values))
+        ]
+        if self.listing_mode == "ajax":
+            for _, genre_value, genre_page in genres:
+                yield self._movie_list_request(genre_value, genre_page, fan_out=True)
+        else:
+            self.get_selenium_spider().crawl_movie_lists(genres, self._crawl_movie)
+
+    def _movie_list_request(self, genre_value, page, fan_out=False):
+        return Request(
+            self.listing_jsonp_url.format(genre_value=genre_value, page=page),
+            callback=self.parse_movie_list,
+            # 同一类型的各页由同一个进程爬取
+            meta={"genre_value": genre_value, "page": page, "fan_out": fan_out,
+                  "shard_key": "mtime:genre:%s" % genre_value},
+        )
+
+    def parse_movie_list(self, response):
+        """
+        解析搜索服务返回的电影列表
+
+        每个类型的第一个请求根据`pageCount`一次性发出其余各页的请求，
+        没有`pageCount`时逐页请求，直到某一页没有电影
+        """
+        genre_value, page = response.meta["genre_value"], response.meta["page"]
+        value = self._parse_jsonp(response) or {}
+
+        urls = []
+        for href in Selector(text=value.get("listHTML") or "<html></html>").css("a::attr(href)").extract():
+            href = href.strip()
+            if self.movie_url_re.match(href) and href not in urls:
+                urls.append(href)
+        for url in urls:
+            yield Request(url, callback=self.parse_movie_base)
+
+        # 页数由搜索服务给出，不能由本页的电影数推算(本页可能不满或有重复、过滤的链接)
+        page_count = value.get("pageCount")
+        if page_count is None:
+            if urls:
+                yield self._movie_list_request(genre_value, page + 1)
+        elif response.meta.get("fan_out"):
+            for next_page in range(page + 1, int(page_count) + 1):
+                yield self._movie_list_request(genre_value, next_page)
+
+    def _parse_jsonp(self, response):
+        """
+        解析时光网服务返回的JSONP，返回其中的value
+        """
+        response_body = response.body_as_unicode()
+        json_obj = '{%s}' % response_body.split('{', 1)[1].rsplit('}', 1)[0]
+        return json.loads(json_obj).get("value")
+
+    def _crawl_movie(self, url):
+        """
+        在浏览器线程中调用，由reactor线程调度请求
+        """
+        request = Request(url, callback=self.parse_movie_base)
+        reactor.callFromThread(self.crawler.engine.crawl, request, self)
 
     def _parse_id(self, url):
         return int(os.path.basename(url.rstrip("/")))
 
+    def _partial(self, item, part):
+        """
+        标记部分Item的来源页面，见`coalesce_parts`
+        """
+        item._coalesce_part = part
+        return item
+
+    def _part_request(self, url, callback, part, movie, meta_key="item"):
+        """
+        电影子页面的请求。请求失败(404、被中间件忽略等)时返回一个空的部分Item，
+        使合并的Item不必等到超时才写入；子页面只随主页面请求一次，不需要去重
+        """
+        return Request(url, callback=callback, errback=self._part_failed, dont_filter=True,
+                       meta={meta_key: movie.copy(), "coalesce_part": part})
+
+    def _part_failed(self, failure):
+        request = failure.request
+        movie = request.meta.get("item") or request.meta.get("movie")
+        return self._empty_part(movie, request.meta["coalesce_part"])
+
+    def _empty_part(self, movie, part):
+        return self._partial(MovieItem(id=movie["id"]), part)
+
     def parse_movie_base(self, response):
         """
         爬取电影基本信息
@@ -81,41 +230,33 @@ class MovieSpider(Spider):
         genres = detail.css('a[property="v:genre"]::text').extract()
         item["genres"] = [{"title": genre} for genre in genres]
 
-        # TODO: yield item after all other requests done
-        yield item
+        yield self._partial(item, "base")
 
-        yield Request(
-            url=self.rating_jsonp_url.format(movie_id=item["id"]),
-            callback=self.parse_movie_rating,
-            meta={"movie": item.copy()}
+        yield self._part_request(
+            self.rating_jsonp_url.format(movie_id=item["id"]), self.parse_movie_rating, "rating", item,
+            meta_key="movie",
         )
+        yield self._part_request(urljoin(response.url, "fullcredits.html"), self.parse_movie_credits, "credits", item)
+        yield self._part_request(urljoin(response.url, "details.html"), self.parse_movie_detail, "detail", item)
+        yield self._part_request(urljoin(response.url, "plots.html"), self.parse_movie_plots, "plots", item)
 
-        requests = [
-            Request(urljoin(response.url, "fullcredits.html"), callback=self.parse_movie_credits),
-            Request(urljoin(response.url, "details.html"), callback=self.parse_movie_detail),
-            Request(urljoin(response.url, "plots.html"), callback=self.parse_movie_plots),
-            Request(urljoin(response.url, "behind_the_scene.html"), callback=self.parse_movie_story),
-        ]
-        for request in requests:
-            request.meta["item"] = item.copy()
-            yield request
+        request = Request(urljoin(response.url, "behind_the_scene.html"), callback=self.parse_movie_story)
+        request.meta["item"] = item.copy()
+        yield request
 
     def parse_movie_rating(self, response):
         """
         爬取电影评分
         """
         movie = response.meta["movie"]
+        obj = (self._parse_jsonp(response) or {}).get("movieRating")
 
-        response_body = response.body_as_unicode()
-        json_obj = '{%s}' % response_body.split('{', 1)[1].rsplit('}', 1)[0]
-        obj = json.loads(json_obj).get("value").get("movieRating")
-
-        if obj:
-            id, rating = obj.get("MovieId"), obj.get("RatingFinal")
-            if movie["id"] == id:
-                movie["rating"] = rating
-                yield movie
-        yield None
+        if obj and movie["id"] == obj.get("MovieId"):
+            movie["rating"] = obj.get("RatingFinal")
+            yield self._partial(movie, "rating")
+        else:
+            # 没有评分或ID不一致时也需要返回这一部分，合并的Item才能完成
+            yield self._empty_part(movie, "rating")
 
     def parse_movie_credits(self, response):
         """
@@ -165,7 +306,7 @@ class MovieSpider(Spider):
                 movie["stars"].append({"id": self._parse_id(url)})
                 yield Request(url, callback=self.parse_celebrity)
 
-        yield movie
+        yield self._partial(movie, "credits")
 
     def parse_celebrity(self, response):
         """
@@ -282,7 +423,7 @@ class MovieSpider(Spider):
             )
             yield Request(url=url, callback=self.parse_movie_base)
 
-        yield movie
+        yield self._partial(movie, "detail")
 
     def parse_movie_photos(self, response):
         """
@@ -304,7 +445,7 @@ class MovieSpider(Spider):
             paragraphs.append(first_letter + other_letter)
 
         movie["intro"] = "\n\n".join(paragraphs)
-        yield movie
+        yield self._partial(movie, "plots")
 
     def parse_movie_story(self, response):
         """
@@ -323,55 +464,64 @@ class SeleniumSpider(object):
     """
     电影列表爬虫
 
+    `workers`个线程各自使用浏览器池中的一个浏览器(及代理)，并发爬取不同类型的
+    电影列表，同一类型的各页由同一个浏览器依次翻页。遇到验证码或超时时立即
+    换上备用浏览器重新加载当前页。
+
     外部接口：
-    - crawl_movie_list_by(genre, page)
+    - crawl_movie_lists(genres, on_movie)
+    - stop()
     - save_last_crawl_point(genre_dom_index, page)
     - get_last_crawl_point()
     """
 
     page_load_timeout = 30
+    page_wait_timeout = 60
+    max_retries = 5
     start_url = "http://movie.mtime.com/movie/search/section/#viewType=1&type={genre_value}&pageIndex={page}"
     last_crawl_point_filename = ".lastcrawl"
 
-    def __init__(self):
-        self._browser = None
-        self._proxy_middleware = ProxyMiddleware()
+    def __init__(self, workers=1, standby=1, driver_factory=phantomjs_factory, proxy_middleware=None):
+        self.workers = workers
+        self._proxy_middleware = proxy_middleware or ProxyMiddleware()
+        self._pool = BrowserPool(self._proxy_middleware, driver_factory, standby, self.page_load_timeout)
+        self._genres = Queue.Queue()
+        self._progress = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stopping = False
 
-    def crawl_movie_list_by(self, genre_value, genre_index, page=1):
-        self.start_browser()
-        reload_page = True
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
 
-        while True:
-            log.msg("Loading Page [%s]" % page)
-            try:
-                if reload_page:
-                    self._browser.get(self._get_url(genre_value, page))
-                # Waiting for page loaded
-                WebDriverWait(self._browser, 60).until(
-                    lambda x: x.find_element_by_css_selector("div#pagerRegion a.on").text == str(page)
-                )
-            except TimeoutException:
-                log.msg("May be encounter captcha, save screenshot [%s]" % self._save_screenshot(), level=log.WARNING)
-                proxy_args = self._change_proxy()
-                self.restart_browser(service_args=proxy_args)
-                reload_page = True
-            except Exception as e:
-                log.msg("Unknow exception [%s], save screenshot [%s]" % (e, self._save_screenshot()), level=log.ERROR)
-            else:
-                reload_page = False
+    def crawl_movie_lists(self, genres, on_movie):
+        """
+        在后台线程中爬取电影列表，立即返回
 
-                for e in self._browser.find_elements_by_css_selector("div#searchResultRegion a"):
-                    yield e.get_attribute("href")
+        `genres`为[(类型序号, 类型值, 起始页码)]，
+        每个电影的URL通过`on_movie(url)`返回，注意该函数在工作线程中调用
+        """
+        for genre_index, genre_value, page in genres:
+            self._progress[genre_index] = page
+            self._genres.put((genre_index, genre_value, page))
+
+        self._pool.start()
+        self._threads = [
+            threading.Thread(target=self._work, args=(on_movie,), name="SeleniumSpider-%d" % i)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
 
-                SeleniumSpider.save_last_crawl_point(genre_index, page)
-                try:
-                    next_page = self._browser.find_element_by_id("key_nextpage")
-                except NoSuchElementException:
-                    self._browser.quit()
-                    break
-                else:
-                    next_page.click()
-                    page += 1
+    def stop(self):
+        self._stopping = True
+        self._pool.close()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
 
     @classmethod
     def get_last_crawl_point(cls):
@@ -392,61 +542,95 @@ class SeleniumSpider(object):
     def save_last_crawl_point(cls, genre_dom_index, page):
         """
         保存最后一次爬取电影列表的位置
-
-        TODO:
-        将此接口迁移到MovieSpider
         """
         with open(cls.last_crawl_point_filename, "w") as f:
             f.write("{}::{}".format(genre_dom_index, page))
 
-    def start_browser(self, **options):
-        log.msg("Start browser with proxy [%s]" % options)
+    def _work(self, on_movie):
+        browser = None
+        try:
+            while not self._stopping:
+                try:
+                    genre_index, genre_value, page = self._genres.get_nowait()
+                except Queue.Empty:
+                    break
+                if browser is None:
+                    browser = self._pool.acquire()
+                browser = self._crawl_genre(browser, genre_index, genre_value, page, on_movie)
+        except Exception as e:
+            log.msg("Browser worker failed [%s]" % e, level=log.ERROR)
+        finally:
+            if browser is not None:
+                self._pool.release(browser)
+
+    def _crawl_genre(self, browser, genre_index, genre_value, page, on_movie):
+        """
+        依次爬取一个类型的电影列表，返回当前使用的浏览器
+        """
+        reload_page = True
+        retries = 0
 
-        self._browser = webdriver.PhantomJS(**options)
-        self._browser.set_page_load_timeout(self.page_load_timeout)
-        log.msg("Start browser successfully")
+        while not self._stopping:
+            log.msg("Loading Page [%s:%s]" % (genre_value, page))
+            try:
+                if reload_page:
+                    browser.driver.get(self._get_url(genre_value, page))
+                # Waiting for page loaded
+                WebDriverWait(browser.driver, self.page_wait_timeout).until(
+                    lambda x: x.find_element_by_css_selector("div#pagerRegion a.on").text == str(page)
+                )
+            except TimeoutException:
+                log.msg("May be encounter captcha, save screenshot [%s]" % self._save_screenshot(browser), level=log.WARNING)
+                retries += 1
+            except Exception as e:
+                log.msg("Unknow exception [%s], save screenshot [%s]" % (e, self._save_screenshot(browser)), level=log.ERROR)
+                retries += 1
+            else:
+                reload_page = False
+                retries = 0
 
-    def quit_browser(self):
-        log.msg("Quit browser...")
-        self._browser.quit()
+                for e in browser.driver.find_elements_by_css_selector("div#searchResultRegion a"):
+                    on_movie(e.get_attribute("href"))
 
-    def restart_browser(self, **options):
-        self.quit_browser()
+                try:
+                    next_page = browser.driver.find_element_by_id("key_nextpage")
+                except NoSuchElementException:
+                    self._update_progress(genre_index, None)
+                    break
+                else:
+                    next_page.click()
+                    page += 1
+                    self._update_progress(genre_index, page)
+                continue
 
-        time.sleep(2)
-        self.start_browser(**options)
+            if retries > self.max_retries:
+                log.msg("Give up genre [%s] at page [%s]" % (genre_value, page), level=log.ERROR)
+                break
+            browser = self._pool.replace(browser)
+            reload_page = True
 
-    @property
-    def _proxy(self):
-        if self._browser:
-            service_args = self._browser.service.service_args
-            if service_args[1].startswith("--proxy="):
-                netloc = service_args[1].split("=")[1]
-                scheme = service_args[2].split("=")[1]
-                return urlunparse((scheme, netloc, "", "", "", ""))
-        return ""
-
-    def _change_proxy(self):
-        """
-        获得新的浏览器代理参数
-        """
-        old_proxy = self._proxy
-        new_proxy = self._proxy_middleware.get_random_proxy()
-
-        if old_proxy:
-            self._proxy_middleware.del_proxy(old_proxy)
-        obj = urlparse(new_proxy)
-        proxy_args = [
-            '--proxy={}'.format(obj.netloc.strip()),
-            '--proxy-type={}'.format(obj.scheme),
-        ]
-        return proxy_args
+        return browser
+
+    def _update_progress(self, genre_index, page):
+        """
+        记录各类型的爬取进度，保存最靠前的未完成位置
+        """
+        with self._lock:
+            if page is None:
+                self._progress.pop(genre_index, None)
+            else:
+                self._progress[genre_index] = page
+            if self._progress:
+                SeleniumSpider.save_last_crawl_point(*min(self._progress.items()))
 
     def _get_url(self, genre_value, page):
         return self.start_url.format(genre_value=genre_value, page=page)
 
-    def _save_screenshot(self, filename=None):
+    def _save_screenshot(self, browser, filename=None):
         if filename is None:
-            filename = datetime.now().strftime("%Y_%m_%d_%H_%M_%S") + ".png"
-        self._browser.save_screenshot(filename)
+            filename = datetime.now().strftime("%Y_%m_%d_%H_%M_%S_%f") + ".png"
+        try:
+            browser.driver.save_screenshot(filename)
+        except Exception:
+            return None
         return filename
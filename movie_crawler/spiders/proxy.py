@@ -1,37 +1,59 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from urlparse import urlparse
+
+from scrapy import signals
 from scrapy.contrib.spiders import CrawlSpider, Rule
 from scrapy.contrib.linkextractors import LinkExtractor
 
-from movie_crawler.settings.scrapy_settings import PROXY_LIST
+from movie_crawler.settings.scrapy_settings import PROXY_SOURCE_URLS, PROXY_STORE_FILE
+from movie_crawler.utils import ProxyStore
 
 
 class ProxySpider(CrawlSpider):
     """
         代理爬虫, 获取最新代理, PROTOCOL://IP:PORT
+
+        每个页面只遍历一次代理表格，抓取到的代理逐页合并到代理仓库中，
+        来源页面可以有多个，分页链接会被继续抓取。
+        仓库中的代理需要经过`scrapy checkproxies`验证后才会被使用
     """
 
     name = "proxy"
     allowed_domains = ["checkerproxy.net"]
-    start_urls = [
-        "http://checkerproxy.net/all_proxy",
-    ]
-    rules = [Rule(LinkExtractor(allow=['/all_proxy$']), 'parse_proxy', follow=True)]
+    start_urls = PROXY_SOURCE_URLS
+    rules = [Rule(LinkExtractor(allow=[r'/all_proxy(/\d+/?|\?page=\d+)?$']), 'parse_proxy', follow=True)]
+
+    # 每页最多读取的行数
+    max_rows = 2000
+
+    def __init__(self, store_file=PROXY_STORE_FILE, *args, **kwargs):
+        super(ProxySpider, self).__init__(*args, **kwargs)
+        self.store = ProxyStore(store_file)
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        kwargs.setdefault('store_file', crawler.settings.get('PROXY_STORE_FILE', PROXY_STORE_FILE))
+        spider = super(ProxySpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.start_urls = crawler.settings.getlist('PROXY_SOURCE_URLS', cls.start_urls)
+        spider.allowed_domains = list(set(urlparse(url).hostname for url in spider.start_urls))
+        crawler.signals.connect(spider.spider_closed, signals.spider_closed)
+        return spider
+
+    def parse_start_url(self, response):
+        return self.parse_proxy(response)
 
     def parse_proxy(self, response):
-        address_set = set()
-        sel = response.xpath('/html')
-        ip_count = len(sel.css('#result-box-table > tbody > tr'))
-        for i in range(1, ip_count):
-            ip_port = sel.css('#result-box-table > tbody > tr:nth-child(%d) > td.proxy-ipport::text' % i).extract()[0]
-            protocol = sel.css('#result-box-table > tbody > tr:nth-child(%d) > td.proxy-type-1::text' % i).extract()[0]
-            if ip_port.split(':')[-1].isdigit():
-                address = protocol.lower() + '://' + ip_port
-                address_set.add(address)
-            if i == 2000:
-                break
-
-        with open(PROXY_LIST, 'w') as f:
-            for address in list(address_set):
-                f.write(address + '\n')
+        self.store.merge(self.extract_proxies(response))
+        return []
+
+    def extract_proxies(self, response):
+        for row in response.css('#result-box-table > tbody > tr')[:self.max_rows]:
+            ip_port = row.css('td.proxy-ipport::text').extract()
+            protocol = row.css('td.proxy-type-1::text').extract()
+            if ip_port and protocol and ip_port[0].split(':')[-1].isdigit():
+                yield protocol[0].strip().lower() + '://' + ip_port[0].strip()
+
+    def spider_closed(self, spider):
+        self.store.save()
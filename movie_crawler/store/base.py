@@ -108,6 +108,8 @@ class BaseCelebrity(models.Model):
     achievement = models.TextField(verbose_name="主要成就")
     experience = models.TextField(verbose_name="星路历程")
 
+    update_time = models.DateTimeField(auto_now=True, null=True, verbose_name="更新时间")
+
     class Meta:
         abstract = True
 
@@ -123,7 +125,8 @@ class BasePhoto(models.Model):
     movie_id = models.IntegerField(null=True, blank=True, verbose_name="电影ID")
     celebrity_id = models.IntegerField(null=True, blank=True, verbose_name="艺人ID")
 
-    url = models.CharField(max_length=255, verbose_name="图片URL")
+    # PhotoItem.unique_fields
+    url = models.CharField(max_length=255, db_index=True, verbose_name="图片URL")
     size = models.CharField(max_length=255, null=True, blank=True, verbose_name="文件大小")
     pixel = models.CharField(max_length=255, null=True, blank=True, verbose_name="分辨率")
     type = models.CharField(max_length=255, null=True, blank=True, verbose_name="图片类型(封面/官方剧照/工作照等)")
@@ -241,9 +244,13 @@ class BaseComment(models.Model):
     dislike = models.IntegerField(null=True, blank=True, verbose_name="赞")
     created_time = models.DateField(null=True, blank=True, verbose_name="创建时间")
 
+    update_time = models.DateTimeField(auto_now=True, null=True, verbose_name="更新时间")
+
     class Meta:
         abstract = True
         verbose_name = verbose_name_plural = "评论"
+        # CommentItem.unique_fields
+        index_together = [("id_movie", "id_comment", "type")]
 
     def __unicode__(self):
         return self.username
@@ -0,0 +1,45 @@
+# coding: utf-8
+"""
+为已有的数据表补上模型中新加的字段
+
+syncdb只创建不存在的表，已有的表不会加入之后在模型中新增的字段
+(如艺人及评论的update_time)，这些字段需要用`scrapy addcolumns`补上。
+"""
+
+from __future__ import unicode_literals
+
+from django.db import connections, router
+from django.db.models import get_app, get_models
+
+
+STORE_APPS = ('douban', 'mtime')
+
+
+def get_store_models():
+    return [model for app_label in STORE_APPS for model in get_models(get_app(app_label))]
+
+
+def get_missing_columns(models=None):
+    """
+    返回 [(模型, 字段)]，数据表已存在但缺少的字段；表不存在的模型由syncdb创建，不在其中
+    """
+    missing = []
+    for model in models or get_store_models():
+        connection = connections[router.db_for_write(model)]
+        table = model._meta.db_table
+        cursor = connection.cursor()
+        if table not in connection.introspection.table_names(cursor):
+            continue
+        columns = set(row[0] for row in connection.introspection.get_table_description(cursor, table))
+        missing.extend((model, field) for field in model._meta.local_fields if field.column not in columns)
+    return missing
+
+
+def get_add_column_sql(model, field):
+    """
+    加入字段的SQL，字段必须允许为NULL，已有的行的值为NULL
+    """
+    connection = connections[router.db_for_write(model)]
+    qn = connection.ops.quote_name
+    return 'ALTER TABLE %s ADD COLUMN %s %s NULL' % (
+        qn(model._meta.db_table), qn(field.column), field.db_type(connection))
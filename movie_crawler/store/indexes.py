@@ -0,0 +1,91 @@
+# coding: utf-8
+"""
+由Item的unique_fields推导数据库索引
+
+SavePipeline按`item.unique_fields`查询对象是否已存在，这些查询需要索引支持：
+其中一个字段是主键或唯一字段，或者有一个索引的前几列正好是这些字段。
+"""
+
+from __future__ import unicode_literals
+
+from django.core.management.color import no_style
+from django.db import connections, router
+from django.db.models.fields import FieldDoesNotExist
+
+
+def get_item_classes():
+    """
+    所有保存到数据库的Item类
+    """
+    from scrapy.contrib.djangoitem import DjangoItem
+    from movie_crawler.items import douban, mtime
+
+    item_classes = []
+    for module in (douban, mtime):
+        for value in vars(module).values():
+            if isinstance(value, type) and issubclass(value, DjangoItem) and value is not DjangoItem \
+                    and value.__module__ == module.__name__:
+                item_classes.append(value)
+    return sorted(item_classes, key=lambda cls: (cls.__module__, cls.__name__))
+
+
+def _is_unique(model, fields):
+    opts = model._meta
+    for name in fields:
+        field = opts.get_field(name)
+        if field.primary_key or field.unique:
+            return True
+    return any(set(together) == set(fields) for together in opts.unique_together)
+
+
+def _is_indexed(model, fields):
+    opts = model._meta
+    if len(fields) == 1 and opts.get_field(fields[0]).db_index:
+        return True
+    return any(set(together[:len(fields)]) == set(fields) for together in opts.index_together)
+
+
+def get_required_indexes(item_classes=None):
+    """
+    返回 [(Item类, 模型, 字段)]，每个为按unique_fields查询所需的非唯一索引，
+    主键、唯一字段或unique_together已经覆盖的不在其中
+    """
+    required = []
+    for item_class in item_classes or get_item_classes():
+        fields = tuple(getattr(item_class, 'unique_fields', None) or ())
+        if not fields:
+            continue
+        model = item_class.django_model
+        try:
+            if _is_unique(model, fields):
+                continue
+        except FieldDoesNotExist:
+            pass
+        required.append((item_class, model, fields))
+    return required
+
+
+def get_missing_indexes(item_classes=None):
+    """
+    返回 [(Item类, 字段, 原因)]，模型定义中没有支持unique_fields查询的索引
+    """
+    missing = []
+    for item_class, model, fields in get_required_indexes(item_classes):
+        try:
+            if _is_indexed(model, fields):
+                continue
+        except FieldDoesNotExist as e:
+            missing.append((item_class, fields, '%s' % e))
+            continue
+        missing.append((item_class, fields, 'no index on %s' % model._meta.db_table))
+    return missing
+
+
+def get_index_sql(model, fields):
+    """
+    创建索引的SQL，索引名与syncdb按db_index/index_together生成的相同
+    """
+    connection = connections[router.db_for_write(model)]
+    return connection.creation.sql_indexes_for_fields(
+        model, [model._meta.get_field(name) for name in fields], no_style()
+    )
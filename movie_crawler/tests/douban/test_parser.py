@@ -0,0 +1,51 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import os
+import unittest
+
+from scrapy.http import HtmlResponse, Request
+from scrapy.item import BaseItem
+
+from movie_crawler.spiders.douban.movie import MovieSpider
+from movie_crawler.items.douban import MovieItem
+
+
+class ParserConformanceTestCase(unittest.TestCase):
+    """
+    lxml解析器的解析结果需要与BeautifulSoup完全一致
+    """
+
+    fixtures = [
+        ("movie_without_imdb.html", "http://movie.douban.com/subject/1867420/", "parse_movie_base", {}),
+        ("celebrity.html", "http://movie.douban.com/celebrity/1048000/", "parse_celebrity", {}),
+        ("celebrity_photo.html", "http://movie.douban.com/celebrity/1048000/photo/826255312/", "parse_celebrity_photo_base", {}),
+        ("review.html", "http://movie.douban.com/review/6195573/", "parse_review", {"item": MovieItem(id=1867420)}),
+        ("movie_photo.html", "http://movie.douban.com/photos/photo/2092045531/", "parse_movie_photo_base", {}),
+        ("movie_photo.html", "http://movie.douban.com/photos/photo/2092045531/", "parse_movie_photo", {}),
+    ]
+
+    def setUp(self):
+        self.html_dir = os.path.join(os.path.dirname(__file__), "html")
+
+    def parse(self, parser, filename, url, callback, meta):
+        spider = MovieSpider()
+        spider.parser = parser
+        with open(os.path.join(self.html_dir, filename)) as f:
+            response = HtmlResponse(url=url, body=f.read(), request=Request(url=url, meta=meta))
+        result = getattr(spider, callback)(response)
+        if isinstance(result, BaseItem):
+            result = [result]
+        return [self.normalize(obj) for obj in result]
+
+    def normalize(self, obj):
+        if isinstance(obj, Request):
+            return (obj.url, obj.callback.__name__, sorted(obj.meta.items()))
+        return (obj.__class__.__name__, sorted(obj.items()))
+
+    def test_lxml_conformance(self):
+        for fixture in self.fixtures:
+            self.assertEqual(
+                self.parse("lxml", *fixture),
+                self.parse("beautifulsoup", *fixture),
+                "lxml parser differs from BeautifulSoup on %s" % fixture[0]
+            )
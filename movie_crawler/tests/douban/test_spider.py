@@ -2,12 +2,13 @@
 from __future__ import unicode_literals
 
 from urlparse import urlparse
+import cPickle as pickle
 import os
 import unittest
 
 from scrapy.http import HtmlResponse, TextResponse, Request
 
-from movie_crawler.spiders.douban.movie import MovieSpider
+from movie_crawler.spiders.douban.movie import MovieSpider, extract_in_worker
 from movie_crawler.items.douban import (
     MovieItem, CelebrityItem, AwardItem, CommentItem
 )
@@ -85,6 +86,16 @@ class SpiderTestCase(unittest.TestCase):
 
         self.assertEqual(result.next()['type'], 'cover')
 
+    def test_extract_in_worker(self):
+        response = self.fake_response_from_file("movie_without_imdb.html", url="http://movie.douban.com/subject/1867420/")
+        data = extract_in_worker("extract_movie_base", self.spider.parser, response.url, response.body, response.encoding)
+        # 解析进程返回的数据需要可以pickle
+        data = pickle.loads(pickle.dumps(data, protocol=2))
+        built = list(self.spider.build_movie_base(data))
+        parsed = list(self.spider.parse_movie_base(response))
+        self.assertEqual([dict(r) if not isinstance(r, Request) else r.url for r in built],
+                         [dict(r) if not isinstance(r, Request) else r.url for r in parsed])
+
     def test_parse_celebrity_photo_base(self):
         """
         @url: http://movie.douban.com/celebrity/1048000/photo/826255312/
@@ -0,0 +1 @@
+var result_20148720141259834 = { "value":{"isSuccess":true,"listHTML":"<ul class=\"ser_mlist\"><li><div class=\"td pic\"><a href=\"http://movie.mtime.com/12135/\" target=\"_blank\" title=\"卧虎藏龙\"><img src=\"http://img31.mtime.cn/mt/2014/02/22/222222.22222222_96X128.jpg\" alt=\"卧虎藏龙\" /></a></div><div class=\"td\"><h3 class=\"normal mt6\"><a href=\"http://movie.mtime.com/12135/\" target=\"_blank\">卧虎藏龙</a></h3><p class=\"c_666 mt6\">导演：<a href=\"http://people.mtime.com/914002/\" target=\"_blank\">李安</a></p></div></li><li><div class=\"td pic\"><a href=\"http://movie.mtime.com/10968/\" target=\"_blank\" title=\"英雄\"><img src=\"http://img31.mtime.cn/mt/2014/02/22/111111.11111111_96X128.jpg\" alt=\"英雄\" /></a></div><div class=\"td\"><h3 class=\"normal mt6\"><a href=\"http://movie.mtime.com/10968/\" target=\"_blank\">英雄</a></h3><p class=\"c_666 mt6\"><a href=\"http://movie.mtime.com/10968/trailer/\" target=\"_blank\">预告片</a></p></div></li></ul>","pagerHTML":"<div id=\"pager\"><a class=\"on\" href=\"javascript:void(0);\">1</a><a href=\"javascript:void(0);\">2</a><a id=\"key_nextpage\" href=\"javascript:void(0);\">下一页</a></div>","totalCount":5,"pageCount":3},"error":null};var getSearchMovieResult=result_20148720141259834;
@@ -1,14 +1,16 @@
 # coding: utf-8
 from __future__ import unicode_literals
-from urlparse import urlparse
 import os
 import unittest
 
+from scrapy.exceptions import IgnoreRequest
 from scrapy.http import HtmlResponse, TextResponse, Request
-from selenium import webdriver
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+from twisted.python.failure import Failure
 
 from movie_crawler.spiders.mtime.movie import MovieSpider, SeleniumSpider
 from movie_crawler.items.mtime import MovieItem, CharacterItem, CelebrityItem
+from movie_crawler.middlewares.proxy import ProxyMiddleware
 
 
 class SpiderTestCase(unittest.TestCase):
@@ -45,6 +47,51 @@ class SpiderTestCase(unittest.TestCase):
         result = self.spider.parse_movie_rating(response)
         self.assertEqual(result.next(), MovieItem(id=12135, rating=6.9))
 
+    def test_parse_movie_list(self):
+        with open(os.path.join(self.html_dir, "movie_list.js")) as f:
+            body = f.read()
+        self.spider.listing_jsonp_url = "http://127.0.0.1:8000/search?type={genre_value}&page={page}"
+        request = self.spider._movie_list_request("192", 1, fan_out=True)
+        response = TextResponse(url=request.url, body=body, encoding="utf-8", request=request)
+
+        requests = list(self.spider.parse_movie_list(response))
+        self.assertEqual([r.url for r in requests], [
+            "http://movie.mtime.com/12135/",
+            "http://movie.mtime.com/10968/",
+            "http://127.0.0.1:8000/search?type=192&page=2",
+            "http://127.0.0.1:8000/search?type=192&page=3",
+        ])
+        self.assertEqual(requests[0].callback, self.spider.parse_movie_base)
+        self.assertEqual(requests[-1].callback, self.spider.parse_movie_list)
+        self.assertFalse(requests[-1].meta["fan_out"])
+
+        # 其余各页不再重复发出请求
+        request = self.spider._movie_list_request("192", 2)
+        response = TextResponse(url=request.url, body=body, encoding="utf-8", request=request)
+        self.assertEqual(len(list(self.spider.parse_movie_list(response))), 2)
+
+    def test_parse_movie_list_page_count(self):
+        # 第一页只有一部电影，页数以pageCount为准
+        body = ('var result_1 = { "value":{"isSuccess":true,"listHTML":"<a href=\\"http://movie.mtime.com/12135/\\">'
+                '</a>","totalCount":50,"pageCount":4},"error":null};var getSearchMovieResult=result_1;')
+        request = self.spider._movie_list_request("192", 1, fan_out=True)
+        response = TextResponse(url=request.url, body=body, encoding="utf-8", request=request)
+        requests = list(self.spider.parse_movie_list(response))
+        self.assertEqual([r.meta.get("page") for r in requests], [None, 2, 3, 4])
+
+    def test_parse_movie_list_without_total_count(self):
+        body = ('var result_1 = { "value":{"isSuccess":true,"listHTML":"<a href=\\"http://movie.mtime.com/12135/\\">'
+                '</a>"},"error":null};var getSearchMovieResult=result_1;')
+        request = self.spider._movie_list_request("192", 4)
+        response = TextResponse(url=request.url, body=body, encoding="utf-8", request=request)
+        requests = list(self.spider.parse_movie_list(response))
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(requests[1].meta["page"], 5)
+
+        body = 'var result_1 = { "value":{"isSuccess":true,"listHTML":""},"error":null};var getSearchMovieResult=result_1;'
+        response = TextResponse(url=request.url, body=body, encoding="utf-8", request=request)
+        self.assertEqual(list(self.spider.parse_movie_list(response)), [])
+
     def test_parse_movie_rating_with_id_none(self):
         url = "http://www.test.com"
         body = ('var result_20148715112823067 = { "value":{"isRelease":true,"'
@@ -57,8 +104,20 @@ class SpiderTestCase(unittest.TestCase):
         request = Request(url=str(url), meta={"movie": MovieItem(id=12135)})
         response = TextResponse(url=str(url), body=body, encoding="utf-8", request=request)
 
-        result = self.spider.parse_movie_rating(response)
-        self.assertEqual(result.next(), None)
+        # ID不一致时返回空的部分Item，合并的电影不必等到超时
+        item = self.spider.parse_movie_rating(response).next()
+        self.assertEqual(item, MovieItem(id=12135))
+        self.assertEqual(item._coalesce_part, "rating")
+
+    def test_movie_part_failed(self):
+        request = self.spider._part_request("http://movie.mtime.com/12135/plots.html",
+                                            self.spider.parse_movie_plots, "plots", MovieItem(id=12135, title="t"))
+        self.assertTrue(request.dont_filter)
+        failure = Failure(IgnoreRequest())
+        failure.request = request
+        item = request.errback(failure)
+        self.assertEqual(item, MovieItem(id=12135))
+        self.assertEqual(item._coalesce_part, "plots")
 
     def test_parse_movie_credits(self):
         """
@@ -199,21 +258,133 @@ class SpiderTestCase(unittest.TestCase):
         pass
 
 
+class FakeElement(object):
+    def __init__(self, text="", href=None, on_click=None):
+        self.text = text
+        self.href = href
+        self.on_click = on_click
+
+    def get_attribute(self, name):
+        return self.href
+
+    def click(self):
+        self.on_click()
+
+
+class FakeDriver(object):
+    """
+    代替PhantomJS，每个类型有`pages`页电影列表，每页两部电影
+    """
+
+    pages = {"192": 3, "193": 1}
+    bad_proxies = set()
+
+    def __init__(self, service_args):
+        self.service_args = service_args
+        self.proxy = service_args[0].split("=")[1] if service_args else None
+        self.genre = None
+        self.page = None
+        self.quitted = False
+
+    def set_page_load_timeout(self, timeout):
+        pass
+
+    def get(self, url):
+        if self.proxy in self.bad_proxies:
+            raise TimeoutException()
+        params = dict(param.split("=") for param in url.split("#", 1)[1].split("&"))
+        self.genre, self.page = params["type"], int(params["pageIndex"])
+
+    def find_element_by_css_selector(self, selector):
+        return FakeElement(text=str(self.page))
+
+    def find_elements_by_css_selector(self, selector):
+        return [FakeElement(href="http://movie.mtime.com/%s%02d%d/" % (self.genre, self.page, i)) for i in range(2)]
+
+    def find_element_by_id(self, id):
+        if self.page >= self.pages[self.genre]:
+            raise NoSuchElementException()
+        return FakeElement(on_click=self.next_page)
+
+    def next_page(self):
+        self.page += 1
+
+    def save_screenshot(self, filename):
+        pass
+
+    def quit(self):
+        self.quitted = True
+
+
+class FakeProxyMiddleware(object):
+    def __init__(self, proxies):
+        self.pool = list(proxies)
+        self.deleted = []
+
+    def get_random_proxy(self):
+        return self.pool[0]
+
+    def del_proxy(self, proxy):
+        if proxy in self.pool:
+            self.deleted.append(proxy)
+            self.pool.remove(proxy)
+
+
+class SharedProxyPoolTestCase(unittest.TestCase):
+    def test_browsers_share_downloader_proxy_middleware(self):
+        proxy_middleware = ProxyMiddleware({"PROXY_LIST": os.devnull, "PROXY_SCORES_FILE": None})
+        downloader = FakeObject(middleware=FakeObject(middlewares=[object(), proxy_middleware]))
+        spider = MovieSpider()
+        spider._crawler = FakeObject(engine=FakeObject(downloader=downloader))
+        self.assertIsNone(spider.selenium_spider)
+        self.assertIs(spider.get_selenium_spider()._proxy_middleware, proxy_middleware)
+        self.assertIs(spider.get_selenium_spider(), spider.selenium_spider)
+
+
+class FakeObject(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
 class SeleniumSpiderTestCase(unittest.TestCase):
     def setUp(self):
-        self.spider = SeleniumSpider()
+        self.proxy_middleware = FakeProxyMiddleware(["http://127.0.0.1:%d" % port for port in range(8000, 8010)])
+        self.spider = SeleniumSpider(workers=2, standby=1, driver_factory=FakeDriver,
+                                     proxy_middleware=self.proxy_middleware)
 
     def tearDown(self):
         filename = SeleniumSpider.last_crawl_point_filename
         if os.path.exists(filename):
             os.remove(filename)
-        if self.spider._browser:
-            self.spider._browser.quit()
-
-    def test_parse_movie_list_by(self):
-        return
-        for movie in self.spider.crawl_movie_list_by(genre_value=192, genre_index=0, page=1):
-            pass
+        FakeDriver.bad_proxies = set()
+
+    def crawl(self, genres):
+        movies = []
+        self.spider.crawl_movie_lists(genres, movies.append)
+        self.spider.join(10)
+        self.assertFalse(self.spider.running)
+        return movies
+
+    def test_crawl_movie_lists(self):
+        movies = self.crawl([(0, "192", 1), (1, "193", 1)])
+        self.assertEqual(sorted(movies), sorted(
+            ["http://movie.mtime.com/192%02d%d/" % (page, i) for page in (1, 2, 3) for i in range(2)] +
+            ["http://movie.mtime.com/19301%d/" % i for i in range(2)]
+        ))
+
+    def test_crawl_movie_lists_from_last_crawl_point(self):
+        movies = self.crawl([(0, "192", 3)])
+        self.assertEqual(sorted(movies), ["http://movie.mtime.com/192030/", "http://movie.mtime.com/192031/"])
+
+    def test_crawl_movie_lists_failover(self):
+        # 除一个代理外都无法加载页面，出错的浏览器被替换，代理进入冷却期
+        FakeDriver.bad_proxies = set("127.0.0.1:%d" % port for port in range(8000, 8009))
+        self.spider.max_retries = 20
+        movies = self.crawl([(0, "192", 1)])
+        self.assertEqual(len(movies), 6)
+        self.assertIn("http://127.0.0.1:8009", self.proxy_middleware.pool)
+        self.assertTrue(self.proxy_middleware.deleted)
+        self.assertNotIn("http://127.0.0.1:8009", self.proxy_middleware.deleted)
 
     def test_save_last_crawl_point(self):
         SeleniumSpider.save_last_crawl_point(genre_dom_index=1, page=2)
@@ -231,24 +402,3 @@ class SeleniumSpiderTestCase(unittest.TestCase):
         with open(filename, "w") as f:
             f.write("1::2")
         self.assertEqual(SeleniumSpider.get_last_crawl_point(), (1, 2))
-
-    def test_change_proxy_with_no_proxy(self):
-        proxy_args = self.spider._change_proxy()
-        self.spider._browser = webdriver.PhantomJS(service_args=proxy_args)
-        self.assertTrue(self.spider._proxy + "\n" in self.spider._proxy_middleware.proxies)
-
-    def test_change_proxy_with_proxy(self):
-        o = urlparse(self.spider._proxy_middleware.proxies[0])
-        proxy_args = [
-            '--proxy={}'.format(o.netloc.strip()),
-            '--proxy-type={}'.format(o.scheme),
-        ]
-        self.spider._browser = webdriver.PhantomJS(service_args=proxy_args)
-        old_proxy = self.spider._proxy
-
-        proxy_args = self.spider._change_proxy()
-        self.spider._browser = webdriver.PhantomJS(service_args=proxy_args)
-        new_proxy = self.spider._proxy
-
-        self.assertTrue(old_proxy + "\n" not in self.spider._proxy_middleware.proxies)
-        self.assertTrue(new_proxy + "\n" in self.spider._proxy_middleware.proxies)
@@ -0,0 +1,98 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import json
+import unittest
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext, override_settings
+from django_dynamic_fixture import G
+from rest_framework.test import APIRequestFactory
+
+from movie_crawler.api.cache import response_cache
+from movie_crawler.api.views.douban import MovieAPIView, MovieBulkAPIView
+from movie_crawler.store.douban.models import Movie, Celebrity, Genre
+
+
+class MovieAPITestCase(unittest.TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = MovieAPIView.as_view()
+        response_cache.cache.clear()
+
+    def get(self, movie, query=""):
+        request = self.factory.get("/api/douban/movie/%d/%s" % (movie.pk, query))
+        with CaptureQueriesContext(connections["douban"]) as context:
+            response = self.view(request, pk=movie.pk)
+        return response.data, len(context)
+
+    def create_movie(self, star_count):
+        stars = [G(Celebrity) for _ in range(star_count)]
+        return G(Movie, stars=stars, genres=[G(Genre)]), stars
+
+    def test_fields(self):
+        movie, stars = self.create_movie(3)
+        data, _ = self.get(movie, "?fields=id,title,stars")
+        self.assertEqual(sorted(data.keys()), ["id", "stars", "title"])
+        self.assertEqual(sorted(data["stars"]), sorted(star.pk for star in stars))
+
+    def test_expand(self):
+        movie, stars = self.create_movie(3)
+        data, _ = self.get(movie, "?fields=id,genres&expand=stars")
+        self.assertEqual(sorted(data.keys()), ["genres", "id", "stars"])
+        self.assertEqual(sorted(star["id"] for star in data["stars"]), sorted(star.pk for star in stars))
+        self.assertEqual(sorted(data["stars"][0].keys()), ["id", "name", "name_en"])
+
+    def test_query_count(self):
+        # 查询数与关联对象的数量无关
+        few, _ = self.create_movie(2)
+        many, _ = self.create_movie(20)
+        self.assertEqual(self.get(few, "?expand=stars,genres")[1], self.get(many, "?expand=stars,genres")[1])
+        self.assertEqual(self.get(many, "?fields=id,stars")[1], 2)
+
+
+class MovieBulkAPITestCase(unittest.TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = MovieBulkAPIView.as_view()
+
+    def get(self, query):
+        request = self.factory.get("/api/douban/movies/%s" % query)
+        with CaptureQueriesContext(connections["douban"]) as context:
+            response = self.view(request)
+            lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        return [json.loads(line) for line in lines], len(context)
+
+    def test_ids(self):
+        movies = [G(Movie, stars=[G(Celebrity)]) for _ in range(3)]
+        ids = [movies[2].pk, movies[0].pk, 0]
+        data, _ = self.get("?ids=%s&fields=id,stars" % ",".join(map(str, ids)))
+        # 按请求的顺序返回，不存在的ID被跳过
+        self.assertEqual([movie["id"] for movie in data], ids[:2])
+        self.assertEqual(data[0]["stars"], [star.pk for star in movies[2].stars.all()])
+
+    def test_post_ids(self):
+        movie = G(Movie)
+        request = self.factory.post("/api/douban/movies/", {"ids": [movie.pk]}, format="json")
+        response = self.view(request)
+        self.assertEqual(json.loads(b"".join(response.streaming_content))["id"], movie.pk)
+
+    def test_range(self):
+        movies = [G(Movie) for _ in range(5)]
+        with override_settings(API_BULK_CHUNK_SIZE=2):
+            data, _ = self.get("?min_id=%d&max_id=%d&fields=id" % (movies[1].pk, movies[3].pk))
+        self.assertEqual([movie["id"] for movie in data], [movie.pk for movie in movies[1:4]])
+
+    def test_query_count(self):
+        # 每块的查询数与块内的对象数无关
+        movies = [G(Movie, stars=[G(Celebrity)], genres=[G(Genre)]) for _ in range(6)]
+        ids = ",".join(str(movie.pk) for movie in movies)
+        with override_settings(API_BULK_CHUNK_SIZE=3):
+            _, two_chunks = self.get("?ids=%s&expand=stars,genres" % ids)
+        with override_settings(API_BULK_CHUNK_SIZE=6):
+            _, one_chunk = self.get("?ids=%s&expand=stars,genres" % ids)
+        self.assertEqual(two_chunks, one_chunk * 2)
+
+    def test_too_many_ids(self):
+        with override_settings(API_BULK_MAX_IDS=2):
+            response = self.view(self.factory.get("/api/douban/movies/?ids=1,2,3"))
+        self.assertEqual(response.status_code, 400)
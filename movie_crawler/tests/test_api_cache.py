@@ -0,0 +1,128 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from django.core.cache import get_cache
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from django_dynamic_fixture import G
+from rest_framework.test import APIRequestFactory
+from scrapy.spider import Spider
+
+from movie_crawler.api.cache import ResponseCache, response_cache
+from movie_crawler.api.views.douban import MovieAPIView
+from movie_crawler.items.douban import CelebrityItem, MovieItem
+from movie_crawler.pipelines.save import SavePipeline
+from movie_crawler.store.douban.models import Movie, Celebrity
+
+
+class APICacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = MovieAPIView.as_view()
+        self.spider = Spider(name="movie.douban.com")
+        response_cache.cache.clear()
+
+    def get(self, movie, query="", **headers):
+        request = self.factory.get("/api/douban/movie/%d/%s" % (movie.pk, query), **headers)
+        with CaptureQueriesContext(connections["douban"]) as context:
+            response = self.view(request, pk=movie.pk)
+        return response, len(context)
+
+    def test_cached_response(self):
+        movie = G(Movie, stars=[G(Celebrity)])
+        first, _ = self.get(movie, "?expand=stars")
+        second, query_count = self.get(movie, "?expand=stars")
+        self.assertEqual(query_count, 0)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["ETag"], first["ETag"])
+        # 查询参数不同，分别缓存
+        self.assertNotEqual(self.get(movie, "?fields=id")[0]["ETag"], first["ETag"])
+
+    def test_not_modified(self):
+        movie = G(Movie)
+        etag = self.get(movie)[0]["ETag"]
+        response, query_count = self.get(movie, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(query_count, 0)
+
+    def test_pipeline_invalidates(self):
+        movie = G(Movie, title="old")
+        etag = self.get(movie)[0]["ETag"]
+        SavePipeline(response_cache=response_cache).process_item(
+            MovieItem(id=movie.id, title="new"), self.spider)
+        response, _ = self.get(movie, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["title"], "new")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_batch_pipeline_invalidates_expanded(self):
+        star = G(Celebrity, name="old")
+        movie = G(Movie, stars=[star])
+        self.get(movie, "?expand=stars")
+        # 电影本身没有写入，但展开的艺人已更新
+        pipeline = SavePipeline(batch_size=10, response_cache=response_cache)
+        pipeline.process_item(CelebrityItem(id=star.id, name="new"), self.spider)
+        pipeline.flush()
+        response, _ = self.get(movie, "?expand=stars")
+        self.assertEqual(response.data["stars"][0]["name"], "new")
+
+    def test_single_flight(self):
+        cache = ResponseCache(alias="api")
+        cache.cache.clear()
+        calls = []
+
+        def build():
+            calls.append(1)
+            time.sleep(0.1)
+            return {"id": 1}
+
+        threads = [threading.Thread(target=cache.get_or_build, args=("api:test", build)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache._locks, {})
+
+
+class SQLiteCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = get_cache("movie_crawler.api.cache_backend.SQLiteCache",
+                               LOCATION=os.path.join(self.tmpdir, "cache.sqlite"),
+                               OPTIONS={"MAX_ENTRIES": 10, "CULL_EVERY": 5})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", {"id": 1})
+        self.assertEqual(self.cache.get("a"), {"id": 1})
+        self.assertFalse(self.cache.add("a", 2))
+        self.assertTrue(self.cache.add("b", 2, None))
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]), {"a": {"id": 1}, "b": 2})
+        self.cache.delete("a")
+        self.assertFalse(self.cache.has_key("a"))
+
+    def test_expires(self):
+        self.cache.set("a", 1, -1)
+        self.assertIsNone(self.cache.get("a"))
+        # 过期的条目可以再次add
+        self.assertTrue(self.cache.add("a", 2))
+        self.assertEqual(self.cache.get("a"), 2)
+
+    def test_cull(self):
+        # 不过期的条目(如版本号)同样受MAX_ENTRIES限制，最早写入的先被淘汰
+        self.cache.set_many(dict(("version%d" % i, i) for i in range(10)), None)
+        self.cache.set_many(dict(("key%d" % i, i) for i in range(10)), None)
+        count, = self.cache.conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        # 剩下MAX_ENTRIES的(1 - 1/CULL_FREQUENCY)
+        self.assertEqual(count, 7)
+        self.assertEqual(self.cache.get_many(["version%d" % i for i in range(10)]), {})
@@ -0,0 +1,41 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import unittest
+
+from scrapy.http import Request
+from twisted.internet import defer
+
+from movie_crawler.commands.benchparse import _consume, compare_results
+
+
+class BenchParseTestCase(unittest.TestCase):
+    def test_compare_results(self):
+        baseline = {
+            "douban.parse_review": {"ms_per_page": 10.0},
+            "douban.parse_celebrity": {"ms_per_page": 10.0},
+            "mtime.parse_movie_plots": {"ms_per_page": 10.0},
+        }
+        results = {
+            "douban.parse_review": {"ms_per_page": 13.0},
+            "douban.parse_celebrity": {"ms_per_page": 11.5},
+            "mtime.parse_movie_plots": {"ms_per_page": 5.0},
+            # 基线中没有的回调不比较
+            "mtime.parse_celebrity": {"ms_per_page": 100.0},
+        }
+        self.assertEqual(compare_results(baseline, results, 0.2), [("douban.parse_review", 10.0, 13.0)])
+        self.assertEqual(compare_results(baseline, results, 0.1), [
+            ("douban.parse_celebrity", 10.0, 11.5),
+            ("douban.parse_review", 10.0, 13.0),
+        ])
+
+    def test_consume_deferred(self):
+        consumed = []
+
+        def results():
+            consumed.append(1)
+            yield Request("http://movie.douban.com/subject/1/")
+
+        _consume(defer.succeed(results()))
+        self.assertEqual(consumed, [1])
+        self.assertRaises(RuntimeError, _consume, defer.Deferred())
+        self.assertRaises(ValueError, _consume, defer.fail(ValueError()))
@@ -0,0 +1,133 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+
+from scrapy.http import HtmlResponse, Request
+from scrapy.spider import Spider
+
+from movie_crawler.middlewares.checkpoint import CheckpointMiddleware
+
+
+class CheckpointSpider(Spider):
+    name = "checkpoint"
+
+    def parse(self, response):
+        pass
+
+    def parse_movie(self, response):
+        pass
+
+
+class CheckpointMiddlewareTestCase(unittest.TestCase):
+    def setUp(self):
+        self.checkpoint_dir = tempfile.mkdtemp()
+        self.spider = CheckpointSpider()
+
+    def tearDown(self):
+        shutil.rmtree(self.checkpoint_dir)
+
+    def open(self, **kwargs):
+        kwargs.setdefault("capacity", 1000)
+        middleware = CheckpointMiddleware(self.checkpoint_dir, **kwargs)
+        middleware.open(self.spider)
+        return middleware
+
+    def close(self, middleware, reason="shutdown"):
+        completed = middleware._take_buffers()
+        middleware.store.write(*completed)
+        middleware._written(completed[1])
+        middleware.close(self.spider, reason)
+
+    def response_for(self, request):
+        return HtmlResponse(request.url, body=b"<html></html>", request=request)
+
+    def test_restore(self):
+        middleware = self.open()
+        start = Request("http://movie.douban.com/tag/", dont_filter=True)
+        self.assertEqual(list(middleware.process_start_requests([start], self.spider)), [start])
+
+        movies = [Request("http://movie.douban.com/subject/%d/" % i, callback=self.spider.parse_movie) for i in range(3)]
+        self.assertEqual(list(middleware.process_spider_output(self.response_for(start), movies, self.spider)), movies)
+        list(middleware.process_spider_output(self.response_for(movies[0]), [], self.spider))
+        self.close(middleware)
+
+        # 重启后跳过已完成的请求，重新发出未完成的请求
+        middleware = self.open()
+        requests = list(middleware.process_start_requests([start], self.spider))
+        self.assertEqual(sorted(r.url for r in requests), [movies[1].url, movies[2].url])
+        self.assertEqual(requests[0].callback, self.spider.parse_movie)
+        # 持久化的去重记录中已有这些请求，不能再被调度器过滤
+        self.assertTrue(all(r.dont_filter for r in requests))
+
+        output = list(middleware.process_spider_output(self.response_for(requests[0]), movies, self.spider))
+        self.assertEqual(output, movies[1:])
+        self.close(middleware)
+
+    def test_failed_callback_stays_pending(self):
+        middleware = self.open()
+        request = Request("http://movie.douban.com/subject/1/")
+        list(middleware.process_start_requests([request], self.spider))
+
+        def failing_callback():
+            yield Request("http://movie.douban.com/subject/2/")
+            raise ValueError()
+
+        output = middleware.process_spider_output(self.response_for(request), failing_callback(), self.spider)
+        self.assertRaises(ValueError, list, output)
+        self.close(middleware)
+
+        middleware = self.open()
+        requests = list(middleware.process_start_requests([], self.spider))
+        self.assertEqual(sorted(r.url for r in requests), ["http://movie.douban.com/subject/1/", "http://movie.douban.com/subject/2/"])
+        self.close(middleware)
+
+    def test_unflushed_completed(self):
+        middleware = self.open()
+        request = Request("http://movie.douban.com/subject/1/")
+        list(middleware.process_start_requests([request], self.spider))
+        list(middleware.process_spider_output(self.response_for(request), [], self.spider))
+        # 还没有写入数据库时也会被跳过
+        self.assertEqual(list(middleware.process_start_requests([request], self.spider)), [])
+        self.close(middleware)
+
+        middleware = self.open()
+        self.assertTrue(middleware.is_completed(middleware.store.iter_completed().next()))
+        self.assertFalse(middleware.is_completed("0" * 40))
+        self.close(middleware)
+
+    def test_finished_removes_checkpoint(self):
+        middleware = self.open()
+        request = Request("http://movie.douban.com/tag/", dont_filter=True)
+        list(middleware.process_start_requests([request], self.spider))
+        list(middleware.process_spider_output(self.response_for(request), [], self.spider))
+        filename = middleware.store.filename
+        self.close(middleware, "finished")
+        self.assertFalse(os.path.exists(filename))
+
+        # 下次运行重新开始
+        middleware = self.open()
+        self.assertEqual(list(middleware.process_start_requests([request], self.spider)), [request])
+        self.close(middleware)
+
+    def test_job_and_reset(self):
+        request = Request("http://movie.douban.com/subject/1/")
+        middleware = self.open(job="a")
+        self.assertTrue(middleware.store.filename.endswith("checkpoint.a.sqlite"))
+        list(middleware.process_start_requests([request], self.spider))
+        self.close(middleware)
+
+        # 不同的任务使用不同的检查点
+        middleware = self.open(job="b")
+        self.assertEqual(middleware.pending, set())
+        self.close(middleware)
+
+        middleware = self.open(job="a")
+        self.assertEqual(len(middleware.pending), 1)
+        self.close(middleware)
+
+        middleware = self.open(job="a", reset=True)
+        self.assertEqual(middleware.pending, set())
+        self.close(middleware)
@@ -0,0 +1,19 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import unittest
+
+from movie_crawler.store.columns import get_add_column_sql, get_missing_columns, get_store_models
+from movie_crawler.store.douban.models import Celebrity, Comment
+
+
+class ColumnsTestCase(unittest.TestCase):
+    def test_missing_columns(self):
+        self.assertIn(Comment, get_store_models())
+        # 测试数据库由syncdb按当前模型创建
+        self.assertEqual(get_missing_columns(), [])
+
+    def test_add_column_sql(self):
+        statement = get_add_column_sql(Celebrity, Celebrity._meta.get_field("update_time"))
+        self.assertIn("ALTER TABLE", statement)
+        self.assertIn('"update_time"', statement)
+        self.assertTrue(statement.endswith(" NULL"))
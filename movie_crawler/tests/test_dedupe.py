@@ -0,0 +1,38 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import unittest
+
+from scrapy.http import HtmlResponse, Request
+from scrapy.spider import Spider
+
+from movie_crawler.middlewares.dedupe import EntityDedupeMiddleware
+
+
+class EntityDedupeMiddlewareTestCase(unittest.TestCase):
+    def setUp(self):
+        self.spider = Spider(name="douban_movie")
+        self.middleware = EntityDedupeMiddleware()
+        self.response = HtmlResponse("http://movie.douban.com/tag/", body=b"<html></html>")
+
+    def process(self, urls):
+        requests = [Request(url) for url in urls]
+        return [r.url for r in self.middleware.process_spider_output(self.response, requests, self.spider)]
+
+    def test_process_spider_output(self):
+        urls = self.process([
+            "http://movie.douban.com/subject/1867420/?from=tag",
+            "http://movie.douban.com/subject/1867420",
+            "https://movie.douban.com/subject/1867420/",
+            "http://movie.douban.com/celebrity/1048000/",
+            "http://movie.douban.com/celebrity/1048000/photos/?start=40",
+            "http://movie.douban.com/tag/%E7%88%B1%E6%83%85",
+        ])
+        self.assertEqual(urls, [
+            "http://movie.douban.com/subject/1867420/",
+            "http://movie.douban.com/celebrity/1048000/",
+            "http://movie.douban.com/celebrity/1048000/photos/?start=40",
+            "http://movie.douban.com/tag/%E7%88%B1%E6%83%85",
+        ])
+
+        # 同一次运行中，实体只调度一次
+        self.assertEqual(self.process(["http://movie.douban.com/celebrity/1048000/?from=subject"]), [])
@@ -0,0 +1,72 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+
+from scrapy.http import Request
+from scrapy.settings import Settings
+
+from movie_crawler.dupefilter import BloomDupeFilter
+from movie_crawler.utils.bloom import BloomFilter
+
+
+class BloomFilterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "requests.bloom")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_add(self):
+        bloom = BloomFilter(1000, 0.01)
+        self.assertFalse(bloom.add("a"))
+        self.assertTrue(bloom.add("a"))
+        self.assertIn("a", bloom)
+        self.assertNotIn("b", bloom)
+        self.assertEqual(len(bloom), 1)
+        self.assertGreater(bloom.fill_ratio, 0)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(10000, 0.01)
+        for i in range(10000):
+            bloom.add("seen-%d" % i)
+        false_positives = sum(1 for i in range(10000) if "unseen-%d" % i in bloom)
+        self.assertLess(false_positives, 200)
+        self.assertLess(bloom.false_positive_rate, 0.02)
+
+    def test_persistent(self):
+        bloom = BloomFilter(1000, 0.01, self.path)
+        bloom.add("a")
+        bloom.close()
+
+        # 文件已存在时沿用文件中的参数
+        bloom = BloomFilter(10, 0.5, self.path)
+        self.assertIn("a", bloom)
+        self.assertEqual(len(bloom), 1)
+        self.assertEqual(bloom.num_bits, BloomFilter(1000, 0.01).num_bits)
+        bloom.close()
+
+
+class BloomDupeFilterTestCase(unittest.TestCase):
+    def test_request_seen(self):
+        dupefilter = BloomDupeFilter(capacity=1000, error_rate=0.001)
+        self.assertFalse(dupefilter.request_seen(Request("http://movie.douban.com/subject/1/")))
+        self.assertTrue(dupefilter.request_seen(Request("http://movie.douban.com/subject/1/")))
+        self.assertFalse(dupefilter.request_seen(Request("http://movie.douban.com/subject/2/")))
+        dupefilter.close("finished")
+
+    def test_path_requires_checkpoint(self):
+        path = os.path.join(tempfile.mkdtemp(), "seen.bloom")
+        settings = Settings({"DUPEFILTER_PATH": path, "DUPEFILTER_CAPACITY": 1000})
+        dupefilter = BloomDupeFilter.from_settings(settings)
+        self.assertIsNone(dupefilter.bloom.path)
+        dupefilter.close("finished")
+
+        settings.set("CHECKPOINT_DIR", os.path.dirname(path))
+        dupefilter = BloomDupeFilter.from_settings(settings)
+        self.assertEqual(dupefilter.bloom.path, path)
+        dupefilter.close("finished")
+        shutil.rmtree(os.path.dirname(path))
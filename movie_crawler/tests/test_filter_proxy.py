@@ -0,0 +1,94 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import json
+import os
+import tempfile
+
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+from twisted.web import http, proxy, resource, server
+
+from movie_crawler.filter_proxy import check_proxy, rank, read_candidates, validate, write_results
+
+
+class ProbeResource(resource.Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        return b'ok'
+
+
+class ProxyRequest(proxy.ProxyRequest):
+    def process(self):
+        if self.method == b'CONNECT':
+            self.setResponseCode(405)
+            self.finish()
+        else:
+            proxy.ProxyRequest.process(self)
+
+
+class Proxy(proxy.Proxy):
+    requestFactory = ProxyRequest
+
+
+class ProxyFactory(http.HTTPFactory):
+    protocol = Proxy
+
+
+class FilterProxyTestCase(unittest.TestCase):
+    def setUp(self):
+        # 本地探测页面以及本地HTTP代理(不支持CONNECT)
+        self.site_port = reactor.listenTCP(0, server.Site(ProbeResource()), interface='127.0.0.1')
+        self.proxy_port = reactor.listenTCP(0, ProxyFactory(), interface='127.0.0.1')
+        self.probe_url = 'http://127.0.0.1:%d/' % self.site_port.getHost().port
+        self.proxy = 'http://127.0.0.1:%d' % self.proxy_port.getHost().port
+
+        # 监听后立即关闭，得到一个不可用的端口
+        dead_port = reactor.listenTCP(0, server.Site(ProbeResource()), interface='127.0.0.1')
+        self.dead_proxy = 'http://127.0.0.1:%d' % dead_port.getHost().port
+        return dead_port.stopListening()
+
+    def tearDown(self):
+        return defer.gatherResults([self.site_port.stopListening(), self.proxy_port.stopListening()])
+
+    @defer.inlineCallbacks
+    def test_check_proxy(self):
+        result = yield check_proxy(self.proxy, self.probe_url, timeout=5)
+        self.assertEqual(result['protocols'], ['http'])
+        self.assertIsNotNone(result['latency'])
+        self.assertIsNone(result['https_latency'])
+
+        result = yield check_proxy(self.dead_proxy, self.probe_url, timeout=5)
+        self.assertEqual(result['protocols'], [])
+        self.assertIsNone(result['latency'])
+
+    @defer.inlineCallbacks
+    def test_validate_and_write_results(self):
+        results = yield validate([self.dead_proxy, self.proxy, self.proxy], self.probe_url, concurrency=1, timeout=5)
+        self.assertEqual(len(results), 2)
+
+        tmpdir = tempfile.mkdtemp()
+        list_file = os.path.join(tmpdir, 'proxy_list.txt')
+        meta_file = os.path.join(tmpdir, 'proxy_list.json')
+        write_results(results, list_file, meta_file)
+        with open(list_file) as f:
+            self.assertEqual(f.read().split(), [self.proxy])
+        with open(meta_file) as f:
+            meta = json.load(f)
+        self.assertEqual(meta[0]['rank'], 1)
+        self.assertEqual(meta[0]['proxy'], self.proxy)
+
+    def test_rank(self):
+        results = [
+            {'address': 'https://10.0.0.1:8080', 'protocols': ['http', 'https'], 'http_latency': 2.0},
+            {'address': 'http://10.0.0.2:8080', 'protocols': ['http'], 'http_latency': 1.0},
+            # 只支持CONNECT隧道，无法请求http://页面
+            {'address': 'http://10.0.0.3:8080', 'protocols': ['https'], 'http_latency': None},
+        ]
+        # 保持代理地址原来的协议
+        self.assertEqual([r['proxy'] for r in rank(results)], ['http://10.0.0.2:8080', 'https://10.0.0.1:8080'])
+
+    def test_read_candidates(self):
+        path = os.path.join(os.path.dirname(__file__), '..', 'unfilter_proxy.txt')
+        candidates = read_candidates(path)
+        self.assertIn('https://115.238.164.208:8080', candidates)
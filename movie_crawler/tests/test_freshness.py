@@ -0,0 +1,59 @@
+# coding: utf-8
+from __future__ import unicode_literals
+from datetime import timedelta
+import unittest
+
+from django.utils import timezone
+from django_dynamic_fixture import G
+from scrapy.http import HtmlResponse, Request
+from scrapy.spider import Spider
+
+from movie_crawler.middlewares.freshness import FreshnessMiddleware
+from movie_crawler.store.mtime.models import Movie
+from movie_crawler.utils.entity import Entity, entity_url, parse_entity_url
+
+
+class EntityTestCase(unittest.TestCase):
+    def test_parse_entity_url(self):
+        self.assertEqual(parse_entity_url("https://movie.douban.com/subject/1867420/?from=showing"),
+                         Entity("douban", "movie", 1867420, ""))
+        self.assertEqual(parse_entity_url("http://movie.douban.com/subject/1867420"),
+                         Entity("douban", "movie", 1867420, ""))
+        self.assertEqual(parse_entity_url("http://movie.douban.com/celebrity/1048000/photos/"),
+                         Entity("douban", "celebrity", 1048000, "photos/"))
+        self.assertEqual(parse_entity_url("http://movie.mtime.com/157125/fullcredits.html"),
+                         Entity("mtime", "movie", 157125, "fullcredits.html"))
+        self.assertEqual(parse_entity_url("http://people.mtime.com/914002/"),
+                         Entity("mtime", "celebrity", 914002, ""))
+        self.assertEqual(parse_entity_url("http://movie.douban.com/tag/"), None)
+
+    def test_entity_url(self):
+        self.assertEqual(entity_url(Entity("douban", "review", 6195573, "")), "http://movie.douban.com/review/6195573/")
+        self.assertEqual(entity_url(Entity("mtime", "movie", 157125, "plots.html")), "http://movie.mtime.com/157125/plots.html")
+
+
+class FreshnessMiddlewareTestCase(unittest.TestCase):
+    def setUp(self):
+        self.spider = Spider(name="mtime_movie")
+        self.fresh = G(Movie)
+        self.stale = G(Movie)
+        Movie.objects.filter(pk=self.stale.pk).update(update_time=timezone.now() - timedelta(days=30))
+        self.middleware = FreshnessMiddleware({"movie": 7 * 24 * 3600, "celebrity": 0})
+        self.middleware.load_indexes()
+
+    def test_process_spider_output(self):
+        requests = [
+            Request("http://movie.mtime.com/%d/" % self.fresh.pk),
+            Request("http://movie.mtime.com/%d/" % self.stale.pk),
+            Request("http://movie.mtime.com/%d/plots.html" % self.fresh.pk),
+            Request("http://people.mtime.com/914002/"),
+        ]
+        response = HtmlResponse("http://movie.mtime.com/movie/search/section", body=b"<html></html>")
+        output = list(self.middleware.process_spider_output(response, requests, self.spider))
+        self.assertEqual(output, requests[1:])
+        self.assertEqual(self.middleware.skipped, 1)
+
+    def test_load_indexes(self):
+        # 只载入设置了TTL的实体
+        self.assertEqual(sorted(self.middleware._indexes), [("douban", "movie"), ("mtime", "movie")])
+        self.assertIsNotNone(self.middleware._indexes[("mtime", "movie")].get(self.fresh.pk))
@@ -0,0 +1,70 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from scrapy.http import HtmlResponse, Request
+from scrapy.settings import Settings
+from scrapy.spider import Spider
+
+from movie_crawler.httpcache import SQLiteCacheStorage, TTLRules, compact
+
+
+class SQLiteCacheStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.settings = Settings({
+            "HTTPCACHE_DIR": self.cache_dir,
+            "HTTPCACHE_EXPIRATION_SECS": 0,
+            "HTTPCACHE_TTLS": [(r"/subject/\d+/", 3600)],
+        })
+        self.spider = Spider(name="douban_movie")
+        self.storage = SQLiteCacheStorage(self.settings)
+        self.storage.open_spider(self.spider)
+
+    def tearDown(self):
+        self.storage.close_spider(self.spider)
+        shutil.rmtree(self.cache_dir)
+
+    def store(self, url, body=b"<html><body>douban</body></html>"):
+        request = Request(url)
+        response = HtmlResponse(url, body=body, headers={"Content-Type": "text/html; charset=utf-8"})
+        self.storage.store_response(self.spider, request, response)
+        return request
+
+    def test_store_and_retrieve(self):
+        request = self.store("http://movie.douban.com/subject/1867420/")
+        response = self.storage.retrieve_response(self.spider, request)
+        self.assertIsInstance(response, HtmlResponse)
+        self.assertEqual(response.body, b"<html><body>douban</body></html>")
+        self.assertEqual(response.headers["Content-Type"], b"text/html; charset=utf-8")
+        self.assertIsNone(self.storage.retrieve_response(self.spider, Request("http://movie.douban.com/subject/1/")))
+
+    def test_deduplicate_bodies(self):
+        self.store("http://movie.douban.com/subject/1867420/")
+        self.store("http://movie.douban.com/subject/1867420/?from=tag")
+        count = self.storage.conn.execute("SELECT COUNT(*) FROM bodies").fetchone()[0]
+        self.assertEqual(count, 1)
+
+    def test_ttl(self):
+        subject = self.store("http://movie.douban.com/subject/1867420/")
+        tag = self.store("http://movie.douban.com/tag/", body=b"<html>tag</html>")
+        self.storage.conn.execute("UPDATE responses SET timestamp = ?", (time.time() - 7200,))
+        self.assertIsNone(self.storage.retrieve_response(self.spider, subject))
+        self.assertIsNotNone(self.storage.retrieve_response(self.spider, tag))
+
+        self.storage.conn.commit()
+        self.assertEqual(compact(self.storage.path, TTLRules.from_settings(self.settings)), (1, 1))
+        conn = sqlite3.connect(self.storage.path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0], 1)
+        conn.close()
+
+    def test_ttl_rules(self):
+        rules = TTLRules([(r"/subject/", 10), (r"/celebrity/", 0)], default=5)
+        self.assertEqual(rules.get("http://movie.douban.com/subject/1/"), 10)
+        self.assertEqual(rules.get("http://movie.douban.com/tag/"), 5)
+        self.assertFalse(rules.expired("http://movie.douban.com/celebrity/1/", 0))
+        self.assertTrue(rules.expired("http://movie.douban.com/tag/", 0))
@@ -0,0 +1,30 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import unittest
+
+from movie_crawler.items import douban, mtime
+from movie_crawler.store.indexes import (
+    get_index_sql, get_item_classes, get_missing_indexes, get_required_indexes
+)
+
+
+class IndexesTestCase(unittest.TestCase):
+    def test_required_indexes(self):
+        self.assertIn(douban.CommentItem, get_item_classes())
+        required = dict((item_class, fields) for item_class, _, fields in get_required_indexes())
+        self.assertEqual(required[douban.CommentItem], ("id_movie", "id_comment", "type"))
+        self.assertEqual(required[douban.PhotoItem], ("url",))
+        # 主键及unique_together已经覆盖
+        self.assertNotIn(douban.MovieItem, required)
+        self.assertNotIn(douban.AwardItem, required)
+        self.assertNotIn(mtime.CharacterItem, required)
+
+    def test_missing_indexes(self):
+        # 时光网奖项模型没有award_type字段
+        self.assertEqual([item_class for item_class, _, _ in get_missing_indexes()], [mtime.AwardItem])
+
+    def test_index_sql(self):
+        statements = get_index_sql(douban.CommentItem.django_model, ("id_movie", "id_comment", "type"))
+        self.assertEqual(len(statements), 1)
+        self.assertIn("CREATE INDEX", statements[0])
+        self.assertIn('"id_movie", "id_comment", "type"', statements[0])
@@ -0,0 +1,45 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import threading
+import time
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from movie_crawler.utils.parsepool import ParseError, ParsePool
+
+
+def _unpicklable():
+    return threading.Lock()
+
+
+class ParsePoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pool = ParsePool(2, max_in_flight=1)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_submit(self):
+        d = self.pool.submit(sorted, [3, 1, 2])
+        d.addCallback(self.assertEqual, [1, 2, 3])
+        return d
+
+    def test_error(self):
+        return self.assertFailure(self.pool.submit(int, "x"), ParseError)
+
+    def test_unpicklable_result(self):
+        # 结果无法pickle时同样失败，而不是永远没有结果
+        return self.assertFailure(self.pool.submit(_unpicklable), ParseError)
+
+    def test_unpicklable_argument(self):
+        return self.assertFailure(self.pool.submit(sorted, threading.Lock()), ParseError)
+
+    @defer.inlineCallbacks
+    def test_timeout(self):
+        self.pool.timeout = 0.1
+        yield self.assertFailure(self.pool.submit(time.sleep, 0.5), ParseError)
+        # 超时后释放名额
+        self.pool.timeout = 5
+        result = yield self.pool.submit(sorted, [2, 1])
+        self.assertEqual(result, [1, 2])
@@ -2,12 +2,16 @@
 from __future__ import unicode_literals
 import unittest
 
+from scrapy.signalmanager import SignalManager
 from scrapy.spider import Spider
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
 from django_dynamic_fixture import G
 
 from movie_crawler.store.mtime.models import Movie, Genre
 from movie_crawler.items.mtime import MovieItem
 from movie_crawler.pipelines.save import SavePipeline
+from movie_crawler.signals import item_saved
 
 class PipelineTestCase(unittest.TestCase):
     def setUp(self):
@@ -40,3 +44,112 @@ class PipelineTestCase(unittest.TestCase):
         movie = Movie.objects.get(pk=self.movie.pk)
         self.assertEqual(movie.genres.count(), 1)
         self.assertEqual(movie.genres.all()[0].title, "genre_title")
+
+    def test_process_item_batch_mode(self):
+        pipeline = SavePipeline(batch_size=10)
+        new_movie_id = self.movie.id + 100000
+        pipeline.process_item(item=MovieItem(
+            id=self.movie.id,
+            title="movie_title",
+            genres=[{"title": "genre_title"}]
+        ), spider=self.spider)
+        pipeline.process_item(item=MovieItem(id=new_movie_id, title="new_movie_title"), spider=self.spider)
+        pipeline.process_item(item=MovieItem(id=self.movie.id, rating=9.0, genres=[]), spider=self.spider)
+        self.assertFalse(Movie.objects.filter(pk=new_movie_id).exists())
+
+        pipeline.close_spider(self.spider)
+        movie = Movie.objects.get(pk=self.movie.pk)
+        self.assertEqual(movie.title, "movie_title")
+        self.assertEqual(movie.rating, 9.0)
+        self.assertEqual([genre.title for genre in movie.genres.all()], ["genre_title"])
+        self.assertEqual(Movie.objects.get(pk=new_movie_id).title, "new_movie_title")
+
+    def test_item_saved_after_flush(self):
+        signals = SignalManager()
+        saved = []
+        signals.connect(lambda item: saved.append(item["id"]), signal=item_saved, weak=False)
+        pipeline = SavePipeline(batch_size=10, signals=signals)
+        pipeline.process_item(item=MovieItem(id=self.movie.id, title="movie_title"), spider=self.spider)
+        self.assertEqual(saved, [])
+        pipeline.flush()
+        self.assertEqual(saved, [self.movie.id])
+
+    def test_process_item_dimension_cache(self):
+        pipeline = SavePipeline()
+        pipeline.load_dimension_cache()
+        item = MovieItem(id=self.movie.id, genres=[{"title": self.genre.title}])
+        pipeline.process_item(item=item, spider=self.spider)
+        self.assertIn((Genre, (self.genre.title,)), pipeline._dimension_cache)
+
+        # 缓存命中时不再查询数据库
+        Genre.objects.filter(pk=self.genre.pk).update(title="genre_title_changed")
+        pipeline.process_item(item=item, spider=self.spider)
+        movie = Movie.objects.get(pk=self.movie.pk)
+        self.assertEqual([genre.pk for genre in movie.genres.all()], [self.genre.pk])
+
+    def test_process_item_dimension_cache_rollback(self):
+        class FailingPipeline(SavePipeline):
+            def _save_many_to_many(self, *args):
+                SavePipeline._save_many_to_many(self, *args)
+                raise ValueError()
+
+        pipeline = FailingPipeline()
+        item = MovieItem(id=self.movie.id, genres=[{"title": "rolled_back_genre"}])
+        self.assertRaises(ValueError, pipeline.process_item, item=item, spider=self.spider)
+        self.assertFalse(Genre.objects.filter(title="rolled_back_genre").exists())
+        # 回滚后缓存中不能留下不存在的主键
+        self.assertNotIn((Genre, ("rolled_back_genre",)), pipeline._dimension_cache)
+
+    def test_process_item_m2m_queries_independent_of_relation_count(self):
+        pipeline = SavePipeline()
+
+        def count_queries(genre_count):
+            item = MovieItem(id=self.movie.id, genres=[
+                {"title": "genre_%d_%d" % (genre_count, i)}
+                for i in range(genre_count)
+            ])
+            with CaptureQueriesContext(connections["mtime"]) as context:
+                pipeline.process_item(item=item, spider=self.spider)
+            return len(context)
+
+        self.assertEqual(count_queries(2), count_queries(20))
+        self.assertEqual(Movie.objects.get(pk=self.movie.pk).genres.count(), 20)
+
+    def test_process_item_symmetrical_m2m_fields(self):
+        relative = G(Movie)
+        item = MovieItem(id=self.movie.id, relatives=[{"id": relative.id}])
+        SavePipeline().process_item(item=item, spider=self.spider)
+        self.assertEqual(list(relative.relatives.all()), [self.movie])
+
+        item = MovieItem(id=self.movie.id, relatives=[{"id": self.movie.id + 100000}])
+        SavePipeline().process_item(item=item, spider=self.spider)
+        self.assertEqual(relative.relatives.count(), 0)
+
+    def test_process_item_coalesce_partial_items(self):
+        self.spider.coalesce_parts = {MovieItem: ("base", "plots")}
+        pipeline = SavePipeline()
+
+        base = MovieItem(id=self.movie.id, title="movie_title")
+        base._coalesce_part = "base"
+        pipeline.process_item(item=base, spider=self.spider)
+        self.assertNotEqual(Movie.objects.get(pk=self.movie.pk).title, "movie_title")
+
+        plots = MovieItem(id=self.movie.id, intro="movie_intro")
+        plots._coalesce_part = "plots"
+        pipeline.process_item(item=plots, spider=self.spider)
+        movie = Movie.objects.get(pk=self.movie.pk)
+        self.assertEqual(movie.title, "movie_title")
+        self.assertEqual(movie.intro, "movie_intro")
+
+    def test_process_item_coalesce_normalizes_key(self):
+        self.spider.coalesce_parts = {MovieItem: ("base", "plots")}
+        pipeline = SavePipeline()
+
+        base = MovieItem(id=self.movie.id, title="movie_title")
+        base._coalesce_part = "base"
+        pipeline.process_item(item=base, spider=self.spider)
+        # 不同页面解析出的ID类型不同
+        plots = MovieItem(id="%d" % self.movie.id, intro="movie_intro")
+        plots._coalesce_part = "plots"
+        pipeline.process_item(item=plots, spider=self.spider)
+        self.assertEqual(Movie.objects.get(pk=self.movie.pk).title, "movie_title")
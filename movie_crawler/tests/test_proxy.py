@@ -0,0 +1,121 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import os
+import tempfile
+import time
+import unittest
+
+from scrapy.http import HtmlResponse, Request
+
+from movie_crawler.middlewares.proxy import ProxyMiddleware
+from movie_crawler.spiders.proxy import ProxySpider
+from movie_crawler.utils import ProxyPool, ProxyStore
+
+
+class ProxyPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.proxies = ["http://127.0.0.1:%d" % port for port in range(8000, 8010)]
+        self.pool = ProxyPool(self.proxies, cooldown=60)
+
+    def test_choose(self):
+        self.assertIn(self.pool.choose(), self.proxies)
+        self.assertEqual(ProxyPool().choose(), None)
+
+    def test_choose_prefers_fast_proxies(self):
+        for proxy in self.proxies[1:]:
+            self.pool.record_success(proxy, 10)
+        self.pool.record_success(self.proxies[0], 0.1)
+        chosen = [self.pool.choose() for _ in range(1000)]
+        self.assertGreater(chosen.count(self.proxies[0]), 200)
+
+    def test_record_failure_quarantine(self):
+        proxy = self.proxies[0]
+        self.pool.record_failure(proxy)
+        self.assertNotIn(proxy, self.pool)
+        self.assertEqual(len(self.pool), 9)
+        self.assertEqual(self.pool.quarantined, 1)
+        self.assertTrue(all(self.pool.choose() != proxy for _ in range(100)))
+
+        # 冷却结束后重新可用
+        release_time = time.time() - 1
+        self.pool._states[proxy].release_time = release_time
+        self.pool._quarantine = [(release_time, proxy)]
+        self.pool.choose()
+        self.assertIn(proxy, self.pool)
+
+    def test_all_quarantined(self):
+        for proxy in self.proxies:
+            self.pool.record_failure(proxy)
+        self.assertIn(self.pool.choose(), self.proxies)
+
+    def test_save_and_load(self):
+        self.pool.record_success(self.proxies[0], 0.5)
+        self.pool.record_failure(self.proxies[1])
+        filename = os.path.join(tempfile.mkdtemp(), "scores.json")
+        self.pool.save_file(filename)
+
+        pool = ProxyPool(self.proxies)
+        pool.load_file(filename)
+        self.assertEqual(pool.score(self.proxies[0]), self.pool.score(self.proxies[0]))
+        self.assertNotIn(self.proxies[1], pool)
+
+
+class ProxyStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.meta_file = os.path.join(tmpdir, "proxy_store.json")
+
+    def test_merge(self):
+        store = ProxyStore(self.meta_file)
+        new = store.merge(["http://127.0.0.1:8001", "http://127.0.0.1:8000", "http://127.0.0.1:8001"], now=100)
+        self.assertEqual(new, ["http://127.0.0.1:8001", "http://127.0.0.1:8000"])
+        self.assertEqual(store.get("http://127.0.0.1:8001"), {"first_seen": 100, "last_seen": 100})
+        store.save()
+
+        store = ProxyStore(self.meta_file)
+        self.assertEqual(store.merge(["http://127.0.0.1:8001"], now=200), [])
+        self.assertEqual(store.get("http://127.0.0.1:8001"), {"first_seen": 100, "last_seen": 200})
+        self.assertEqual(ProxyStore.load_addresses(self.meta_file), ["http://127.0.0.1:8000", "http://127.0.0.1:8001"])
+
+    def test_parse_proxy(self):
+        rows = "".join(
+            '<tr><td class="proxy-ipport">%s</td><td class="proxy-type-1">%s</td></tr>' % row
+            for row in [("127.0.0.1:8001", "HTTP"), ("127.0.0.1:8002", "HTTPS"), ("127.0.0.1:x", "HTTP")]
+        )
+        body = '<html><body><table id="result-box-table"><tbody>%s</tbody></table></body></html>' % rows
+        response = HtmlResponse("http://checkerproxy.net/all_proxy", body=body.encode("utf-8"), encoding="utf-8")
+
+        spider = ProxySpider(store_file=self.meta_file)
+        self.assertEqual(list(spider.parse_proxy(response)), [])
+        self.assertIn("http://127.0.0.1:8001", spider.store)
+        self.assertIn("https://127.0.0.1:8002", spider.store)
+        # 端口不合法的行被忽略
+        self.assertEqual(len(spider.store), 2)
+        self.assertNotIn("http://127.0.0.1:x", spider.store)
+
+
+class ProxyMiddlewareTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.proxy_list = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write("http://127.0.0.1:8000\nhttp://127.0.0.1:8001\n")
+        self.middleware = ProxyMiddleware({"PROXY_LIST": self.proxy_list, "PROXY_SCORES_FILE": None})
+
+    def tearDown(self):
+        os.remove(self.proxy_list)
+
+    def test_retry_resets_proxy(self):
+        request = Request("http://movie.douban.com/subject/1/")
+        self.middleware.process_request(request, None)
+        request.meta["proxy_start_time"] -= 100
+
+        # RetryMiddleware复制请求时带着上一次尝试的meta
+        retry = request.copy()
+        self.middleware.process_request(retry, None)
+        self.assertLess(time.time() - retry.meta["proxy_start_time"], 10)
+
+    def test_keep_request_proxy(self):
+        request = Request("http://movie.douban.com/subject/1/", meta={"proxy": "http://10.0.0.1:3128"})
+        self.middleware.process_request(request, None)
+        self.assertEqual(request.meta["proxy"], "http://10.0.0.1:3128")
+        self.assertNotIn("proxy_start_time", request.meta)
@@ -0,0 +1,100 @@
+# coding: utf-8
+from __future__ import unicode_literals
+from datetime import timedelta
+
+from django.utils import timezone
+from django_dynamic_fixture import G
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.spider import Spider
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from movie_crawler.items.mtime import MovieItem
+from movie_crawler.middlewares.revalidation import RevalidationMiddleware
+from movie_crawler.store.mtime.models import Movie
+
+
+class RevalidationMiddlewareTestCase(unittest.TestCase):
+    def setUp(self):
+        self.spider = Spider(name="mtime_movie")
+        self.middleware = RevalidationMiddleware(":memory:")
+        self.movie = G(Movie)
+        Movie.objects.filter(pk=self.movie.pk).update(update_time=timezone.now() - timedelta(days=30))
+        self.url = "http://movie.mtime.com/%d/" % self.movie.pk
+
+    def tearDown(self):
+        return self.middleware.spider_closed(self.spider)
+
+    def crawl(self, url, status=200, body=b"<html>movie</html>", headers=None, meta=None):
+        request = Request(url, meta=meta or {})
+        self.middleware.process_request(request, self.spider)
+        response = HtmlResponse(url, status=status, body=body, headers=headers or {})
+        return request, self.middleware.process_response(request, response, self.spider)
+
+    def save(self):
+        self.middleware.item_saved(MovieItem(id=self.movie.pk))
+
+    @defer.inlineCallbacks
+    def assertTouched(self):
+        # update_time在线程中更新
+        yield defer.DeferredList(list(self.middleware._updates))
+        update_time = Movie.objects.get(pk=self.movie.pk).update_time
+        self.assertTrue(update_time > timezone.now() - timedelta(minutes=1))
+
+    def test_not_modified(self):
+        self.crawl(self.url, headers={"ETag": '"abc"', "Last-Modified": "Sat, 01 Nov 2014 00:00:00 GMT"})
+        self.save()
+        request = Request(self.url + "?from=list")
+        self.middleware.process_request(request, self.spider)
+        self.assertEqual(request.headers["If-None-Match"], b'"abc"')
+        self.assertEqual(request.headers["If-Modified-Since"], b"Sat, 01 Nov 2014 00:00:00 GMT")
+
+        response = Response(request.url, status=304)
+        self.assertRaises(IgnoreRequest, self.middleware.process_response, request, response, self.spider)
+        return self.assertTouched()
+
+    def test_unchanged_body(self):
+        request, response = self.crawl(self.url)
+        self.assertNotIn("If-None-Match", request.headers)
+        self.save()
+        self.assertRaises(IgnoreRequest, self.crawl, self.url)
+        d = self.assertTouched()
+
+        _, response = self.crawl(self.url, body=b"<html>changed</html>")
+        self.assertEqual(response.status, 200)
+        return d
+
+    def test_stored_after_saved(self):
+        # Item没有写入(回调出错、写入失败)时不保存校验信息，下次仍然完整地解析
+        self.crawl(self.url)
+        _, response = self.crawl(self.url)
+        self.assertEqual(response.status, 200)
+        self.assertIsNone(self.middleware.store.get(self.url))
+
+        # 其他实体的Item不影响
+        self.middleware.item_saved(MovieItem(id=self.movie.pk + 1))
+        self.assertIsNone(self.middleware.store.get(self.url))
+        self.save()
+        self.assertIsNotNone(self.middleware.store.get(self.url))
+
+    def test_skip_cached_and_other_pages(self):
+        self.crawl(self.url)
+        self.save()
+        request = Request(self.url)
+        response = HtmlResponse(self.url, body=b"<html>movie</html>", flags=["cached"])
+        self.assertIs(self.middleware.process_response(request, response, self.spider), response)
+
+        url = "http://movie.mtime.com/movie/search/section/"
+        self.crawl(url)
+        self.crawl(url)
+
+    def test_skip_coalesce_parts(self):
+        # 合并Item的部分页面必须解析，否则合并的Item要等到超时才写入
+        url = self.url + "plots.html"
+        meta = {"coalesce_part": "plots"}
+        self.crawl(url, meta=meta)
+        self.save()
+        request, response = self.crawl(url, meta=meta)
+        self.assertEqual(response.status, 200)
+        self.assertNotIn("If-None-Match", request.headers)
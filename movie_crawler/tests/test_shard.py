@@ -0,0 +1,106 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+
+from scrapy.http import HtmlResponse, Request
+from scrapy.settings import Settings
+from scrapy.spider import Spider
+from scrapy.statscol import MemoryStatsCollector
+
+from movie_crawler.frontier import SharedFrontier
+from movie_crawler.middlewares.shard import ShardMiddleware, shard_key
+from movie_crawler.utils import HashRing
+
+
+class HashRingTestCase(unittest.TestCase):
+    def test_get_node(self):
+        keys = ["douban:movie:%d" % i for i in range(1000)]
+        ring = HashRing(range(4))
+        nodes = [ring.get_node(key) for key in keys]
+        self.assertEqual(set(nodes), set(range(4)))
+        self.assertTrue(all(150 < nodes.count(node) < 350 for node in range(4)))
+
+        # 增加一个节点时，大部分key的归属不变
+        moved = sum(1 for key, node in zip(keys, nodes) if HashRing(range(5)).get_node(key) != node)
+        self.assertTrue(moved < 300)
+
+
+class FakeCrawler(object):
+    def __init__(self):
+        self.settings = Settings()
+        self.stats = MemoryStatsCollector(self)
+
+
+class SpiderWithCallback(Spider):
+    name = "douban_movie"
+
+    def parse_movie(self, response):
+        pass
+
+
+class ShardMiddlewareTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "frontier.sqlite")
+        SharedFrontier(self.path).reset(2)
+        self.spider = SpiderWithCallback()
+        self.middlewares = [ShardMiddleware(FakeCrawler(), SharedFrontier(self.path), shard, 2) for shard in range(2)]
+
+    def tearDown(self):
+        for middleware in self.middlewares:
+            middleware.frontier.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_dispatch(self):
+        requests = [
+            Request("http://movie.douban.com/subject/%d/" % i, callback=self.spider.parse_movie)
+            for i in range(20)
+        ]
+        response = HtmlResponse("http://movie.douban.com/tag/", body=b"<html></html>",
+                                request=Request("http://movie.douban.com/tag/"))
+        output = list(self.middlewares[0].process_spider_output(response, requests, self.spider))
+        ring = self.middlewares[0].ring
+        self.assertEqual(output, [r for r in requests if ring.get_node(shard_key(r)) == 0])
+
+        # 另一个进程再次发现同样的电影时不再发出
+        again = [Request("https://movie.douban.com/subject/%d/?from=tag" % i) for i in range(20)]
+        self.assertEqual(self.middlewares[1].dispatch(again, self.spider), [])
+
+        claimed = self.middlewares[1].frontier.claim(1, 100)
+        self.assertEqual(len(claimed), len(requests) - len(output))
+        self.assertFalse(self.middlewares[1].frontier.finished())
+        for shard in range(2):
+            self.middlewares[shard].frontier.set_idle(shard)
+        self.assertTrue(self.middlewares[0].frontier.finished())
+
+    def test_claim_and_complete(self):
+        frontier = self.middlewares[0].frontier
+        frontier.add([("a", 1, b"request-a"), ("b", 1, b"request-b")])
+        claimed = frontier.claim(1, 1)
+        self.assertEqual([data for _, data in claimed], [b"request-a"])
+        # 取走的请求在完成之前保留在队列中，不会被再次取走
+        self.assertEqual([data for _, data in frontier.claim(1, 10)], [b"request-b"])
+        self.assertEqual(frontier.claim(1, 10), [])
+
+        frontier.complete([claimed[0][0]])
+        # 同一分片的进程重启后，未完成的请求重新排队
+        self.assertEqual(frontier.release(1), 1)
+        self.assertEqual([data for _, data in frontier.claim(1, 10)], [b"request-b"])
+
+        # 心跳超时的进程取走的请求重新排队
+        self.assertEqual(frontier.requeue_stale(timeout=60), 0)
+        self.assertEqual(frontier.requeue_stale(timeout=-1), 1)
+
+    def test_complete_after_callback(self):
+        middleware = self.middlewares[1]
+        middleware.frontier.add([("a", 1, b"request-a")])
+        (row_id, _), = middleware.frontier.claim(1, 10)
+        request = Request("http://movie.douban.com/subject/1/", meta={"frontier_id": row_id})
+        response = HtmlResponse(request.url, body=b"<html></html>", request=request)
+        list(middleware.process_spider_output(response, [], self.spider))
+        middleware.complete()
+        self.assertEqual(middleware.frontier.release(1), 0)
+        self.assertEqual(middleware.frontier.claim(1, 10), [])
@@ -0,0 +1,78 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import unittest
+
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+from scrapy.spider import Spider
+from scrapy.statscol import MemoryStatsCollector
+from twisted.internet.error import TimeoutError
+
+from movie_crawler.middlewares.throttle import AdaptiveThrottleMiddleware, AIMDThrottle
+
+
+class AIMDThrottleTestCase(unittest.TestCase):
+    def test_success_and_backoff(self):
+        throttle = AIMDThrottle(start_delay=0.5, max_concurrency=3, window=2, delay_step=0.25)
+        for _ in range(10):
+            throttle.success("movie.douban.com")
+        state = throttle.get("movie.douban.com")
+        self.assertEqual((state.delay, state.concurrency), (0, 3))
+
+        throttle.backoff("movie.douban.com")
+        self.assertEqual((state.delay, state.concurrency), (0, 1))
+        throttle.backoff("movie.douban.com")
+        throttle.backoff("movie.douban.com")
+        self.assertEqual((state.delay, state.concurrency), (0.5, 1))
+        # 其他下载槽不受影响
+        self.assertEqual(throttle.get("api.douban.com").delay, 0.5)
+
+
+class FakeSlot(object):
+    delay = 2
+    concurrency = 8
+
+
+class FakeCrawler(object):
+    def __init__(self):
+        self.settings = Settings()
+        self.stats = MemoryStatsCollector(self)
+        self.engine = self
+        self.downloader = self
+        self.slots = {}
+
+
+class AdaptiveThrottleMiddlewareTestCase(unittest.TestCase):
+    def setUp(self):
+        self.spider = Spider(name="douban_movie")
+        self.crawler = FakeCrawler()
+        self.middleware = AdaptiveThrottleMiddleware(
+            self.crawler, AIMDThrottle(start_delay=1, window=1), [403], [r"sec\.douban\.com"])
+
+    def download(self, status=200, headers=None, proxy="http://127.0.0.1:8080"):
+        request = Request("http://movie.douban.com/subject/1867420/", meta={"proxy": proxy})
+        self.middleware.process_request(request, self.spider)
+        key = request.meta["download_slot"]
+        self.crawler.slots.setdefault(key, FakeSlot())
+        self.middleware.process_response(request, Response(request.url, status=status, headers=headers), self.spider)
+        return self.crawler.slots[key]
+
+    def test_process_response(self):
+        slot = self.download()
+        self.assertEqual(self.crawler.slots.keys(), ["movie.douban.com|http://127.0.0.1:8080"])
+        self.assertEqual((slot.delay, slot.concurrency), (0.75, 1))
+
+        self.download(status=302, headers={"Location": "https://sec.douban.com/a"})
+        self.assertEqual(slot.delay, 1.5)
+        self.download(status=403)
+        self.assertEqual(slot.delay, 3)
+        self.assertEqual(self.download(proxy="http://127.0.0.2:8080").delay, 0.75)
+
+        request = Request("http://movie.douban.com/subject/1867420/", meta={"download_slot": "movie.douban.com"})
+        self.crawler.slots["movie.douban.com"] = FakeSlot()
+        self.middleware.process_exception(request, TimeoutError(), self.spider)
+        self.assertEqual(self.crawler.slots["movie.douban.com"].delay, 2)
+
+        self.middleware.update_stats(self.spider)
+        self.assertEqual(self.crawler.stats.get_value("throttle/backoff"), 3)
+        self.assertEqual(self.crawler.stats.get_value("throttle/slots"), 3)
@@ -0,0 +1,32 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import threading
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from movie_crawler.pipelines.writer import DatabaseWriter
+
+
+class DatabaseWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.writer = DatabaseWriter("douban", 1)
+        self.writer.start()
+
+    def tearDown(self):
+        return self.writer.stop()
+
+    @defer.inlineCallbacks
+    def test_submit_does_not_block_when_full(self):
+        release = threading.Event()
+        first = self.writer.submit(release.wait, 5)
+        # 队列已满，第二个任务等待而不是阻塞reactor线程
+        second = self.writer.submit(lambda: "done")
+        self.assertFalse(second.called)
+        release.set()
+        yield first
+        result = yield second
+        self.assertEqual(result, "done")
+
+    def test_error(self):
+        return self.assertFailure(self.writer.submit(int, "x"), ValueError)
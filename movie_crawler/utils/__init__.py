@@ -1,3 +1,5 @@
-from .datastuctures import DictIgnoreSpace
+from .datastuctures import DictIgnoreSpace, LRUCache
+from .hashring import HashRing
+from .proxypool import ProxyPool, ProxyStore
 
-__all__ = ['DictIgnoreSpace']
+__all__ = ['DictIgnoreSpace', 'HashRing', 'LRUCache', 'ProxyPool', 'ProxyStore']
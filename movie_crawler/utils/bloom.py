@@ -0,0 +1,121 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+
+MAGIC = b'MCBLOOM1'
+# magic, 位数, 哈希函数个数, 已置位的位数, 加入的元素数
+HEADER = struct.Struct(b'<8sQQQQ')
+DATA_OFFSET = 64
+
+
+class BloomFilter(object):
+    """
+    基于mmap的布隆过滤器
+
+    - 按容量`capacity`及误判率`error_rate`确定位数组大小，内存占用固定
+    - 指定`path`时位数组保存在文件中，重启后继续使用，同一台机器上的多个进程
+      可以共用同一个文件(写入时加文件锁)；不指定时使用匿名内存映射
+    - 文件已存在时沿用文件中的参数
+    """
+
+    def __init__(self, capacity, error_rate, path=None):
+        num_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        num_hashes = max(int(round(num_bits / float(capacity) * math.log(2))), 1)
+        self.path = path
+        self._file = None
+
+        if path:
+            exists = os.path.exists(path) and os.path.getsize(path) > DATA_OFFSET
+            self._file = open(path, 'r+b' if exists else 'w+b')
+            if not exists:
+                self._file.write(HEADER.pack(MAGIC, num_bits, num_hashes, 0, 0))
+                self._file.truncate(DATA_OFFSET + (num_bits + 7) // 8)
+                self._file.flush()
+            else:
+                magic, num_bits, num_hashes, _, _ = HEADER.unpack(self._file.read(HEADER.size))
+                if magic != MAGIC:
+                    raise ValueError('%s is not a bloom filter file' % path)
+            self._mm = mmap.mmap(self._file.fileno(), DATA_OFFSET + (num_bits + 7) // 8)
+        else:
+            self._mm = mmap.mmap(-1, DATA_OFFSET + (num_bits + 7) // 8)
+            self._mm[:HEADER.size] = HEADER.pack(MAGIC, num_bits, num_hashes, 0, 0)
+
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+
+    def add(self, key):
+        """
+        加入key，key(可能)已存在时返回True
+        """
+        new_bits = 0
+        with self._locked():
+            for position in self._positions(key):
+                index = DATA_OFFSET + (position >> 3)
+                mask = 1 << (position & 7)
+                value = bytearray(self._mm[index:index + 1])[0]
+                if not value & mask:
+                    self._mm[index:index + 1] = bytes(bytearray([value | mask]))
+                    new_bits += 1
+            if new_bits:
+                magic, num_bits, num_hashes, bits_set, count = self._header()
+                self._mm[:HEADER.size] = HEADER.pack(magic, num_bits, num_hashes, bits_set + new_bits, count + 1)
+        return new_bits == 0
+
+    def __contains__(self, key):
+        for position in self._positions(key):
+            index = DATA_OFFSET + (position >> 3)
+            if not bytearray(self._mm[index:index + 1])[0] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self._header()[4]
+
+    @property
+    def fill_ratio(self):
+        return self._header()[3] / float(self.num_bits)
+
+    @property
+    def false_positive_rate(self):
+        """
+        按当前的置位比例估计的误判率
+        """
+        return self.fill_ratio ** self.num_hashes
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        self._mm.flush()
+        self._mm.close()
+        if self._file:
+            self._file.close()
+
+    def _header(self):
+        return HEADER.unpack(self._mm[:HEADER.size])
+
+    def _positions(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        # 两个哈希值组合出num_hashes个位置(Kirsch-Mitzenmacher)
+        h1, h2 = struct.unpack(b'<QQ', hashlib.md5(key).digest())
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    @contextmanager
+    def _locked(self):
+        if self._file is None:
+            yield
+            return
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,142 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+from urlparse import urlparse
+import Queue
+import threading
+
+from scrapy import log
+
+
+def phantomjs_factory(service_args):
+    from selenium import webdriver
+    return webdriver.PhantomJS(service_args=service_args)
+
+
+def proxy_service_args(proxy):
+    """
+    PhantomJS的代理参数
+    """
+    if not proxy:
+        return []
+    obj = urlparse(proxy)
+    return [
+        '--proxy={}'.format(obj.netloc.strip()),
+        '--proxy-type={}'.format(obj.scheme),
+    ]
+
+
+class Browser(object):
+    """
+    浏览器及其使用的代理
+    """
+
+    def __init__(self, driver, proxy):
+        self.driver = driver
+        self.proxy = proxy
+
+
+class BrowserPool(object):
+    """
+    浏览器池
+
+    - 每个浏览器使用不同的代理，代理从`proxy_middleware`中选择
+    - 预先启动`standby`个备用浏览器，浏览器遇到验证码或超时时，
+      `replace`立即换上备用浏览器，旧浏览器在后台关闭，并在后台补充备用浏览器
+    - `driver_factory(service_args)`创建浏览器驱动，默认为PhantomJS，测试时可替换
+    """
+
+    def __init__(self, proxy_middleware, driver_factory=phantomjs_factory, standby=1, page_load_timeout=30):
+        self.proxy_middleware = proxy_middleware
+        self.driver_factory = driver_factory
+        self.standby = standby
+        self.page_load_timeout = page_load_timeout
+
+        self._standby = Queue.Queue()
+        self._lock = threading.Lock()
+        self._proxies_in_use = set()
+        self._closed = False
+
+    def start(self):
+        for _ in range(self.standby):
+            self._spawn(self._start_standby)
+
+    def acquire(self):
+        """
+        取出一个浏览器，优先使用备用浏览器
+        """
+        try:
+            browser = self._standby.get_nowait()
+        except Queue.Empty:
+            return self._start_browser()
+        self._spawn(self._start_standby)
+        return browser
+
+    def replace(self, browser):
+        """
+        丢弃出错的浏览器，其代理进入冷却期，返回新的浏览器
+        """
+        with self._lock:
+            if browser.proxy:
+                self.proxy_middleware.del_proxy(browser.proxy)
+        self.release(browser)
+        return self.acquire()
+
+    def release(self, browser):
+        with self._lock:
+            self._proxies_in_use.discard(browser.proxy)
+        self._spawn(self._quit, browser)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                browser = self._standby.get_nowait()
+            except Queue.Empty:
+                break
+            self.release(browser)
+
+    def _choose_proxy(self):
+        with self._lock:
+            proxy = None
+            # 尽量避免多个浏览器使用同一个代理
+            for _ in range(10):
+                proxy = self.proxy_middleware.get_random_proxy()
+                if proxy not in self._proxies_in_use:
+                    break
+            self._proxies_in_use.add(proxy)
+            return proxy
+
+    def _start_browser(self):
+        proxy = self._choose_proxy()
+        log.msg("Start browser with proxy [%s]" % proxy)
+        try:
+            driver = self.driver_factory(proxy_service_args(proxy))
+            driver.set_page_load_timeout(self.page_load_timeout)
+        except Exception:
+            with self._lock:
+                self._proxies_in_use.discard(proxy)
+            raise
+        return Browser(driver, proxy)
+
+    def _start_standby(self):
+        try:
+            browser = self._start_browser()
+        except Exception as e:
+            log.msg("Failed to start standby browser [%s]" % e, level=log.ERROR)
+            return
+        if self._closed:
+            self.release(browser)
+        else:
+            self._standby.put(browser)
+
+    def _quit(self, browser):
+        try:
+            browser.driver.quit()
+        except Exception as e:
+            log.msg("Failed to quit browser [%s]" % e, level=log.WARNING)
+
+    def _spawn(self, func, *args):
+        thread = threading.Thread(target=func, args=args)
+        thread.daemon = True
+        thread.start()
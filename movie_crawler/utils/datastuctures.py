@@ -1,6 +1,8 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 
+from collections import OrderedDict
+from threading import Lock
 from UserDict import UserDict  # can't use super, fu*k old style class
 
 
@@ -32,3 +34,44 @@ class DictIgnoreSpace(UserDict):
     def __contains__(self, key):
         key = self._remove_space(key)
         return UserDict.__contains__(self, key)
+
+
+class LRUCache(object):
+    """
+    限定容量的LRU缓存，超出容量时淘汰最久未使用的键，可在多个线程中使用
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
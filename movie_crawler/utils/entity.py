@@ -0,0 +1,64 @@
+# encoding: utf-8
+"""
+URL与实体(站点, 类型, ID)之间的转换
+
+同一个实体可能以多种URL出现(http/https、有无结尾斜杠、带查询参数等)，
+统一解析为Entity后再比较。
+"""
+
+from __future__ import unicode_literals
+
+from collections import namedtuple
+from urlparse import urlparse
+import re
+
+
+Entity = namedtuple('Entity', ['site', 'type', 'id', 'subpage'])
+
+# (站点, 实体类型, 域名, 路径正则)，第一个分组为实体ID，第二个分组为子页面
+ENTITY_URL_PATTERNS = [
+    ('douban', 'movie', 'movie.douban.com', r'^/subject/(\d+)(?:/(.*))?$'),
+    ('douban', 'celebrity', 'movie.douban.com', r'^/celebrity/(\d+)(?:/(.*))?$'),
+    ('douban', 'review', 'movie.douban.com', r'^/review/(\d+)(?:/(.*))?$'),
+    ('mtime', 'movie', 'movie.mtime.com', r'^/(\d+)(?:/(.*))?$'),
+    ('mtime', 'celebrity', 'people.mtime.com', r'^/(\d+)(?:/(.*))?$'),
+]
+
+ENTITY_URLS = {
+    ('douban', 'movie'): 'http://movie.douban.com/subject/%d/',
+    ('douban', 'celebrity'): 'http://movie.douban.com/celebrity/%d/',
+    ('douban', 'review'): 'http://movie.douban.com/review/%d/',
+    ('mtime', 'movie'): 'http://movie.mtime.com/%d/',
+    ('mtime', 'celebrity'): 'http://people.mtime.com/%d/',
+}
+
+_patterns = {}
+for _site, _type, _host, _regex in ENTITY_URL_PATTERNS:
+    _patterns.setdefault(_host, []).append((_site, _type, re.compile(_regex)))
+
+
+def parse_entity_url(url):
+    """
+    解析URL对应的实体，忽略协议、查询参数及锚点，不是实体页面时返回None，
+    例如`https://movie.douban.com/subject/1867420/?from=showing`为
+    Entity('douban', 'movie', 1867420, '')
+    """
+    obj = urlparse(url)
+    host = (obj.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    for site, entity_type, regex in _patterns.get(host, ()):
+        match = regex.match(obj.path)
+        if match:
+            return Entity(site, entity_type, int(match.group(1)), match.group(2) or '')
+    return None
+
+
+def entity_url(entity):
+    """
+    实体主页面的规范URL
+    """
+    url = ENTITY_URLS[(entity.site, entity.type)] % entity.id
+    if entity.subpage:
+        url += entity.subpage
+    return url
@@ -0,0 +1,34 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+from bisect import bisect
+import hashlib
+import struct
+
+
+class HashRing(object):
+    """
+    一致性哈希环
+
+    每个节点在环上放置`replicas`个虚拟节点，key映射到顺时针方向的第一个虚拟节点。
+    节点数变化时只有约1/N的key改变归属，便于调整进程数后继续爬取。
+    """
+
+    def __init__(self, nodes, replicas=100):
+        self.nodes = list(nodes)
+        ring = sorted(
+            (self._hash('%s#%d' % (node, i)), node)
+            for node in self.nodes for i in range(replicas)
+        )
+        self._positions = [position for position, _ in ring]
+        self._nodes = [node for _, node in ring]
+
+    def get_node(self, key):
+        index = bisect(self._positions, self._hash(key))
+        return self._nodes[index % len(self._nodes)]
+
+    @staticmethod
+    def _hash(key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        return struct.unpack(b'<Q', hashlib.md5(key).digest()[:8])[0]
@@ -0,0 +1,141 @@
+# encoding: utf-8
+"""
+基于lxml的BeautifulSoup兼容层
+
+只实现了爬虫中用到的BeautifulSoup接口(find/findAll/find_previous/text/
+attrs/next_sibling等)，查询被编译为XPath在lxml中执行，
+省去了BeautifulSoup在Python中构建文档树的开销。
+"""
+
+from __future__ import unicode_literals
+
+from lxml import etree, html
+
+
+# BeautifulSoup中按空白分隔的多值属性
+MULTI_VALUED_ATTRIBUTES = ('class', 'rel', 'rev', 'accept-charset', 'headers', 'accesskey', 'dropzone')
+
+_xpath_cache = {}
+
+
+def _literal(value):
+    if "'" not in value:
+        return "'%s'" % value
+    return 'concat(%s)' % ", \"'\", ".join("'%s'" % part for part in value.split("'"))
+
+
+def _attr_predicate(name, value):
+    if value is True:
+        return '@%s' % name
+    if name not in MULTI_VALUED_ATTRIBUTES:
+        return '@%s=%s' % (name, _literal(value))
+    if not value:
+        return "not(@%s) or normalize-space(@%s)=''" % (name, name)
+    if ' ' in value:
+        # 与BeautifulSoup相同，包含空格时要求所有值完全一致
+        return 'normalize-space(@%s)=%s' % (name, _literal(' '.join(value.split())))
+    return "contains(concat(' ', normalize-space(@%s), ' '), %s)" % (name, _literal(' %s ' % value))
+
+
+def _compile(template, name, attrs):
+    key = (template, name, tuple(sorted(attrs.items())))
+    if key not in _xpath_cache:
+        predicates = ''.join('[%s]' % _attr_predicate(k, v) for k, v in sorted(attrs.items()))
+        _xpath_cache[key] = etree.XPath(template.format(step=(name or '*') + predicates))
+    return _xpath_cache[key]
+
+
+class NavigableString(unicode):
+    """
+    元素之后的文本(lxml中的tail)，记录了所在的位置以便继续获取next_sibling
+    """
+
+    def __new__(cls, value, element):
+        obj = unicode.__new__(cls, value)
+        obj._element = element
+        return obj
+
+    @property
+    def next_sibling(self):
+        return Tag.wrap(self._element.getnext())
+
+
+class Tag(object):
+
+    def __init__(self, element):
+        self._element = element
+
+    @classmethod
+    def wrap(cls, element):
+        return None if element is None else cls(element)
+
+    @property
+    def name(self):
+        return self._element.tag
+
+    @property
+    def text(self):
+        return self._element.text_content()
+
+    @property
+    def attrs(self):
+        attrs = dict(self._element.attrib)
+        for name in MULTI_VALUED_ATTRIBUTES:
+            if name in attrs:
+                attrs[name] = attrs[name].split()
+        return attrs
+
+    @property
+    def next_sibling(self):
+        if self._element.tail:
+            return NavigableString(self._element.tail, self._element)
+        return Tag.wrap(self._element.getnext())
+
+    descendant_xpath = 'descendant::{step}'
+
+    def find(self, name=None, attrs=None, **kwargs):
+        result = self._query(self.descendant_xpath, name, attrs, kwargs)
+        return Tag.wrap(result[0]) if result else None
+
+    def findAll(self, name=None, attrs=None, **kwargs):
+        return [Tag(e) for e in self._query(self.descendant_xpath, name, attrs, kwargs)]
+
+    def find_previous(self, name=None, attrs=None, **kwargs):
+        # BeautifulSoup中前面的元素包括祖先元素，取文档顺序中最近的一个
+        result = self._query('(preceding::{step} | ancestor::{step})[last()]', name, attrs, kwargs)
+        return Tag.wrap(result[0]) if result else None
+
+    def _query(self, template, name, attrs, kwargs):
+        attrs = dict(attrs or {}, **kwargs)
+        return _compile(template, name, attrs)(self._element)
+
+    def __getitem__(self, key):
+        return self.attrs[key]
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+    def __eq__(self, other):
+        return isinstance(other, Tag) and self._element is other._element
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._element)
+
+
+class LxmlSoup(Tag):
+    """
+    文档根节点，与BeautifulSoup一样从整个文档(包括根节点)中查找
+    """
+
+    descendant_xpath = 'descendant-or-self::{step}'
+
+    def __init__(self, body, encoding='utf-8'):
+        parser = html.HTMLParser(encoding=encoding)
+        try:
+            root = html.document_fromstring(body, parser=parser)
+        except etree.ParserError:
+            root = html.document_fromstring('<html></html>')
+        super(LxmlSoup, self).__init__(root)
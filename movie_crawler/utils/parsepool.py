@@ -0,0 +1,105 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+import cPickle as pickle
+import multiprocessing
+import signal
+import traceback
+
+from twisted.internet import defer, reactor
+
+
+class ParseError(Exception):
+    """
+    子进程中解析出错或超时，消息为子进程中的异常堆栈
+    """
+
+
+def _init_worker():
+    # Ctrl-C由主进程处理，子进程随进程池关闭
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _call(data):
+    """
+    在子进程中执行，参数及结果都是pickle后的(func, args)及(是否成功, 值)。
+    Python 2的apply_async没有error_callback，结果无法pickle时callback不会被调用，
+    因此在子进程中pickle结果，出错时同样返回(False, 异常堆栈)
+    """
+    try:
+        func, args = pickle.loads(data)
+        return pickle.dumps((True, func(*args)), pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return pickle.dumps((False, traceback.format_exc()), pickle.HIGHEST_PROTOCOL)
+
+
+class ParsePool(object):
+    """
+    解析进程池
+
+    在子进程中执行CPU密集的解析函数(页面内容 -> 普通的dict/list)，
+    返回Deferred，结果在reactor线程中取得。`func`及参数、返回值需要可以pickle，
+    同时进行的任务不超过`max_in_flight`个，避免页面内容在队列中堆积。
+    任务超过`timeout`秒没有结果时以ParseError失败，释放名额
+    (进程池无法终止单个子进程，卡住的子进程仍然占用一个进程)。
+    """
+
+    def __init__(self, processes, max_in_flight=None, timeout=60):
+        self.processes = processes
+        self.max_in_flight = max_in_flight or processes * 2
+        self.timeout = timeout
+        self._pool = multiprocessing.Pool(processes, initializer=_init_worker)
+        self._semaphore = defer.DeferredSemaphore(self.max_in_flight)
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        `PARSE_POOL_PROCESSES`为0时不使用进程池，返回None
+        """
+        processes = settings.getint('PARSE_POOL_PROCESSES')
+        if not processes:
+            return None
+        return cls(processes, settings.getint('PARSE_POOL_MAX_IN_FLIGHT'),
+                   settings.getfloat('PARSE_POOL_TIMEOUT', 60))
+
+    def submit(self, func, *args):
+        return self._semaphore.run(self._apply, func, args)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def _apply(self, func, args):
+        # 在reactor线程中pickle参数，出错时直接失败，而不是在进程池的任务线程中出错后没有结果
+        try:
+            data = pickle.dumps((func, args), pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return defer.fail(ParseError(traceback.format_exc()))
+
+        d = defer.Deferred()
+        timeout_call = None
+        if self.timeout:
+            timeout_call = reactor.callLater(self.timeout, self._timeout, d, func)
+
+        def done(result):
+            # 在进程池的结果线程中调用
+            reactor.callFromThread(self._fire, d, timeout_call, result)
+
+        self._pool.apply_async(_call, (data,), callback=done)
+        return d
+
+    def _timeout(self, d, func):
+        if not d.called:
+            d.errback(ParseError('%s timed out after %ss' % (getattr(func, '__name__', func), self.timeout)))
+
+    def _fire(self, d, timeout_call, result):
+        if timeout_call is not None and timeout_call.active():
+            timeout_call.cancel()
+        if d.called:
+            # 已经超时
+            return
+        success, value = pickle.loads(result)
+        if success:
+            d.callback(value)
+        else:
+            d.errback(ParseError(value))
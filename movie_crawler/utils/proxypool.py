@@ -0,0 +1,231 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+import heapq
+import json
+import os
+import random
+import threading
+import time
+
+
+class ProxyState(object):
+    """
+    代理的历史表现
+    """
+
+    __slots__ = ('success', 'failure', 'latency', 'consecutive_failures', 'release_time')
+
+    def __init__(self, success=0, failure=0, latency=None, consecutive_failures=0, release_time=0):
+        self.success = success
+        self.failure = failure
+        self.latency = latency
+        self.consecutive_failures = consecutive_failures
+        self.release_time = release_time
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ProxyPool(object):
+    """
+    代理池
+
+    - 可用代理保存在列表中，并维护地址到下标的索引，删除时与末尾元素交换，O(1)
+    - 每次随机抽取`sample_size`个可用代理，按得分(成功率/EWMA延迟)加权选择
+    - 失败的代理进入冷却期，冷却时间随连续失败次数翻倍(不超过`max_cooldown`)，
+      冷却结束后重新可用，而不是永久删除
+    - 下载器(reactor线程)与浏览器线程共用同一个代理池，各方法由锁保护
+    """
+
+    def __init__(self, addresses=(), sample_size=3, cooldown=60, max_cooldown=3600, alpha=0.3):
+        self.sample_size = sample_size
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.alpha = alpha
+
+        self._states = {}
+        self._active = []
+        self._index = {}
+        self._quarantine = []
+        self._lock = threading.RLock()
+        for address in addresses:
+            self.add(address)
+
+    def add(self, address):
+        with self._lock:
+            if address not in self._states:
+                self._states[address] = ProxyState()
+                self._activate(address)
+
+    def remove(self, address):
+        with self._lock:
+            self._deactivate(address)
+            self._states.pop(address, None)
+
+    def choose(self):
+        """
+        选择一个代理，没有可用代理时返回None
+        """
+        with self._lock:
+            return self._choose()
+
+    def _choose(self):
+        self._release(time.time())
+        while not self._active and self._quarantine:
+            # 所有代理都在冷却中，提前启用最先到期的代理
+            self._release(self._quarantine[0][0])
+        if not self._active:
+            return None
+
+        candidates = [random.choice(self._active) for _ in range(self.sample_size)]
+        scores = [self.score(address) for address in candidates]
+        point = random.uniform(0, sum(scores))
+        for address, score in zip(candidates, scores):
+            point -= score
+            if point <= 0:
+                return address
+        return candidates[-1]
+
+    def score(self, address):
+        state = self._states[address]
+        # 平滑后的成功率，没有记录的代理为0.5
+        success_rate = (state.success + 1.0) / (state.success + state.failure + 2.0)
+        return success_rate / (state.latency or 1.0)
+
+    def record_success(self, address, latency):
+        with self._lock:
+            state = self._states.get(address)
+            if state is None:
+                return
+            state.success += 1
+            state.consecutive_failures = 0
+            if state.latency is None:
+                state.latency = latency
+            else:
+                state.latency = self.alpha * latency + (1 - self.alpha) * state.latency
+
+    def record_failure(self, address):
+        with self._lock:
+            state = self._states.get(address)
+            if state is None:
+                return
+            state.failure += 1
+            state.consecutive_failures += 1
+            cooldown = min(self.cooldown * 2 ** (state.consecutive_failures - 1), self.max_cooldown)
+            state.release_time = time.time() + cooldown
+            self._deactivate(address)
+            heapq.heappush(self._quarantine, (state.release_time, address))
+
+    @property
+    def quarantined(self):
+        return len(self._states) - len(self._active)
+
+    def dump(self):
+        with self._lock:
+            return {address: state.to_dict() for address, state in self._states.items()}
+
+    def load(self, data):
+        """
+        载入之前保存的代理表现，只更新已在代理池中的代理
+        """
+        now = time.time()
+        with self._lock:
+            for address, values in data.items():
+                if address not in self._states:
+                    continue
+                state = self._states[address] = ProxyState(**values)
+                if state.release_time > now:
+                    self._deactivate(address)
+                    heapq.heappush(self._quarantine, (state.release_time, address))
+
+    def save_file(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.dump(), f)
+
+    def load_file(self, filename):
+        with open(filename) as f:
+            self.load(json.load(f))
+
+    def _activate(self, address):
+        if address not in self._index:
+            self._index[address] = len(self._active)
+            self._active.append(address)
+
+    def _deactivate(self, address):
+        index = self._index.pop(address, None)
+        if index is None:
+            return
+        last = self._active.pop()
+        if last != address:
+            self._active[index] = last
+            self._index[last] = index
+
+    def _release(self, now):
+        while self._quarantine and self._quarantine[0][0] <= now:
+            release_time, address = heapq.heappop(self._quarantine)
+            state = self._states.get(address)
+            # 冷却期间再次失败的代理，以最新的到期时间为准
+            if state is not None and state.release_time == release_time:
+                self._activate(address)
+
+    def __contains__(self, address):
+        return address in self._index
+
+    def __len__(self):
+        return len(self._active)
+
+
+class ProxyStore(object):
+    """
+    代理仓库
+
+    代理爬虫抓取到的代理(PROTOCOL://IP:PORT)及其首次、最近一次发现的时间，
+    保存在JSON文件中。仓库中的代理都未经验证，由`scrapy checkproxies`
+    验证后才写入ProxyMiddleware使用的代理列表。
+    """
+
+    def __init__(self, meta_file):
+        self.meta_file = meta_file
+        self._meta = {}
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                self._meta = json.load(f)
+
+    @classmethod
+    def load_addresses(cls, meta_file):
+        """
+        仓库中所有代理的地址，文件不存在时为空
+        """
+        return sorted(cls(meta_file)._meta) if meta_file else []
+
+    def merge(self, addresses, now=None):
+        """
+        合并一批代理，返回新代理
+        """
+        now = now or time.time()
+        new = []
+        for address in addresses:
+            meta = self._meta.get(address)
+            if meta is None:
+                meta = self._meta[address] = {'first_seen': now, 'last_seen': now}
+                new.append(address)
+            else:
+                meta['first_seen'] = meta['first_seen'] or now
+                meta['last_seen'] = now
+        return new
+
+    def get(self, address):
+        return self._meta.get(address)
+
+    def save(self):
+        tmp_file = self.meta_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self._meta, f)
+        os.rename(tmp_file, self.meta_file)
+
+    def __contains__(self, address):
+        return address in self._meta
+
+    def __len__(self):
+        return len(self._meta)